@@ -0,0 +1,238 @@
+"""
+Concurrency benchmark: the dev server against ASGI with worker threads.
+
+Starts the app in each --modes server and, while --slow-clients keep running
+an updateCell whose IMPORT_CSV cell is fetched from a deliberately slow local
+upstream (--slow-seconds per response), has --clients clients send the
+Dashboard's currentUser query. Reports the latency and throughput of those
+fast requests, i.e. how much the slow ones hold them up, and on PostgreSQL
+the number of database connections the server had open at the end.
+
+    runserver    manage.py runserver, Django's threaded dev server
+    asgi-plain   manage.py serve with ASGI_WORKER_THREADS=0: Django's default,
+                 a new thread (and database connection) per request
+    asgi         manage.py serve, what docker-compose.yml runs: requests on
+                 the worker threads
+
+    python benchmarks/bench_asgi.py --clients 16 --slow-clients 4
+"""
+import argparse
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import django
+
+# Set up Django environment
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ctf_challenge.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from graphql_jwt.shortcuts import get_token
+from core.models import Workspace, WorkspaceMembership, Spreadsheet
+
+User = get_user_model()
+
+MODES = {
+    'runserver': (['runserver', '--noreload'], {}),
+    'asgi-plain': (['serve', '--log-level', 'warning'], {'ASGI_WORKER_THREADS': '0'}),
+    'asgi': (['serve', '--log-level', 'warning'], {}),
+}
+
+CURRENT_USER = "query CurrentUser { currentUser { id username workspaces { id name } } }"
+
+UPDATE_CELL = """
+mutation UpdateCell($spreadsheetId: UUID!, $row: Int!, $column: Int!, $content: String!) {
+  updateCell(spreadsheetId: $spreadsheetId, row: $row, column: $column, content: $content) {
+    cell { evaluatedContent }
+  }
+}
+"""
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def slow_upstream(seconds):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            time.sleep(seconds)
+            body = b"a,b\n1,2\n"
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/csv')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(('127.0.0.1', free_port()), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def start_server(mode, port):
+    args, env = MODES[mode]
+    if mode == 'runserver':
+        args = args + [f'127.0.0.1:{port}']
+    else:
+        args = args + ['--port', str(port)]
+    process = subprocess.Popen(
+        [sys.executable, 'manage.py'] + args, cwd=BACKEND, env=dict(os.environ, **env),
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=1).read()
+            return process
+        except OSError:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit(f"The {mode} server didn't start.")
+
+
+def graphql(port, token, query, variables=None, timeout=30):
+    request = urllib.request.Request(
+        f'http://127.0.0.1:{port}/graphql',
+        data=json.dumps({'query': query, 'variables': variables or {}}).encode(),
+        headers={'Content-Type': 'application/json', 'Authorization': f'JWT {token}'},
+    )
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        body = json.load(response)
+    if body.get('errors'):
+        raise RuntimeError(body['errors'][0])
+
+
+def open_connections():
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()")
+        # Not counting this one.
+        return cursor.fetchone()[0] - 1
+
+
+def percentile(ordered, fraction):
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def measure(port, token, sheet_id, upstream, args):
+    latencies, errors, slow_done = [], [], [0]
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def slow_client(index):
+        n = 0
+        while not stop.is_set():
+            n += 1
+            url = f'http://127.0.0.1:{upstream.server_port}/slow?{index}-{n}-{time.time()}'
+            try:
+                graphql(port, token, UPDATE_CELL, {
+                    'spreadsheetId': sheet_id, 'row': index, 'column': 0, 'content': f'=IMPORT_CSV("{url}")',
+                })
+                with lock:
+                    slow_done[0] += 1
+            except Exception:
+                pass
+
+    def fast_client():
+        for _ in range(args.requests // args.clients):
+            start = time.perf_counter()
+            try:
+                graphql(port, token, CURRENT_USER)
+            except Exception as e:
+                with lock:
+                    errors.append(repr(e))
+                continue
+            with lock:
+                latencies.append(time.perf_counter() - start)
+
+    slow = [threading.Thread(target=slow_client, args=(i,)) for i in range(args.slow_clients)]
+    for thread in slow:
+        thread.start()
+    # Let the slow requests occupy the server first.
+    time.sleep(min(args.slow_seconds / 2, 1))
+    fast = [threading.Thread(target=fast_client) for _ in range(args.clients)]
+    started = time.perf_counter()
+    for thread in fast:
+        thread.start()
+    for thread in fast:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    connections = open_connections()
+    stop.set()
+    for thread in slow:
+        thread.join()
+
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 1) if seconds is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': len(errors),
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'slow_requests': slow_done[0],
+        'db_connections': connections,
+        'first_error': errors[0] if errors else None,
+    }
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--modes', nargs='+', choices=MODES, default=list(MODES))
+    parser.add_argument('--clients', type=int, default=16, help="Concurrent clients sending fast queries")
+    parser.add_argument('--requests', type=int, default=400, help="Fast queries, across all clients")
+    parser.add_argument('--slow-clients', type=int, default=4, help="Clients keeping slow requests running")
+    parser.add_argument('--slow-seconds', type=float, default=1.0, help="Upstream delay per IMPORT_CSV fetch")
+    args = parser.parse_args(argv)
+
+    upstream = slow_upstream(args.slow_seconds)
+    user = User.objects.create_user(username='bench.asgi', email='bench.asgi@example.com', password='bench')
+    try:
+        workspace = Workspace.objects.create(name='ASGI benchmark', owner=user)
+        WorkspaceMembership.objects.create(user=user, workspace=workspace, role=WorkspaceMembership.Role.ADMIN)
+        sheet = Spreadsheet.objects.create(workspace=workspace, name='ASGI benchmark')
+        token = get_token(user)
+        print(f"{args.clients} clients, {args.requests} fast requests; "
+              f"{args.slow_clients} clients running {args.slow_seconds}s requests")
+        print(f"{'mode':12} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'slow':>6} "
+              f"{'errors':>7} {'db conns':>9}")
+        for mode in args.modes:
+            port = free_port()
+            process = start_server(mode, port)
+            try:
+                result = measure(port, token, str(sheet.id), upstream, args)
+            finally:
+                process.terminate()
+                process.wait(10)
+            print(f"{mode:12} {result['p50_ms']:8.1f} {result['p95_ms']:8.1f} {result['p99_ms']:8.1f} "
+                  f"{result['throughput_rps']:8.1f} {result['slow_requests']:6d} {result['errors']:7d} "
+                  f"{result['db_connections'] if result['db_connections'] is not None else '-':>9}")
+            if result['first_error']:
+                print(f"  first error: {result['first_error']}")
+    finally:
+        user.delete()
+        upstream.shutdown()
+
+
+if __name__ == '__main__':
+    run()
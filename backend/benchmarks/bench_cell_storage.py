@@ -0,0 +1,78 @@
+import os
+import sys
+import time
+
+import django
+
+# Set up Django environment
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ctf_challenge.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from core import storage
+from core.models import CellTile, Spreadsheet, SpreadsheetCell, Workspace
+
+User = get_user_model()
+
+ROWS = 20_000
+COLS = 10
+REPEAT = 5
+
+
+def table_bytes(model):
+    table = model._meta.db_table
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute("SELECT pg_total_relation_size(%s)", [table])
+            return cursor.fetchone()[0]
+        if connection.vendor == 'sqlite':
+            try:
+                cursor.execute(
+                    "SELECT SUM(pgsize) FROM dbstat WHERE name = %s OR name IN "
+                    "(SELECT name FROM sqlite_master WHERE tbl_name = %s AND type = 'index')",
+                    [table, table],
+                )
+                return cursor.fetchone()[0] or 0
+            except Exception:
+                return None
+    return None
+
+
+def timed(fn):
+    best = float('inf')
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def run():
+    owner = User.objects.create_user(username='bench.storage', email='bench.storage@example.com', password='bench')
+    try:
+        workspace = Workspace.objects.create(name='Storage benchmark', owner=owner)
+        writes = {(row, column): f'{row}-{column}' for row in range(ROWS) for column in range(COLS)}
+        print(f"{ROWS * COLS:,} cells per sheet, best of {REPEAT}")
+        for backend, model in ((Spreadsheet.Storage.ROWS, SpreadsheetCell), (Spreadsheet.Storage.TILES, CellTile)):
+            sheet = Spreadsheet.objects.create(workspace=workspace, name=f'bench {backend}', storage=backend)
+            before = table_bytes(model)
+            start = time.perf_counter()
+            storage.write_cells(sheet.id, writes)
+            write_ms = (time.perf_counter() - start) * 1000
+            after = table_bytes(model)
+            size = f"{(after - before) / 1024 / 1024:8.2f} MiB" if before is not None else "     n/a"
+
+            load_ms = timed(lambda: storage.load_cells([sheet.id]))
+            stream_ms = timed(lambda: sum(1 for _ in storage.iter_rows(sheet.id)))
+            window_ms = timed(lambda: storage.cell_window(sheet.id, (5000, 5019), (0, 9)))
+            edit_ms = timed(lambda: storage.write_cell(sheet.id, 5000, 5, 'edited'))
+            print(f"{backend:6} size {size}  bulk write {write_ms:8.1f} ms  full load {load_ms:8.1f} ms  "
+                  f"stream {stream_ms:8.1f} ms  20x10 window {window_ms:6.2f} ms  single write {edit_ms:6.2f} ms")
+    finally:
+        owner.delete()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,50 @@
+import os
+import sys
+import time
+import tracemalloc
+
+import django
+
+# Set up Django environment
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ctf_challenge.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from core import storage
+from core.export_writers import available_formats
+from core.exports import stream_workspace_export
+from core.models import Spreadsheet, Workspace
+
+User = get_user_model()
+
+SHEETS = 2
+ROWS = 20_000
+COLS = 10
+
+
+def run():
+    owner = User.objects.create_user(username='bench.export', email='bench.export@example.com', password='bench')
+    try:
+        workspace = Workspace.objects.create(name='Export benchmark', owner=owner)
+        for index in range(SHEETS):
+            sheet = Spreadsheet.objects.create(workspace=workspace, name=f'bench {index}')
+            storage.write_cells(sheet.id, {
+                (row, column): str(row * column) if column % 2 else f'item {row}-{column}'
+                for row in range(ROWS) for column in range(COLS)
+            })
+        print(f"{SHEETS} sheets x {ROWS * COLS:,} cells")
+        for format in available_formats():
+            tracemalloc.start()
+            start = time.perf_counter()
+            size = sum(len(chunk) for chunk in stream_workspace_export(workspace, format))
+            elapsed = (time.perf_counter() - start) * 1000
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"{format:6} {elapsed:9.1f} ms  {size / 1024 / 1024:8.2f} MiB  peak memory {peak / 1024 / 1024:6.2f} MiB")
+    finally:
+        owner.delete()
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,66 @@
+"""
+CSV import throughput: rows per second through /spreadsheets/<id>/import.
+
+Generates a CSV of --rows rows and --columns columns in memory and posts it
+to a fresh sheet twice (inserting, then overwriting every cell), once per
+cell storage backend.
+
+    python benchmarks/bench_import.py --rows 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import django
+
+# Set up Django environment
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ctf_challenge.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client
+from graphql_jwt.shortcuts import get_token
+from core.models import Workspace, WorkspaceMembership, Spreadsheet
+
+User = get_user_model()
+
+
+def make_csv(rows, columns):
+    return ''.join(
+        ','.join(str(row * columns + column) if column % 3 else f'"item {row}, {column}"' for column in range(columns)) + '\n'
+        for row in range(rows)
+    ).encode('utf-8')
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100_000)
+    parser.add_argument('--columns', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    body = make_csv(args.rows, args.columns)
+    print(f"{args.rows} rows x {args.columns} columns, {len(body) / 1e6:.1f} MB ({connection.vendor})")
+    user = User.objects.create_user(username='bench.import', email='bench.import@example.com', password='bench')
+    try:
+        workspace = Workspace.objects.create(name='Import benchmark', owner=user)
+        WorkspaceMembership.objects.create(user=user, workspace=workspace, role=WorkspaceMembership.Role.ADMIN)
+        client = Client(HTTP_AUTHORIZATION=f'JWT {get_token(user)}')
+        for storage in Spreadsheet.Storage.values:
+            sheet = Spreadsheet.objects.create(workspace=workspace, name=f'Import {storage}', storage=storage)
+            for label in ('insert', 'update'):
+                start = time.perf_counter()
+                response = client.post(f'/spreadsheets/{sheet.id}/import', body, content_type='text/csv')
+                elapsed = time.perf_counter() - start
+                result = response.json()
+                assert response.status_code == 200, result
+                print(f"{storage:6} {label:6} {result['rows_per_second']:10,.0f} rows/s  "
+                      f"{result['cells'] / elapsed:10,.0f} cells/s  ({elapsed:.2f}s)")
+    finally:
+        user.delete()
+
+
+if __name__ == '__main__':
+    run()
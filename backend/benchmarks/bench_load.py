@@ -0,0 +1,273 @@
+"""
+Load benchmark: concurrent clients against the app in-process.
+
+Drives spreadsheetById, updateCell, the Dashboard's currentUser query and
+/export/ with --clients threads, each logged in as its own user from the
+synthetic data (seed_megacrop.py --users N), and reports p50/p95/p99 latency,
+throughput and database queries per request. Results are saved as JSON;
+--compare prints the change against an earlier run. Run it against Postgres:
+SQLite serializes writers, so concurrent updateCells fail with "database is
+locked".
+
+    python seed_megacrop.py --no-megacorp --users 200
+    python benchmarks/bench_load.py --save results/before.json
+    python benchmarks/bench_load.py --compare results/before.json
+"""
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+
+import django
+
+# Set up Django environment
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ctf_challenge.settings')
+django.setup()
+
+from django.conf import settings
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from graphql_jwt.shortcuts import get_token
+from core.models import Spreadsheet, WorkspaceMembership
+
+SCENARIOS = ('spreadsheetById', 'updateCell', 'currentUser', 'export')
+
+# The frontend's operations (frontend/src/pages).
+SPREADSHEET_BY_ID = """
+query SpreadsheetById($id: UUID!, $rowEnd: Int!, $columnEnd: Int!) {
+  spreadsheetById(id: $id) {
+    id
+    name
+    workspace { id name }
+    cells(rowStart: 0, rowEnd: $rowEnd, columnStart: 0, columnEnd: $columnEnd) {
+      id row column content evaluatedContent
+    }
+  }
+}
+"""
+
+UPDATE_CELL = """
+mutation UpdateCell($spreadsheetId: UUID!, $row: Int!, $column: Int!, $content: String!) {
+  updateCell(spreadsheetId: $spreadsheetId, row: $row, column: $column, content: $content) {
+    cell { id content evaluatedContent }
+  }
+}
+"""
+
+CURRENT_USER = """
+query CurrentUser {
+  currentUser {
+    id
+    username
+    workspaces { id name spreadsheets { id name } }
+  }
+}
+"""
+
+
+class Session:
+    """One simulated user: a logged-in client and a sheet they administer."""
+
+    def __init__(self, membership, sheet_id, rng):
+        self.user = membership.user
+        self.workspace_id = membership.workspace_id
+        self.sheet_id = str(sheet_id)
+        self.rng = rng
+        self.client = Client(HTTP_AUTHORIZATION=f'JWT {get_token(self.user)}')
+        # /export/ authenticates with the session, not the JWT.
+        self.client.force_login(self.user)
+
+    def graphql(self, query, variables):
+        response = self.client.post(
+            '/graphql', json.dumps({'query': query, 'variables': variables}), content_type='application/json',
+        )
+        errors = response.json().get('errors')
+        if errors:
+            return errors[0].get('message') if isinstance(errors[0], dict) else str(errors[0])
+        if response.status_code != 200:
+            return f"HTTP {response.status_code}"
+        return None
+
+    def request(self, scenario):
+        """Make one request; returns None, or what went wrong."""
+        if scenario == 'spreadsheetById':
+            return self.graphql(SPREADSHEET_BY_ID, {'id': self.sheet_id, 'rowEnd': 19, 'columnEnd': 9})
+        if scenario == 'updateCell':
+            return self.graphql(UPDATE_CELL, {
+                'spreadsheetId': self.sheet_id, 'row': self.rng.randrange(20), 'column': self.rng.randrange(10),
+                'content': str(self.rng.randrange(100_000)),
+            })
+        if scenario == 'currentUser':
+            return self.graphql(CURRENT_USER, {})
+        if scenario == 'export':
+            response = self.client.get(f'/export/{self.workspace_id}')
+            if response.status_code != 200:
+                return f"HTTP {response.status_code}"
+            # Read the whole archive; streaming responses are produced as they're read.
+            b''.join(response.streaming_content) if response.streaming else response.content
+            return None
+        raise ValueError(f"Unknown scenario: {scenario}")
+
+
+def sessions(prefix, count, seed):
+    memberships = list(
+        WorkspaceMembership.objects
+        .filter(user__username__startswith=f"{prefix}.", role=WorkspaceMembership.Role.ADMIN)
+        .select_related('user').order_by('user__username')[:count]
+    )
+    if len(memberships) < count:
+        raise SystemExit(
+            f"Found {len(memberships)} '{prefix}.' users; seed more with "
+            f"`python seed_megacrop.py --no-megacorp --users {count} --prefix {prefix}`."
+        )
+    sheets = {}
+    for workspace_id, sheet_id in Spreadsheet.objects.filter(
+        workspace_id__in=[m.workspace_id for m in memberships]
+    ).values_list('workspace_id', 'id'):
+        sheets.setdefault(workspace_id, sheet_id)
+    return [
+        Session(membership, sheets[membership.workspace_id], random.Random(seed + index))
+        for index, membership in enumerate(memberships) if membership.workspace_id in sheets
+    ]
+
+
+def percentile(ordered, fraction):
+    # Nearest rank.
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(fraction * len(ordered)) - 1)]
+
+
+def run_scenario(scenario, clients, requests):
+    latencies = []
+    queries = []
+    errors = []
+    first_error = []
+    lock = threading.Lock()
+    barrier = threading.Barrier(len(clients))
+
+    def worker(session, count):
+        local_latencies, local_queries, failures = [], [], []
+        barrier.wait()
+        try:
+            for _ in range(count):
+                with CaptureQueriesContext(connection) as captured:
+                    start = time.perf_counter()
+                    try:
+                        error = session.request(scenario)
+                    except Exception as e:
+                        error = repr(e)
+                    local_latencies.append(time.perf_counter() - start)
+                local_queries.append(len(captured.captured_queries))
+                if error is not None:
+                    failures.append(error)
+        finally:
+            connection.close()
+        with lock:
+            latencies.extend(local_latencies)
+            queries.extend(local_queries)
+            errors.append(len(failures))
+            first_error.extend(failures[:1])
+
+    per_client = max(1, requests // len(clients))
+    threads = [threading.Thread(target=worker, args=(session, per_client)) for session in clients]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    ms = lambda seconds: round(seconds * 1000, 2) if seconds is not None else None
+    return {
+        'requests': len(latencies),
+        'errors': sum(errors),
+        'p50_ms': ms(percentile(latencies, 0.50)),
+        'p95_ms': ms(percentile(latencies, 0.95)),
+        'p99_ms': ms(percentile(latencies, 0.99)),
+        'mean_ms': ms(sum(latencies) / len(latencies)) if latencies else None,
+        'throughput_rps': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else None,
+        'first_error': first_error[0] if first_error else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print(f"\nChange against {baseline.get('git') or 'baseline'} ({baseline.get('timestamp')}):")
+    for scenario, current in results['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(scenario)
+        if not before:
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'queries_per_request'):
+            if before.get(metric) and current.get(metric) is not None:
+                changes.append(f"{metric} {(current[metric] - before[metric]) / before[metric] * 100:+.1f}%")
+        print(f"{scenario:16} " + "  ".join(changes))
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--clients', type=int, default=8, help="Concurrent clients, one user each")
+    parser.add_argument('--requests', type=int, default=400, help="Requests per scenario, across all clients")
+    parser.add_argument('--warmup', type=int, default=2, help="Unmeasured requests per client first")
+    parser.add_argument('--prefix', default='load', help="Username prefix of the seeded users")
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--keep-budget', action='store_true',
+                        help="Keep the per-minute GraphQL cost budget (it throttles a benchmark quickly)")
+    parser.add_argument('--save', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="A saved results file to compare against")
+    args = parser.parse_args(argv)
+
+    if not args.keep_budget:
+        settings.GRAPHQL_COST = dict(getattr(settings, 'GRAPHQL_COST', {}), BUDGET_PER_MINUTE=None)
+    clients = sessions(args.prefix, args.clients, args.seed)
+    results = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git': git_revision(),
+        'database': connection.vendor,
+        'config': {'clients': len(clients), 'requests': args.requests, 'prefix': args.prefix},
+        'scenarios': {},
+    }
+    print(f"{len(clients)} clients, {args.requests} requests per scenario ({connection.vendor})")
+    print(f"{'scenario':16} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>8} {'queries':>8} {'errors':>7}")
+    for scenario in args.scenarios:
+        for session in clients:
+            for _ in range(args.warmup):
+                session.request(scenario)
+        result = results['scenarios'][scenario] = run_scenario(scenario, clients, args.requests)
+        print(f"{scenario:16} {result['p50_ms']:8.1f} {result['p95_ms']:8.1f} {result['p99_ms']:8.1f} "
+              f"{result['throughput_rps']:8.1f} {result['queries_per_request']:8.1f} {result['errors']:7d}")
+        if result['first_error']:
+            print(f"  first error: {result['first_error']}")
+
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nSaved to {args.save}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,75 @@
+import os
+import sys
+import json
+import time
+
+import django
+
+# Set up Django environment
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ctf_challenge.settings')
+django.setup()
+
+from django.contrib.auth import get_user_model
+from django.test import Client
+from graphql_jwt.shortcuts import get_token
+from core.models import Workspace, WorkspaceMembership, Spreadsheet
+
+User = get_user_model()
+
+PASTE_ROWS = 1000
+PASTE_COLS = 10
+SINGLE_SAMPLE = 500
+
+UPDATE_CELL = """
+mutation UpdateCell($spreadsheetId: UUID!, $row: Int!, $column: Int!, $content: String!) {
+    updateCell(spreadsheetId: $spreadsheetId, row: $row, column: $column, content: $content) { cell { id } }
+}
+"""
+
+UPDATE_CELLS = """
+mutation UpdateCells($spreadsheetId: UUID!, $cells: [CellInput!]!) {
+    updateCells(spreadsheetId: $spreadsheetId, cells: $cells) { results { row column } }
+}
+"""
+
+
+def post(client, query, variables):
+    response = client.post('/graphql', json.dumps({'query': query, 'variables': variables}),
+                           content_type='application/json')
+    body = response.json()
+    assert 'errors' not in body, body['errors']
+    return body
+
+
+def run():
+    user = User.objects.create_user(username='bench.paste', email='bench.paste@example.com', password='bench')
+    try:
+        workspace = Workspace.objects.create(name='Paste benchmark', owner=user)
+        WorkspaceMembership.objects.create(user=user, workspace=workspace, role=WorkspaceMembership.Role.ADMIN)
+        sheet = Spreadsheet.objects.create(workspace=workspace, name='Paste benchmark')
+        client = Client(HTTP_AUTHORIZATION=f'JWT {get_token(user)}')
+        sheet_id = str(sheet.id)
+
+        start = time.perf_counter()
+        for i in range(SINGLE_SAMPLE):
+            post(client, UPDATE_CELL, {'spreadsheetId': sheet_id, 'row': i, 'column': 0, 'content': str(i)})
+        single = (time.perf_counter() - start) / SINGLE_SAMPLE
+        print(f"updateCell:  {1 / single:9,.0f} cells/s  (10k paste would take ~{single * 10_000:.1f}s)")
+
+        cells = [
+            {'row': row, 'column': column, 'content': f'{row * column}'}
+            for row in range(PASTE_ROWS) for column in range(PASTE_COLS)
+        ]
+        for label in ('insert', 'update'):
+            start = time.perf_counter()
+            post(client, UPDATE_CELLS, {'spreadsheetId': sheet_id, 'cells': cells})
+            elapsed = time.perf_counter() - start
+            print(f"updateCells: {len(cells) / elapsed:9,.0f} cells/s  "
+                  f"(10k paste, {label}: {elapsed:.2f}s)")
+    finally:
+        user.delete()
+
+
+if __name__ == '__main__':
+    run()
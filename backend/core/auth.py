@@ -0,0 +1,132 @@
+"""
+JWT authentication with an in-process token cache.
+
+graphql_jwt verifies the token's signature and loads the user by username on
+every request, which made the user lookup the most frequent statement on the
+database. CachedJSONWebTokenBackend remembers which user each verified token
+belongs to, as a snapshot of the user row, so a repeated token costs a dict
+lookup.
+
+An entry lives until the token expires, and at most
+settings.JWT_USER_CACHE["TTL"] seconds. Saving or deleting a user (which is
+how deactivation and password changes happen) evicts their entries in this
+process (see core/signals.py); other processes see the change once their
+entries expire.
+"""
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from graphql_jwt.backends import JSONWebTokenBackend
+from graphql_jwt.utils import get_credentials, get_payload, get_user_by_payload
+
+DEFAULTS = {
+    'MAX_SIZE': 10000,
+    'TTL': 60,
+}
+
+
+def _options():
+    return dict(DEFAULTS, **getattr(settings, 'JWT_USER_CACHE', {}))
+
+
+class TokenCache:
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        # token -> (expires at, user id, (db, field names, values))
+        self._entries = OrderedDict()
+        self._tokens_by_user = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def get(self, token):
+        """A fresh instance of the token's cached user, or None."""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                return None
+            if entry[0] <= time.time():
+                self._remove(token)
+                return None
+            self._entries.move_to_end(token)
+        db, field_names, values = entry[2]
+        # A new instance per request, so requests can't see each other's changes.
+        return get_user_model().from_db(db, field_names, values)
+
+    def set(self, token, user, expires=None):
+        expires_at = time.time() + self.ttl
+        if expires is not None:
+            expires_at = min(expires_at, expires)
+        fields = [field for field in user._meta.concrete_fields if field.attname in user.__dict__]
+        snapshot = (
+            user._state.db,
+            [field.attname for field in fields],
+            tuple(getattr(user, field.attname) for field in fields),
+        )
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (expires_at, user.pk, snapshot)
+            self._tokens_by_user[user.pk].add(token)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+
+    def evict_user(self, user_id):
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def _remove(self, token):
+        entry = self._entries.pop(token, None)
+        if entry is not None:
+            tokens = self._tokens_by_user[entry[1]]
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[1]]
+
+
+_tokens = None
+_tokens_lock = threading.Lock()
+
+
+def get_token_cache():
+    global _tokens
+    with _tokens_lock:
+        if _tokens is None:
+            options = _options()
+            _tokens = TokenCache(options['MAX_SIZE'], options['TTL'])
+        return _tokens
+
+
+def user_for_token(token, context=None):
+    """
+    The user a token belongs to, or None if they no longer exist. Raises
+    JSONWebTokenError for invalid or expired tokens and disabled users, as
+    graphql_jwt's get_user_by_token does.
+    """
+    tokens = get_token_cache()
+    user = tokens.get(token)
+    if user is not None:
+        return user
+    payload = get_payload(token, context)
+    user = get_user_by_payload(payload)
+    if user is not None:
+        tokens.set(token, user, payload.get('exp'))
+    return user
+
+
+class CachedJSONWebTokenBackend(JSONWebTokenBackend):
+    def authenticate(self, request=None, **kwargs):
+        if request is None or getattr(request, '_jwt_token_auth', False):
+            return None
+        token = get_credentials(request, **kwargs)
+        if token is None:
+            return None
+        return user_for_token(token, request)
+
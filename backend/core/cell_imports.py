@@ -0,0 +1,293 @@
+"""
+Bulk CSV/TSV import into a spreadsheet.
+
+The upload is read as a stream and parsed a row at a time; non-empty fields
+become cells, positioned from an origin cell. Rows are collected into chunks
+of about CHUNK_CELLS cells and each chunk is written before the next is read,
+so memory use depends on the chunk size, not on the size of the file.
+
+The whole import is one write: one transaction and one sheet revision, like
+UpdateCells. On PostgreSQL, row-storage sheets are loaded with COPY into a
+temporary staging table and upserted from it in a single statement at the
+end; other databases upsert each chunk with executemany. Tile-storage sheets
+write each chunk through the storage backend.
+"""
+import csv
+import io
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models.constants import OnConflict
+
+from . import engine, references, revisions, storage
+from .models import Spreadsheet, SpreadsheetCell
+from .schema import publish_cell_changes
+
+DEFAULTS = {
+    # Cells written per chunk.
+    'CHUNK_CELLS': 20000,
+    'MAX_ROWS': 1_000_000,
+    'MAX_COLUMNS': 1000,
+    # Use COPY on PostgreSQL.
+    'COPY': True,
+}
+
+DELIMITERS = {'csv': ',', 'tsv': '\t'}
+CONTENT_TYPES = {'text/csv': 'csv', 'text/tab-separated-values': 'tsv'}
+READ_SIZE = 64 * 1024
+
+
+def _options():
+    return dict(DEFAULTS, **getattr(settings, 'CELL_IMPORT', {}))
+
+
+class CellImportError(Exception):
+    pass
+
+
+class ImportResult:
+    def __init__(self, revision=None):
+        self.revision = revision
+        self.rows = 0
+        self.cells = 0
+        self.seconds = 0.0
+
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else None
+
+    def as_dict(self):
+        return {
+            'revision': self.revision,
+            'rows': self.rows,
+            'cells': self.cells,
+            'seconds': round(self.seconds, 3),
+            'rows_per_second': round(self.rows_per_second, 1) if self.rows_per_second else None,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Reading
+# ---------------------------------------------------------------------------
+
+def resolve_format(format=None, content_type=None, filename=None):
+    """'csv' or 'tsv', from an explicit format, the upload's content type or its name."""
+    if format:
+        if format.lower() not in DELIMITERS:
+            raise CellImportError(f"Unknown import format: {format}. Use one of {', '.join(DELIMITERS)}.")
+        return format.lower()
+    if content_type:
+        found = CONTENT_TYPES.get(content_type.split(';')[0].strip().lower())
+        if found:
+            return found
+    if filename and filename.lower().endswith(('.tsv', '.tab')):
+        return 'tsv'
+    return 'csv'
+
+
+class _RawReader(io.RawIOBase):
+    # Adapts anything with read(n), such as an HttpRequest or an uploaded file.
+    def __init__(self, source):
+        self.source = source
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.source.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def text_stream(source):
+    """Decode a binary upload as UTF-8 text (dropping a BOM), READ_SIZE bytes at a time."""
+    return io.TextIOWrapper(
+        io.BufferedReader(_RawReader(source), READ_SIZE), encoding='utf-8-sig', newline='',
+    )
+
+
+def read_rows(stream, format='csv'):
+    """Yield the rows of a CSV or TSV text stream as lists of fields."""
+    reader = csv.reader(stream, delimiter=DELIMITERS[format])
+    try:
+        yield from reader
+    except csv.Error as e:
+        raise CellImportError(f"Line {reader.line_num}: {e}")
+    except UnicodeDecodeError:
+        raise CellImportError(f"Line {reader.line_num + 1}: the file is not UTF-8 text.")
+
+
+def _chunks(rows, origin, options):
+    # Yield ({(row, column): content}, rows read) of about CHUNK_CELLS cells.
+    first_row, first_column = origin
+    writes, count = {}, 0
+    for offset, fields in enumerate(rows):
+        if offset >= options['MAX_ROWS']:
+            raise CellImportError(f"At most {options['MAX_ROWS']} rows can be imported at once.")
+        if len(fields) > options['MAX_COLUMNS']:
+            raise CellImportError(f"Row {offset + 1} has more than {options['MAX_COLUMNS']} columns.")
+        if first_row + offset >= settings.SHEET_MAX_ROWS or first_column + len(fields) > settings.SHEET_MAX_COLUMNS:
+            raise CellImportError(f"Row {offset + 1} doesn't fit in the sheet from the given row and column.")
+        for column, content in enumerate(fields):
+            if content:
+                writes[(first_row + offset, first_column + column)] = content
+        count += 1
+        if len(writes) >= options['CHUNK_CELLS']:
+            yield writes, count
+            writes, count = {}, 0
+    if writes or count:
+        yield writes, count
+
+
+# ---------------------------------------------------------------------------
+# Writing
+# ---------------------------------------------------------------------------
+
+class BatchWriter:
+    """Tile storage: each chunk goes through the storage backend's upsert."""
+
+    def __init__(self, spreadsheet_id, revision):
+        self.spreadsheet_id = spreadsheet_id
+        self.revision = revision
+        self.store = storage.store_for(spreadsheet_id)
+
+    def write(self, writes):
+        self.store.write_cells(self.spreadsheet_id, writes, self.revision)
+
+    def finish(self):
+        pass
+
+
+def _cell_columns():
+    meta = SpreadsheetCell._meta
+    return [meta.get_field(name) for name in ('id', 'spreadsheet', 'row', 'column', 'content', 'revision')]
+
+
+class UpsertWriter:
+    """
+    Row storage on other databases: each chunk is upserted with executemany,
+    skipping the model instances and per-row SQL compilation of bulk_create.
+    """
+
+    def __init__(self, spreadsheet_id, revision):
+        self.revision = revision
+        _, spreadsheet, row, column, content, revision_field = fields = _cell_columns()
+        # What UUIDField.get_db_prep_value does, without its cost per row.
+        self.native_uuid = connection.features.has_native_uuid_field
+        self.spreadsheet = spreadsheet.get_db_prep_value(spreadsheet_id, connection)
+        quote = connection.ops.quote_name
+        conflict = connection.ops.on_conflict_suffix_sql(
+            fields, OnConflict.UPDATE, [content.column, revision_field.column],
+            [spreadsheet.column, row.column, column.column],
+        )
+        self.sql = (
+            f"INSERT INTO {quote(SpreadsheetCell._meta.db_table)} "
+            f"({', '.join(quote(field.column) for field in fields)}) "
+            f"VALUES ({', '.join(['%s'] * len(fields))}) {conflict}"
+        )
+
+    def write(self, writes):
+        new_id = uuid.uuid4 if self.native_uuid else (lambda: uuid.uuid4().hex)
+        with connection.cursor() as cursor:
+            cursor.executemany(self.sql, [
+                (new_id(), self.spreadsheet, row, column, content, self.revision)
+                for (row, column), content in writes.items()
+            ])
+
+    def finish(self):
+        pass
+
+
+class CopyWriter:
+    """
+    PostgreSQL and row storage: chunks are COPYed into a temporary staging
+    table, dropped at commit, and upserted into the cells table at the end.
+    """
+    staging = 'core_cell_import'
+
+    def __init__(self, spreadsheet_id, revision):
+        self.spreadsheet_id = spreadsheet_id
+        self.revision = revision
+        quote = connection.ops.quote_name
+        self.columns = ', '.join(quote(name) for name in ('id', 'row', 'column', 'content'))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TEMPORARY TABLE IF NOT EXISTS {quote(self.staging)} "
+                f"(id uuid, {quote('row')} integer, {quote('column')} integer, content text) ON COMMIT DROP"
+            )
+            # Left over from an earlier import in the same transaction.
+            cursor.execute(f"TRUNCATE {quote(self.staging)}")
+
+    def write(self, writes):
+        buffer = io.StringIO()
+        rows = csv.writer(buffer)
+        for (row, column), content in writes.items():
+            rows.writerow((uuid.uuid4(), row, column, content))
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {connection.ops.quote_name(self.staging)} ({self.columns}) FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+
+    def finish(self):
+        quote = connection.ops.quote_name
+        id, spreadsheet, row, column, content, revision = (quote(field.column) for field in _cell_columns())
+        staging = quote(self.staging)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {quote(SpreadsheetCell._meta.db_table)} ({id}, {spreadsheet}, {row}, {column}, {content}, {revision}) "
+                f"SELECT {staging}.id, %s, {staging}.{quote('row')}, {staging}.{quote('column')}, "
+                f"{staging}.content, %s FROM {staging} "
+                f"ON CONFLICT ({spreadsheet}, {row}, {column}) "
+                f"DO UPDATE SET {content} = EXCLUDED.{content}, {revision} = EXCLUDED.{revision}",
+                [self.spreadsheet_id, self.revision],
+            )
+
+
+def _writer(spreadsheet_id, revision):
+    if storage.spreadsheet_storage(spreadsheet_id) != Spreadsheet.Storage.ROWS:
+        return BatchWriter(spreadsheet_id, revision)
+    if connection.vendor == 'postgresql' and _options()['COPY']:
+        return CopyWriter(spreadsheet_id, revision)
+    if connection.features.supports_update_conflicts_with_target:
+        return UpsertWriter(spreadsheet_id, revision)
+    return BatchWriter(spreadsheet_id, revision)
+
+
+def import_cells(spreadsheet_id, stream, format='csv', origin=(0, 0)):
+    """
+    Write the fields of a CSV or TSV text stream as cells, the first field at
+    `origin` (row, column), in one transaction. Empty fields are skipped
+    rather than clearing the cell. Returns an ImportResult.
+    """
+    options = _options()
+    started = time.perf_counter()
+    # Imports no bigger than an updateCells are published to cellChanged in
+    # one batch, as updateCells is.
+    changed = []
+    with transaction.atomic():
+        result = ImportResult(revisions.begin_write(spreadsheet_id))
+        writer = _writer(spreadsheet_id, result.revision)
+        for writes, rows in _chunks(read_rows(stream, format), origin, options):
+            if writes:
+                writer.write(writes)
+                references.record(spreadsheet_id, writes)
+            result.rows += rows
+            result.cells += len(writes)
+            if changed is not None and result.cells <= settings.UPDATE_CELLS_MAX:
+                changed.extend((row, column, content) for (row, column), content in writes.items())
+            else:
+                changed = None
+        writer.finish()
+        if changed:
+            transaction.on_commit(lambda: publish_cell_changes(spreadsheet_id, changed, result.revision))
+        elif changed is None:
+            # Too many cells to push, or to feed the engine: it is rebuilt from
+            # the database when next needed, and subscribers catch up through
+            # changedSince.
+            transaction.on_commit(lambda: engine.evict(spreadsheet_id))
+    result.seconds = time.perf_counter() - started
+    return result
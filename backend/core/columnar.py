@@ -0,0 +1,136 @@
+"""
+Columnar numeric cache used for range aggregation.
+
+Each column holds a float64 array of values indexed by row, plus two masks:
+`numeric` marks rows that hold a number and `error` marks rows whose value is
+an evaluation error. Text and blank cells have neither flag set and hold 0.0,
+so SUM over a slice is a plain array sum.
+
+The arrays only grow to cover a row while at least one in DENSITY of the rows
+they would cover holds a cell. Cells further down are kept in a dict instead,
+so a few far-away cells don't allocate arrays all the way down to them.
+"""
+import numpy as np
+
+# The arrays may be at most this many times longer than the column's cells.
+DENSITY = 8
+INITIAL_CAPACITY = 64
+
+
+class _Column:
+    __slots__ = ('values', 'numeric', 'error', 'present', 'cells', 'sparse')
+
+    def __init__(self):
+        self.values = np.zeros(INITIAL_CAPACITY, dtype=np.float64)
+        self.numeric = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self.error = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self.present = np.zeros(INITIAL_CAPACITY, dtype=bool)
+        self.cells = 0
+        # Rows past the arrays: row -> (value, numeric, error).
+        self.sparse = {}
+
+    def set(self, row, value, numeric, error):
+        if row >= len(self.values):
+            if row not in self.sparse:
+                self.cells += 1
+            self.sparse[row] = (value, numeric, error)
+            capacity = len(self.values)
+            while capacity <= row:
+                capacity *= 2
+            if capacity <= DENSITY * self.cells:
+                self._grow(capacity)
+            return
+        if not self.present[row]:
+            self.present[row] = True
+            self.cells += 1
+        self.values[row] = value
+        self.numeric[row] = numeric
+        self.error[row] = error
+
+    def _grow(self, capacity):
+        for name in ('values', 'numeric', 'error', 'present'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+        for row in [row for row in self.sparse if row < capacity]:
+            self.values[row], self.numeric[row], self.error[row] = self.sparse.pop(row)
+            self.present[row] = True
+
+    def sparse_in(self, r1, r2):
+        return sorted((row, entry) for row, entry in self.sparse.items() if r1 <= row <= r2)
+
+
+class ColumnarSheet:
+    def __init__(self, max_rows=None, max_columns=None):
+        self.max_rows = max_rows
+        self.max_columns = max_columns
+        self._columns = {}
+
+    def contains(self, row, column):
+        """Whether (row, column) lies inside the sheet's bounds."""
+        return (
+            0 <= row and 0 <= column
+            and (self.max_rows is None or row < self.max_rows)
+            and (self.max_columns is None or column < self.max_columns)
+        )
+
+    def set(self, row, column, value, is_error=False):
+        if not self.contains(row, column):
+            raise ValueError(f"Cell ({row}, {column}) is outside the sheet.")
+        col = self._columns.get(column)
+        if col is None:
+            col = self._columns[column] = _Column()
+        if isinstance(value, float) and not is_error:
+            col.set(row, value, True, False)
+        else:
+            col.set(row, 0.0, False, is_error)
+
+    def first_error(self, r1, c1, r2, c2):
+        """Return the (row, column) of the first error in the range, or None."""
+        for column in range(c1, c2 + 1):
+            col = self._columns.get(column)
+            if col is None:
+                continue
+            hits = np.flatnonzero(col.error[r1:r2 + 1])
+            if len(hits):
+                return r1 + int(hits[0]), column
+            for row, (_, _, error) in col.sparse_in(r1, r2):
+                if error:
+                    return row, column
+        return None
+
+    def aggregate(self, r1, c1, r2, c2, extrema=False):
+        """
+        Return (total, count, minimum, maximum) over the numeric cells of the
+        rectangle. Minimum and maximum are only computed when `extrema` is set.
+        """
+        total = 0.0
+        count = 0
+        minimum = maximum = None
+        for column in range(c1, c2 + 1):
+            col = self._columns.get(column)
+            if col is None:
+                continue
+            present = []
+            if r1 < len(col.values):
+                values = col.values[r1:r2 + 1]
+                numeric = col.numeric[r1:r2 + 1]
+                n = int(np.count_nonzero(numeric))
+                if n:
+                    total += float(values.sum())
+                    count += n
+                    if extrema:
+                        present = values[numeric]
+                        present = [float(present.min()), float(present.max())]
+            if col.sparse:
+                far = [value for _, (value, is_numeric, _) in col.sparse_in(r1, r2) if is_numeric]
+                total += sum(far)
+                count += len(far)
+                if extrema:
+                    present.extend(far)
+            if extrema and len(present):
+                lo, hi = min(present), max(present)
+                minimum = lo if minimum is None else min(minimum, lo)
+                maximum = hi if maximum is None else max(maximum, hi)
+        return total, count, minimum, maximum
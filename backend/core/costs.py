@@ -0,0 +1,236 @@
+"""
+Static cost analysis for GraphQL operations.
+
+Before an operation runs, its selection tree is walked against the schema and
+given a cost: every field costs its weight (1 for object fields, 0 for scalars
+unless settings.GRAPHQL_COST["FIELD_WEIGHTS"] says otherwise), and a list
+field multiplies the cost of its children by the number of items it is
+expected to return. Operations over the cost, depth or breadth limits are
+rejected without running; within the limits, each caller has a per-minute
+budget of cost points shared across requests.
+
+Introspection (`__schema`, `__type`) is not counted.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from graphql import (
+    FieldNode, FragmentDefinitionNode, FragmentSpreadNode, GraphQLError, GraphQLList, GraphQLNonNull, InlineFragmentNode,
+    OperationType, get_named_type, get_operation_ast, is_composite_type, value_from_ast_untyped,
+)
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_credentials
+
+from .auth import user_for_token
+
+DEFAULTS = {
+    'MAX_COST': 50000,
+    'MAX_DEPTH': 10,
+    # Most fields one selection set may ask for, aliases and fragments included.
+    'MAX_BREADTH': 100,
+    # Cost points one user (or anonymous IP) may spend per minute; None for no limit.
+    'BUDGET_PER_MINUTE': 500000,
+    # Fields the analyzer will look at before giving up (fragments reused at
+    # many levels can make the tree exponentially large).
+    'MAX_NODES': 10000,
+    'DEFAULT_LIST_SIZE': 20,
+    'FIELD_WEIGHTS': {},
+    'LIST_SIZES': {},
+}
+
+
+def _options():
+    return dict(DEFAULTS, **getattr(settings, 'GRAPHQL_COST', {}))
+
+
+class TooComplex(Exception):
+    pass
+
+
+class QueryCost:
+    def __init__(self):
+        self.cost = 0
+        self.depth = 0
+        self.breadth = 0
+
+    def as_dict(self):
+        return {'requestedQueryCost': self.cost, 'depth': self.depth, 'breadth': self.breadth}
+
+
+def _is_list(type_):
+    while isinstance(type_, GraphQLNonNull):
+        type_ = type_.of_type
+    return isinstance(type_, GraphQLList)
+
+
+def _argument_values(node, variables):
+    return {
+        argument.name.value: value_from_ast_untyped(argument.value, variables)
+        for argument in node.arguments or ()
+    }
+
+
+def _cells_size(arguments, options):
+    # SpreadsheetType.cells: the area of the window when it is bounded, and
+    # never more than a page. Reads of the whole sheet are refused past a page
+    # (see SpreadsheetType.resolve_cells), so they are costed at one; sizing
+    # them by the sheet would count cells before the caller is authorized.
+    limit = settings.CELLS_PAGE_MAX
+    estimate = options['LIST_SIZES'].get('SpreadsheetType.cells', limit)
+    bounds = [arguments.get(name) for name in ('rowStart', 'rowEnd', 'columnStart', 'columnEnd')]
+    if all(isinstance(bound, int) for bound in bounds):
+        row_start, row_end, column_start, column_end = bounds
+        estimate = max(0, row_end - row_start + 1) * max(0, column_end - column_start + 1)
+    if isinstance(arguments.get('first'), int):
+        estimate = min(estimate, arguments['first'])
+    return max(0, min(estimate, limit))
+
+
+# Fields whose size can be estimated from their arguments.
+LIST_SIZE_ESTIMATORS = {
+    'SpreadsheetType.cells': _cells_size,
+}
+
+
+class CostAnalyzer:
+    def __init__(self, schema, document, variables=None, options=None):
+        self.schema = schema
+        self.variables = variables or {}
+        self.options = options or _options()
+        self.fragments = {
+            definition.name.value: definition
+            for definition in document.definitions
+            if isinstance(definition, FragmentDefinitionNode)
+        }
+        self.document = document
+        self.visited = 0
+
+    def analyze(self, operation_name=None):
+        result = QueryCost()
+        operation = get_operation_ast(self.document, operation_name)
+        if operation is None:
+            return result
+        root = {
+            OperationType.QUERY: self.schema.query_type,
+            OperationType.MUTATION: self.schema.mutation_type,
+            OperationType.SUBSCRIPTION: self.schema.subscription_type,
+        }[operation.operation]
+        if root is not None:
+            result.cost = self._selection_cost(operation.selection_set, root, 1, result)
+        return result
+
+    def _fields(self, selection_set, parent_type, seen):
+        # Flatten fragments into (field node, type it is selected on).
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                yield selection, parent_type
+            elif isinstance(selection, InlineFragmentNode):
+                fragment_type = parent_type
+                if selection.type_condition is not None:
+                    fragment_type = self.schema.get_type(selection.type_condition.name.value) or parent_type
+                yield from self._fields(selection.selection_set, fragment_type, seen)
+            elif isinstance(selection, FragmentSpreadNode):
+                name = selection.name.value
+                fragment = self.fragments.get(name)
+                if fragment is None or name in seen:
+                    continue
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value) or parent_type
+                yield from self._fields(fragment.selection_set, fragment_type, seen | {name})
+
+    def _selection_cost(self, selection_set, parent_type, depth, result):
+        fields = list(self._fields(selection_set, parent_type, frozenset()))
+        result.depth = max(result.depth, depth)
+        result.breadth = max(result.breadth, len(fields))
+        self.visited += len(fields)
+        if self.visited > self.options['MAX_NODES']:
+            raise TooComplex()
+        if depth > self.options['MAX_DEPTH']:
+            # Too deep already; don't walk the rest.
+            return 0
+        total = 0
+        for node, field_parent in fields:
+            name = node.name.value
+            if name.startswith('__'):
+                continue
+            field = getattr(field_parent, 'fields', {}).get(name)
+            if field is None:
+                continue
+            key = f"{field_parent.name}.{name}"
+            named_type = get_named_type(field.type)
+            weight = self.options['FIELD_WEIGHTS'].get(key, 1 if is_composite_type(named_type) else 0)
+            size = 1
+            if _is_list(field.type):
+                size = self._list_size(key, node)
+            children = 0
+            if node.selection_set is not None:
+                children = self._selection_cost(node.selection_set, named_type, depth + 1, result)
+            total += weight * size + children * size
+        return total
+
+    def _list_size(self, key, node):
+        arguments = _argument_values(node, self.variables)
+        estimator = LIST_SIZE_ESTIMATORS.get(key)
+        if estimator is not None:
+            return estimator(arguments, self.options)
+        if isinstance(arguments.get('first'), int):
+            return max(0, arguments['first'])
+        return self.options['LIST_SIZES'].get(key, self.options['DEFAULT_LIST_SIZE'])
+
+
+def _spend(identity, cost, budget):
+    """Charge `cost` to the caller's budget for this minute; returns what is left."""
+    key = f"cost:budget:{identity}:{int(time.time() // 60)}"
+    cache.add(key, 0, 60)
+    try:
+        spent = cache.incr(key, cost)
+    except ValueError:
+        # Expired between add and incr.
+        cache.set(key, cost, 60)
+        spent = cost
+    return budget - spent
+
+
+def check(schema, document, operation_name=None, variables=None, identity=None):
+    """
+    Analyze an operation and charge it to `identity`'s budget. Returns
+    (report for the response extensions, GraphQLError or None).
+    """
+    options = _options()
+    try:
+        result = CostAnalyzer(schema, document, variables, options).analyze(operation_name)
+    except TooComplex:
+        return {'maximumQueryCost': options['MAX_COST']}, GraphQLError("Query is too complex to analyze.")
+    report = dict(result.as_dict(), maximumQueryCost=options['MAX_COST'])
+    if result.depth > options['MAX_DEPTH']:
+        return report, GraphQLError(f"Query depth {result.depth} exceeds the limit of {options['MAX_DEPTH']}.")
+    if result.breadth > options['MAX_BREADTH']:
+        return report, GraphQLError(
+            f"Query selects {result.breadth} fields at one level; the limit is {options['MAX_BREADTH']}."
+        )
+    if result.cost > options['MAX_COST']:
+        return report, GraphQLError(f"Query cost {result.cost} exceeds the limit of {options['MAX_COST']}.")
+    budget = options['BUDGET_PER_MINUTE']
+    if budget is not None and identity is not None and result.cost:
+        report['budgetRemaining'] = remaining = _spend(identity, result.cost, budget)
+        if remaining < 0:
+            return report, GraphQLError("Query cost budget exhausted; try again in a minute.")
+    return report, None
+
+
+def request_identity(request):
+    """Who a request's cost is charged to: its user, or its IP when anonymous."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.username}"
+    # JWT users are only authenticated once resolvers run; the token cache
+    # usually names them without a query.
+    token = get_credentials(request)
+    if token:
+        try:
+            user = user_for_token(token, request)
+        except JSONWebTokenError:
+            user = None
+        if user is not None:
+            return f"user:{user.username}"
+    return f"ip:{request.META.get('REMOTE_ADDR', '')}"
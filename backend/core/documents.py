@@ -0,0 +1,144 @@
+"""
+Parsed-document cache and persisted queries.
+
+Parsing and validating an operation costs more CPU than running most of the
+frontend's operations, and the frontend sends the same few query texts over
+and over. get_document keeps the parsed and validated documents of the most
+recently used query texts, keyed by their SHA-256, so each text is parsed and
+validated once per process.
+
+Persisted queries follow Apollo's automatic persisted queries protocol: a
+client sends extensions.persistedQuery.sha256Hash instead of the query text.
+If the server doesn't know the hash it answers PersistedQueryNotFound, and the
+client retries once with both, which registers the text under its hash in the
+shared cache.
+"""
+import hashlib
+import json
+import threading
+from asyncio import ensure_future
+from collections import OrderedDict
+from inspect import isawaitable
+
+from django.conf import settings
+from django.core.cache import cache
+from graphql import GraphQLError, execute, parse, validate
+
+DEFAULTS = {
+    # Parsed documents kept per process.
+    'CACHE_SIZE': 512,
+    'PERSISTED_QUERIES': True,
+    # Seconds a registered query text is kept; None keeps it until evicted.
+    'PERSISTED_QUERY_TIMEOUT': 7 * 24 * 3600,
+}
+
+
+def _options():
+    return dict(DEFAULTS, **getattr(settings, 'GRAPHQL_DOCUMENTS', {}))
+
+
+def query_hash(query):
+    return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+
+# ---------------------------------------------------------------------------
+# Document cache
+# ---------------------------------------------------------------------------
+
+class DocumentCache:
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._documents = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, schema, query):
+        """
+        (document, validation errors) for `query` against `schema`. Raises
+        GraphQLError when the query doesn't parse; those aren't cached.
+        """
+        key = (id(schema), query_hash(query))
+        with self._lock:
+            entry = self._documents.get(key)
+            if entry is not None:
+                self._documents.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        document = parse(query)
+        entry = (document, validate(schema, document))
+        with self._lock:
+            self._documents[key] = entry
+            while len(self._documents) > self.max_size:
+                self._documents.popitem(last=False)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._documents.clear()
+
+
+_documents = None
+_documents_lock = threading.Lock()
+
+
+def get_documents():
+    global _documents
+    with _documents_lock:
+        if _documents is None:
+            _documents = DocumentCache(_options()['CACHE_SIZE'])
+        return _documents
+
+
+def get_document(schema, query):
+    return get_documents().get(schema, query)
+
+
+def execute_document(schema, document, **options):
+    """Run an already validated document synchronously (as graphql_sync does)."""
+    result = execute(schema, document, **options)
+    if isawaitable(result):
+        ensure_future(result).cancel()
+        raise RuntimeError("GraphQL execution failed to complete synchronously.")
+    return result
+
+
+# ---------------------------------------------------------------------------
+# Persisted queries
+# ---------------------------------------------------------------------------
+
+def _persisted_key(digest):
+    return f"graphql:persisted:{digest}"
+
+
+def resolve_query(query, extensions):
+    """
+    The query text of a request given its `query` and `extensions` params,
+    registering or looking up a persisted query when the extensions name one.
+    Raises GraphQLError for the client to act on.
+    """
+    if isinstance(extensions, str):
+        try:
+            extensions = json.loads(extensions)
+        except ValueError:
+            raise GraphQLError("Extensions are invalid JSON.")
+    persisted = extensions.get('persistedQuery') if isinstance(extensions, dict) else None
+    if not isinstance(persisted, dict):
+        return query
+    options = _options()
+    if not options['PERSISTED_QUERIES']:
+        raise GraphQLError("PersistedQueryNotSupported", extensions={'code': 'PERSISTED_QUERY_NOT_SUPPORTED'})
+    digest = persisted.get('sha256Hash')
+    if persisted.get('version') != 1 or not isinstance(digest, str):
+        raise GraphQLError("Unsupported persisted query.")
+    digest = digest.lower()
+    if query:
+        if query_hash(query) != digest:
+            raise GraphQLError("provided sha does not match query")
+        cache.set(_persisted_key(digest), query, options['PERSISTED_QUERY_TIMEOUT'])
+        return query
+    query = cache.get(_persisted_key(digest))
+    if query is None:
+        raise GraphQLError("PersistedQueryNotFound", extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'})
+    return query
@@ -0,0 +1,286 @@
+"""
+Per-spreadsheet evaluation engine.
+
+Each loaded sheet keeps its cell contents, parsed formulas, computed values
+and a dependency graph keyed by (row, column). Formula values are computed
+lazily the first time they are read and cached; an edit only recomputes the
+cells downstream of the edited one. Range functions read from a
+ColumnarSheet kept alongside the values, so they run as array slices.
+"""
+import threading
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+
+from . import storage
+from .columnar import ColumnarSheet
+from .formulas import CYCLE_ERROR, CellError, evaluate, format_value, literal_value, parse_formula
+from .models import Spreadsheet
+
+
+class SheetEngine:
+    def __init__(self, cells=(), revision=0):
+        self.lock = threading.RLock()
+        # The sheet revision (core/revisions.py) the cells are at least as recent as.
+        self.revision = revision
+        self._content = {}
+        self._formulas = {}
+        self._values = {}
+        self.columns = ColumnarSheet(settings.SHEET_MAX_ROWS, settings.SHEET_MAX_COLUMNS)
+        self._formula_rows = defaultdict(set)
+        # Reverse edges: precedent cell -> formula cells that read it directly.
+        self._dependents = defaultdict(set)
+        # Range edges, bucketed by column: col -> {formula cell: [(r1, r2), ...]}
+        self._range_dependents = defaultdict(dict)
+        for row, column, content in cells:
+            # Cells written before the sheet's bounds were enforced are left out.
+            if self.columns.contains(row, column):
+                self._store(row, column, content)
+
+    # --- Graph maintenance ---
+
+    def _store(self, row, column, content):
+        cell = (row, column)
+        self._unlink(cell)
+        self._values.pop(cell, None)
+        if content:
+            self._content[cell] = content
+        else:
+            self._content.pop(cell, None)
+        formula = parse_formula(content)
+        if formula is None:
+            self._set_value(cell, literal_value(content))
+            return
+        # Pending until computed; keep it out of range results meanwhile.
+        self.columns.set(row, column, None)
+        self._formulas[cell] = formula
+        self._formula_rows[column].add(row)
+        for ref in formula.refs:
+            self._dependents[ref].add(cell)
+        for r1, c1, r2, c2 in formula.ranges:
+            for col in range(c1, c2 + 1):
+                self._range_dependents[col].setdefault(cell, []).append((r1, r2))
+
+    def _unlink(self, cell):
+        formula = self._formulas.pop(cell, None)
+        if formula is None:
+            return
+        self._formula_rows[cell[1]].discard(cell[0])
+        for ref in formula.refs:
+            dependents = self._dependents.get(ref)
+            if dependents:
+                dependents.discard(cell)
+        for _, c1, _, c2 in formula.ranges:
+            for col in range(c1, c2 + 1):
+                self._range_dependents[col].pop(cell, None)
+
+    def _direct_dependents(self, cell):
+        row, column = cell
+        found = set(self._dependents.get(cell, ()))
+        for dependent, spans in self._range_dependents.get(column, {}).items():
+            if any(r1 <= row <= r2 for r1, r2 in spans):
+                found.add(dependent)
+        return found
+
+    def _rows_in(self, index, column, r1, r2):
+        rows = index.get(column)
+        if not rows:
+            return []
+        if len(rows) > r2 - r1 + 1:
+            return [r for r in range(r1, r2 + 1) if r in rows]
+        return sorted(r for r in rows if r1 <= r <= r2)
+
+    def _precedents(self, cell):
+        formula = self._formulas[cell]
+        found = [ref for ref in formula.refs if ref in self._formulas]
+        for r1, c1, r2, c2 in formula.ranges:
+            for col in range(c1, c2 + 1):
+                found.extend((row, col) for row in self._rows_in(self._formula_rows, col, r1, r2))
+        return found
+
+    # --- Evaluation ---
+
+    def _set_value(self, cell, value):
+        self._values[cell] = value
+        self.columns.set(cell[0], cell[1], value, isinstance(value, CellError))
+
+    def _lookup(self, row, column):
+        return self._values.get((row, column))
+
+    def _range_aggregate(self, r1, c1, r2, c2, extrema):
+        error_cell = self.columns.first_error(r1, c1, r2, c2)
+        if error_cell is not None:
+            return self._values[error_cell]
+        return self.columns.aggregate(r1, c1, r2, c2, extrema)
+
+    def _compute(self, cell):
+        self._set_value(cell, evaluate(self._formulas[cell].ast, self._lookup, self._range_aggregate))
+
+    def _ensure(self, cell):
+        # Iterative post-order walk so long reference chains cannot exhaust
+        # the Python stack.
+        if cell in self._values:
+            return
+        stack = [cell]
+        on_stack = set()
+        while stack:
+            current = stack[-1]
+            if current in self._values:
+                stack.pop()
+                on_stack.discard(current)
+                continue
+            if current in on_stack:
+                self._compute(current)
+                stack.pop()
+                on_stack.discard(current)
+                continue
+            on_stack.add(current)
+            for precedent in self._precedents(current):
+                if precedent in self._values:
+                    continue
+                if precedent in on_stack:
+                    self._set_value(precedent, CYCLE_ERROR)
+                else:
+                    stack.append(precedent)
+
+    def value(self, row, column):
+        with self.lock:
+            cell = (row, column)
+            if cell in self._formulas:
+                self._ensure(cell)
+            return self._values.get(cell)
+
+    def display(self, row, column):
+        return format_value(self.value(row, column))
+
+    def content(self, row, column):
+        return self._content.get((row, column), '')
+
+    def set_cell(self, row, column, content):
+        """
+        Store new content for a cell and recompute everything downstream of it.
+        Returns the set of cells whose value was recomputed (the edited cell
+        included).
+        """
+        return self.set_cells([(row, column, content)])
+
+    def set_cells(self, cells):
+        """Like set_cell for many (row, column, content) writes at once."""
+        cells = list(cells)
+        with self.lock:
+            for row, column, content in cells:
+                self._store(row, column, content)
+            dirty = self.downstream((row, column) for row, column, _ in cells)
+            for dependent in dirty:
+                if dependent in self._formulas:
+                    self._values.pop(dependent, None)
+            for dependent in dirty:
+                if dependent in self._formulas:
+                    self._ensure(dependent)
+            return dirty
+
+    def downstream(self, cells):
+        """The given (row, column) cells and every cell that depends on them."""
+        with self.lock:
+            dirty = set(cells)
+            frontier = list(dirty)
+            while frontier:
+                for dependent in self._direct_dependents(frontier.pop()):
+                    if dependent not in dirty:
+                        dirty.add(dependent)
+                        frontier.append(dependent)
+            return dirty
+
+
+# --- Registry ---
+#
+# Engines are process-local and built from the database the first time a
+# sheet is evaluated. Writes made in this process go through `cells_updated`
+# to keep them current; writes made by other processes are noticed from the
+# sheet's revision, which readers pass to `get_engine`.
+
+_engines = OrderedDict()
+_engines_lock = threading.Lock()
+
+
+def _max_engines():
+    return getattr(settings, 'FORMULA_ENGINE_MAX_SHEETS', 64)
+
+
+def _stored(spreadsheet_id):
+    # The sheet's revision and storage backend. Engines outlive the request
+    # and are shared by the process, so they are built from the primary, never
+    # from a replica that may lag behind it (see core/routing.py).
+    return Spreadsheet.objects.using(DEFAULT_DB_ALIAS).values_list('revision', 'storage').get(id=spreadsheet_id)
+
+
+def get_engine(spreadsheet_id, revision=None, cells=None):
+    """
+    Return the sheet's engine, building it anew unless the loaded one is at
+    least at `revision`, the sheet revision the caller has seen (the stored
+    one when omitted). `cells` may supply the sheet's (row, column, content)
+    rows as of `revision` when the caller has read them from the primary.
+    """
+    stored = None
+    if revision is None:
+        stored = _stored(spreadsheet_id)
+        revision = stored[0]
+    with _engines_lock:
+        engine = _engines.get(spreadsheet_id)
+        if engine is not None and engine.revision >= revision:
+            _engines.move_to_end(spreadsheet_id)
+            return engine
+    if cells is None:
+        # Read before the cells, so they are at least as recent as it.
+        stored_revision, layout = stored or _stored(spreadsheet_id)
+        revision = max(revision, stored_revision)
+        cells = storage.iter_rows(spreadsheet_id, chunk_size=5000, storage=layout, using=DEFAULT_DB_ALIAS)
+    engine = SheetEngine(cells, revision)
+    with _engines_lock:
+        current = _engines.get(spreadsheet_id)
+        if current is not None and current.revision >= engine.revision:
+            engine = current
+        else:
+            _engines[spreadsheet_id] = engine
+        _engines.move_to_end(spreadsheet_id)
+        while len(_engines) > _max_engines():
+            _engines.popitem(last=False)
+    return engine
+
+
+def peek_engine(spreadsheet_id):
+    with _engines_lock:
+        return _engines.get(spreadsheet_id)
+
+
+def cell_updated(spreadsheet_id, row, column, content, revision):
+    return cells_updated(spreadsheet_id, [(row, column, content)], revision)
+
+
+def cells_updated(spreadsheet_id, cells, revision):
+    """
+    Apply the committed writes of `revision` to the sheet's engine, if it is
+    loaded. Returns the cells whose value changed; empty when the engine isn't
+    loaded.
+    """
+    engine = peek_engine(spreadsheet_id)
+    if engine is None:
+        return set()
+    with engine.lock:
+        if revision == engine.revision + 1:
+            engine.revision = revision
+            return engine.set_cells(cells)
+    if revision > engine.revision:
+        # Revisions in between were written elsewhere; rebuild with them all.
+        engine = get_engine(spreadsheet_id, revision)
+    # The engine already holds these writes (or later ones to the same cells).
+    return engine.downstream((row, column) for row, column, _ in cells)
+
+
+def evict(spreadsheet_id=None):
+    with _engines_lock:
+        if spreadsheet_id is None:
+            _engines.clear()
+        else:
+            _engines.pop(spreadsheet_id, None)
@@ -0,0 +1,237 @@
+"""
+Export formats.
+
+Each writer turns one sheet into one entry of the export archive. Writers get
+the sheet's cells as chunks of (row, column, content) tuples in (row, column)
+order and write each chunk to the entry before taking the next, yielding in
+between so the caller can pass the compressed bytes on.
+
+* txt     - `Cell (r,c): content` lines (the original format)
+* csv     - one `row,column,content` record per cell
+* xlsx    - a single-worksheet workbook with inline strings
+* arrow   - an Arrow IPC stream with row, column and content columns
+            (needs pyarrow)
+* npz     - NumPy arrays per chunk: row.N and column.N (int32), and the
+            content as UTF-8 bytes data.N sliced by offsets.N (int64)
+
+`columnar` picks arrow when pyarrow is installed and npz otherwise.
+"""
+import csv
+import io
+import re
+import zipfile
+from itertools import islice
+from xml.sax.saxutils import escape
+
+import numpy as np
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+CHUNK_SIZE = 2000
+
+
+def chunked(rows, size=CHUNK_SIZE):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class TextWriter:
+    extension = 'txt'
+    compress_type = zipfile.ZIP_DEFLATED
+
+    def write(self, entry, sheet, chunks):
+        entry.write(f"Spreadsheet Name: {sheet.name}\n\n".encode())
+        for chunk in chunks:
+            entry.write("".join(f"Cell ({row},{column}): {content}\n" for row, column, content in chunk).encode())
+            yield
+
+
+class CSVWriter:
+    extension = 'csv'
+    compress_type = zipfile.ZIP_DEFLATED
+
+    def write(self, entry, sheet, chunks):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(('row', 'column', 'content'))
+        for chunk in chunks:
+            writer.writerows(chunk)
+            entry.write(buffer.getvalue().encode())
+            buffer.seek(0)
+            buffer.truncate()
+            yield
+
+
+# --- XLSX ---
+
+_XML_ILLEGAL_RE = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\ufffe\uffff]')
+_XLSX_NUMBER_RE = re.compile(r'-?(0|[1-9]\d*)(\.\d+)?([eE][-+]?\d+)?')
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/>'
+        '</Relationships>'
+    ),
+}
+
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{name}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+
+
+def column_letters(column):
+    letters = ''
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def _xlsx_cell(row, column, content):
+    ref = f"{column_letters(column)}{row + 1}"
+    if _XLSX_NUMBER_RE.fullmatch(content):
+        return f'<c r="{ref}"><v>{content}</v></c>'
+    text = escape(_XML_ILLEGAL_RE.sub('', content))
+    return f'<c r="{ref}" t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_sheet_name(name):
+    # Excel limits sheet names to 31 characters and forbids a few.
+    return escape(re.sub(r'[\[\]:*?/\\]', '_', name)[:31] or 'Sheet1', {'"': '&quot;'})
+
+
+class XLSXWriter:
+    extension = 'xlsx'
+    # The workbook is a zip of its own.
+    compress_type = zipfile.ZIP_STORED
+
+    def write(self, entry, sheet, chunks):
+        with zipfile.ZipFile(entry, 'w', zipfile.ZIP_DEFLATED) as workbook:
+            for name, xml in _XLSX_PARTS.items():
+                workbook.writestr(name, xml)
+            workbook.writestr('xl/workbook.xml', _WORKBOOK.format(name=_xlsx_sheet_name(sheet.name)))
+            with workbook.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as part:
+                part.write(
+                    b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                    b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+                )
+                current_row = None
+                for chunk in chunks:
+                    xml = []
+                    for row, column, content in chunk:
+                        if row != current_row:
+                            if current_row is not None:
+                                xml.append('</row>')
+                            xml.append(f'<row r="{row + 1}">')
+                            current_row = row
+                        xml.append(_xlsx_cell(row, column, content))
+                    part.write(''.join(xml).encode())
+                    yield
+                if current_row is not None:
+                    part.write(b'</row>')
+                part.write(b'</sheetData></worksheet>')
+
+
+# --- Columnar ---
+
+def _columns(chunk):
+    rows, columns, contents = zip(*chunk)
+    return np.array(rows, dtype=np.int32), np.array(columns, dtype=np.int32), contents
+
+
+class ArrowWriter:
+    extension = 'arrow'
+    compress_type = zipfile.ZIP_DEFLATED
+
+    def write(self, entry, sheet, chunks):
+        schema = pa.schema([('row', pa.int32()), ('column', pa.int32()), ('content', pa.string())])
+        writer = pa.ipc.new_stream(entry, schema)
+        for chunk in chunks:
+            rows, columns, contents = _columns(chunk)
+            writer.write_batch(pa.record_batch(
+                [pa.array(rows), pa.array(columns), pa.array(contents, type=pa.string())], schema=schema,
+            ))
+            yield
+        writer.close()
+
+
+class NumPyWriter:
+    extension = 'npz'
+    compress_type = zipfile.ZIP_STORED
+
+    def write(self, entry, sheet, chunks):
+        with zipfile.ZipFile(entry, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for index, chunk in enumerate(chunks):
+                rows, columns, contents = _columns(chunk)
+                encoded = [content.encode() for content in contents]
+                offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+                np.cumsum([len(content) for content in encoded], out=offsets[1:])
+                data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+                for name, array in (('row', rows), ('column', columns), ('offsets', offsets), ('data', data)):
+                    with archive.open(f"{name}.{index}.npy", 'w', force_zip64=True) as member:
+                        np.lib.format.write_array(member, array, allow_pickle=False)
+                yield
+
+
+WRITERS = {
+    'txt': TextWriter,
+    'csv': CSVWriter,
+    'xlsx': XLSXWriter,
+    'arrow': ArrowWriter,
+    'npz': NumPyWriter,
+}
+
+DEFAULT_FORMAT = 'txt'
+
+
+def available_formats():
+    return [name for name in WRITERS if name != 'arrow' or pa is not None]
+
+
+def resolve_format(name):
+    """Map a requested format name to a writer name; raises ValueError."""
+    name = (name or DEFAULT_FORMAT).lower()
+    if name == 'columnar':
+        return 'arrow' if pa is not None else 'npz'
+    if name not in available_formats():
+        raise ValueError(f"Unknown export format: {name}")
+    return name
+
+
+def get_writer(name):
+    return WRITERS[resolve_format(name)]()
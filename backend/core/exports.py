@@ -0,0 +1,229 @@
+"""
+Workspace export.
+
+The archive is produced by a generator: cells are streamed from storage in
+chunks, each sheet's entry is deflated as it is written, and the compressed
+bytes are handed out as soon as zipfile produces them. Memory use depends on
+the chunk size, not on the size of the workspace.
+
+The format of the per-sheet entries is chosen by name; see
+core/export_writers.py. Exports can also run as background jobs on a small thread pool. Finished
+archives are kept on disk under the workspace's revision, so an unchanged
+workspace is only exported once.
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from django.db.models.functions import Lower
+
+from . import storage
+from .export_writers import DEFAULT_FORMAT, chunked, get_writer
+from .models import CellReference, Spreadsheet, Workspace
+from .references import ReferenceIndex
+
+CELL_CHUNK_SIZE = 2000
+
+
+class _ChunkSink:
+    """Write-only file object that collects what zipfile writes to it."""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        chunks, self._chunks = self._chunks, []
+        return chunks
+
+
+def stream_workspace_export(workspace, format=DEFAULT_FORMAT):
+    """Yield the bytes of the workspace's zip archive, with one entry per sheet."""
+    writer = get_writer(format)
+    sink = _ChunkSink()
+    export_log = []
+    resolve = _reference_resolver(workspace)
+    with zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for sheet in Spreadsheet.objects.filter(workspace=workspace).iterator():
+            info = zipfile.ZipInfo(f"{sheet.name.replace(' ', '_')}.{writer.extension}", time.localtime()[:6])
+            info.compress_type = writer.compress_type
+            with zip_file.open(info, "w", force_zip64=True) as entry:
+                rows = storage.iter_rows(sheet.id, chunk_size=CELL_CHUNK_SIZE, storage=sheet.storage)
+                for _ in writer.write(entry, sheet, chunked(rows, CELL_CHUNK_SIZE)):
+                    yield from sink.drain()
+            yield from sink.drain()
+
+            # Cross-sheet references, in cell order
+            for name in sheet.references.order_by('row', 'column').values_list('name', flat=True):
+                export_log.append(_log_reference(workspace, sheet, name, resolve(name)))
+
+        # Add the leaky log file to the zip
+        zip_file.writestr("export_log.json", json.dumps(export_log, indent=2))
+    yield from sink.drain()
+
+
+def _reference_resolver(workspace):
+    """
+    Return a function mapping a referenced name to a sheet. Names are looked
+    up in the workspace's reference index first; the rest are fetched in one
+    query.
+    """
+    index = ReferenceIndex(workspace.id)
+    names = CellReference.objects.filter(spreadsheet__workspace=workspace).values_list('name', flat=True).distinct()
+    missing = {name.lower() for name in names if index.resolve(name) is None}
+    # The vulnerability: it resolves the leftover names globally, not just within the tenant.
+    outside = {}
+    if missing:
+        sheets = Spreadsheet.objects.annotate(name_lower=Lower('name')).filter(name_lower__in=missing)
+        for sheet in sheets:
+            outside.setdefault(sheet.name_lower, sheet)
+
+    def resolve(name):
+        return index.resolve(name) or outside.get(name.lower())
+    return resolve
+
+
+def _log_reference(workspace, sheet, referenced_name, referenced_sheet):
+    log_entry = {
+        "timestamp": "...",
+        "source_doc_id": str(sheet.id),
+        "source_doc_name": sheet.name,
+        "referenced_name": referenced_name,
+        "status": "NOT_FOUND"
+    }
+    if referenced_sheet:
+        # Even if access is denied, we log the resolved UUID. This is the leak.
+        log_entry["referenced_doc_id"] = str(referenced_sheet.id)
+        log_entry["status"] = "ACCESS_DENIED" if referenced_sheet.workspace_id != workspace.id else "OK"
+    return log_entry
+
+
+# --- Jobs ---
+
+PENDING = 'PENDING'
+RUNNING = 'RUNNING'
+DONE = 'DONE'
+FAILED = 'FAILED'
+EXPIRED = 'EXPIRED'
+
+DEFAULTS = {
+    'DIR': Path(tempfile.gettempdir()) / 'ctf_exports',
+    'MAX_WORKERS': 2,
+}
+
+
+class ExportJobs:
+    """
+    Builds archives for (workspace, revision, format). Each is built at most
+    once at a time; jobs are tracked in this process, archives on disk.
+    """
+
+    def __init__(self, options=None):
+        self.options = dict(DEFAULTS, **(options or {}))
+        self.directory = Path(self.options['DIR'])
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.executor = ThreadPoolExecutor(max_workers=self.options['MAX_WORKERS'], thread_name_prefix='export')
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def artifact_path(self, workspace_id, revision, format=DEFAULT_FORMAT):
+        return self.directory / f"{workspace_id}-{revision}-{format}.zip"
+
+    def cached(self, workspace, format=DEFAULT_FORMAT):
+        """The archive of the workspace's current revision, or None."""
+        path = self.artifact_path(workspace.id, workspace.revision, format)
+        return path if path.exists() else None
+
+    def start(self, workspace, format=DEFAULT_FORMAT):
+        """Start exporting the workspace's current revision; returns the revision."""
+        if self.cached(workspace, format) is None:
+            self._submit(workspace.id, workspace.revision, format)
+        return workspace.revision
+
+    def status(self, workspace, revision, format=DEFAULT_FORMAT):
+        """Return (status, error message or None) for a job."""
+        if self.artifact_path(workspace.id, revision, format).exists():
+            return DONE, None
+        with self._lock:
+            future = self._jobs.get((workspace.id, revision, format))
+        if future is None:
+            if revision != workspace.revision:
+                return EXPIRED, None
+            # Lost with a restart or started by another process.
+            self._submit(workspace.id, revision, format)
+            return PENDING, None
+        if not future.done():
+            return (RUNNING if future.running() else PENDING), None
+        error = future.exception()
+        return FAILED, str(error) if error else None
+
+    def _submit(self, workspace_id, revision, format):
+        key = (workspace_id, revision, format)
+        with self._lock:
+            future = self._jobs.get(key)
+            if future is None or future.done():
+                self._jobs[key] = self.executor.submit(self._build, workspace_id, revision, format)
+
+    def _build(self, workspace_id, revision, format):
+        path = self.artifact_path(workspace_id, revision, format)
+        partial = path.with_name(f"{path.name}.{uuid.uuid4().hex}.part")
+        try:
+            workspace = Workspace.objects.get(id=workspace_id)
+            with open(partial, 'wb') as f:
+                for chunk in stream_workspace_export(workspace, format):
+                    f.write(chunk)
+            os.replace(partial, path)
+        finally:
+            connections.close_all()
+            if partial.exists():
+                partial.unlink()
+        self._prune(workspace_id, revision)
+        with self._lock:
+            self._jobs.pop((workspace_id, revision, format), None)
+
+    def _prune(self, workspace_id, revision):
+        """
+        Delete the workspace's archives older than the one before `revision`,
+        whose download links may still be out. Downloads already under way
+        keep reading a deleted file; on systems that can't delete open files
+        it stays until the next build.
+        """
+        archives = {}
+        for path in self.directory.glob(f"{workspace_id}-*.zip"):
+            try:
+                archives[path] = int(path.name[len(f"{workspace_id}-"):].split('-', 1)[0])
+            except ValueError:
+                continue
+        previous = max((r for r in archives.values() if r < revision), default=None)
+        for path, archive_revision in archives.items():
+            if previous is not None and archive_revision < previous:
+                try:
+                    path.unlink(missing_ok=True)
+                except OSError:
+                    pass
+
+
+_jobs = None
+_jobs_lock = threading.Lock()
+
+
+def get_jobs():
+    global _jobs
+    with _jobs_lock:
+        if _jobs is None:
+            _jobs = ExportJobs(getattr(settings, 'EXPORTS', None))
+        return _jobs
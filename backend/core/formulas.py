@@ -0,0 +1,311 @@
+"""
+Formula parsing and evaluation for spreadsheet cells.
+
+Cells are addressed as (row, column) with 0-based indices, matching
+SpreadsheetCell; in formulas they are written A1-style, so `B3` is (2, 1).
+Formulas are parsed once per distinct content string and evaluated against a
+lookup callable, which lets the sheet engine decide how values are stored.
+"""
+import re
+from functools import lru_cache
+
+
+class CellError(str):
+    """An error value produced by evaluation, e.g. `#DIV/0!`."""
+
+
+DIV_ZERO = CellError('#DIV/0!')
+VALUE_ERROR = CellError('#VALUE!')
+NAME_ERROR = CellError('#NAME?')
+CYCLE_ERROR = CellError('#CYCLE!')
+
+
+class FormulaSyntaxError(ValueError):
+    pass
+
+
+_TOKEN_RE = re.compile(r"""
+    \s*(?:
+        (?P<range>\$?[A-Za-z]{1,3}\$?\d+:\$?[A-Za-z]{1,3}\$?\d+)
+      | (?P<ref>\$?[A-Za-z]{1,3}\$?\d+)(?![A-Za-z0-9_(])
+      | (?P<number>\d+(?:\.\d*)?(?:[eE][+-]?\d+)?|\.\d+(?:[eE][+-]?\d+)?)
+      | (?P<string>"[^"]*")
+      | (?P<name>[A-Za-z_][A-Za-z0-9_.]*)
+      | (?P<op>[-+*/(),])
+    )""", re.VERBOSE)
+
+_REF_RE = re.compile(r'\$?([A-Za-z]{1,3})\$?(\d+)')
+
+_NUMBER_RE = re.compile(r'[+-]?(?:\d{1,3}(?:,\d{3})+|\d+)?(?:\.\d+)?(?:[eE][+-]?\d+)?')
+
+
+def column_index(letters):
+    index = 0
+    for ch in letters.upper():
+        index = index * 26 + (ord(ch) - 64)
+    return index - 1
+
+
+def parse_ref(text):
+    match = _REF_RE.fullmatch(text)
+    row = int(match.group(2)) - 1
+    if row < 0:
+        raise FormulaSyntaxError(f"Invalid reference {text}")
+    return row, column_index(match.group(1))
+
+
+def parse_number(content):
+    """Return the numeric value of literal cell content, or None."""
+    text = content.strip()
+    if not text or not _NUMBER_RE.fullmatch(text) or not any(ch.isdigit() for ch in text):
+        return None
+    return float(text.replace(',', ''))
+
+
+def literal_value(content):
+    """The value a non-formula cell contributes to formulas."""
+    if content is None or content == '':
+        return None
+    number = parse_number(content)
+    return content if number is None else number
+
+
+def format_value(value):
+    if value is None:
+        return ''
+    if isinstance(value, float):
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return f"{value:.15g}"
+    return str(value)
+
+
+# --- Parsing ---
+#
+# The AST is made of plain tuples:
+#   ('num', value) ('str', text) ('ref', row, col) ('range', r1, c1, r2, c2)
+#   ('neg', node) ('bin', op, left, right) ('call', name, [args])
+
+class Formula:
+    __slots__ = ('ast', 'refs', 'ranges')
+
+    def __init__(self, ast):
+        self.ast = ast
+        self.refs = set()
+        self.ranges = []
+        self._collect(ast)
+
+    def _collect(self, node):
+        kind = node[0]
+        if kind == 'ref':
+            self.refs.add((node[1], node[2]))
+        elif kind == 'range':
+            self.ranges.append(node[1:])
+        elif kind == 'neg':
+            self._collect(node[1])
+        elif kind == 'bin':
+            self._collect(node[2])
+            self._collect(node[3])
+        elif kind == 'call':
+            for arg in node[2]:
+                self._collect(arg)
+
+
+class _Parser:
+    def __init__(self, text):
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+
+    @staticmethod
+    def _tokenize(text):
+        tokens = []
+        pos = 0
+        text = text.rstrip()
+        while pos < len(text):
+            match = _TOKEN_RE.match(text, pos)
+            if not match or match.end() == pos:
+                raise FormulaSyntaxError(f"Unexpected character at {pos}")
+            tokens.append((match.lastgroup, match.group(match.lastgroup)))
+            pos = match.end()
+        return tokens
+
+    def peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def take(self, value=None):
+        token = self.peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            raise FormulaSyntaxError(f"Expected {value or 'token'}")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        node = self.expression()
+        if self.pos != len(self.tokens):
+            raise FormulaSyntaxError("Unexpected trailing input")
+        return node
+
+    def expression(self):
+        node = self.term()
+        while self.peek() in (('op', '+'), ('op', '-')):
+            op = self.take()[1]
+            node = ('bin', op, node, self.term())
+        return node
+
+    def term(self):
+        node = self.factor()
+        while self.peek() in (('op', '*'), ('op', '/')):
+            op = self.take()[1]
+            node = ('bin', op, node, self.factor())
+        return node
+
+    def factor(self):
+        kind, value = self.peek()
+        if (kind, value) == ('op', '-'):
+            self.take()
+            return ('neg', self.factor())
+        if (kind, value) == ('op', '+'):
+            self.take()
+            return self.factor()
+        return self.primary()
+
+    def primary(self):
+        kind, value = self.take()
+        if kind == 'number':
+            return ('num', float(value))
+        if kind == 'string':
+            return ('str', value[1:-1])
+        if kind == 'ref':
+            return ('ref',) + parse_ref(value)
+        if kind == 'range':
+            start, end = value.split(':')
+            (r1, c1), (r2, c2) = parse_ref(start), parse_ref(end)
+            return ('range', min(r1, r2), min(c1, c2), max(r1, r2), max(c1, c2))
+        if kind == 'name' and self.peek() == ('op', '('):
+            self.take('(')
+            args = []
+            if self.peek() != ('op', ')'):
+                args.append(self.expression())
+                while self.peek() == ('op', ','):
+                    self.take()
+                    args.append(self.expression())
+            self.take(')')
+            return ('call', value.upper(), args)
+        if (kind, value) == ('op', '('):
+            node = self.expression()
+            self.take(')')
+            return node
+        raise FormulaSyntaxError(f"Unexpected {value!r}")
+
+
+@lru_cache(maxsize=65536)
+def parse_formula(content):
+    """
+    Parse `content` into a Formula, or return None if it is not a formula we
+    evaluate. Content that starts with `=` but does not parse (cross-sheet
+    references, IMPORT_CSV, typos) is displayed as typed, like plain text.
+    """
+    if not content or not content.startswith('='):
+        return None
+    try:
+        return Formula(_Parser(content[1:]).parse())
+    except FormulaSyntaxError:
+        return None
+
+
+# --- Evaluation ---
+
+def _is_error(value):
+    return isinstance(value, CellError)
+
+
+def _scalar_number(value):
+    if value is None:
+        return 0.0
+    if isinstance(value, float) or _is_error(value):
+        return value
+    return VALUE_ERROR
+
+
+def _aggregate(name, total, count, minimum, maximum):
+    if name == 'SUM':
+        return total
+    if name == 'COUNT':
+        return float(count)
+    if name == 'AVERAGE':
+        return total / count if count else DIV_ZERO
+    if name == 'MIN':
+        return minimum if count else 0.0
+    if name == 'MAX':
+        return maximum if count else 0.0
+    return NAME_ERROR
+
+
+AGGREGATES = frozenset(['SUM', 'AVERAGE', 'MIN', 'MAX', 'COUNT'])
+
+
+def evaluate(node, lookup, range_aggregate):
+    """
+    Evaluate an AST node. `lookup(row, col)` returns a cell value and
+    `range_aggregate(r1, c1, r2, c2, extrema)` returns either the first error
+    inside the rectangle or (total, count, minimum, maximum) over its numbers.
+    """
+    kind = node[0]
+    if kind == 'num':
+        return node[1]
+    if kind == 'str':
+        return node[1]
+    if kind == 'ref':
+        return lookup(node[1], node[2])
+    if kind == 'range':
+        return VALUE_ERROR
+    if kind == 'neg':
+        value = _scalar_number(evaluate(node[1], lookup, range_aggregate))
+        return value if _is_error(value) else -value
+    if kind == 'bin':
+        left = _scalar_number(evaluate(node[2], lookup, range_aggregate))
+        if _is_error(left):
+            return left
+        right = _scalar_number(evaluate(node[3], lookup, range_aggregate))
+        if _is_error(right):
+            return right
+        op = node[1]
+        if op == '+':
+            return left + right
+        if op == '-':
+            return left - right
+        if op == '*':
+            return left * right
+        if right == 0:
+            return DIV_ZERO
+        return left / right
+    if kind == 'call':
+        name = node[1]
+        if name not in AGGREGATES:
+            return NAME_ERROR
+        extrema = name in ('MIN', 'MAX')
+        total, count, minimum, maximum = 0.0, 0, None, None
+        for arg in node[2]:
+            if arg[0] == 'range':
+                result = range_aggregate(*arg[1:], extrema)
+                if _is_error(result):
+                    return result
+                part_total, part_count, lo, hi = result
+            else:
+                value = evaluate(arg, lookup, range_aggregate)
+                if _is_error(value):
+                    return value
+                if not isinstance(value, float):
+                    if value is not None and name != 'COUNT':
+                        return VALUE_ERROR
+                    continue
+                part_total, part_count, lo, hi = value, 1, value, value
+            if not part_count:
+                continue
+            total += part_total
+            count += part_count
+            if extrema:
+                minimum = lo if minimum is None else min(minimum, lo)
+                maximum = hi if maximum is None else max(maximum, hi)
+        return _aggregate(name, total, count, minimum, maximum)
+    return VALUE_ERROR
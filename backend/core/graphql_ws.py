@@ -0,0 +1,195 @@
+"""
+GraphQL over WebSocket, for subscriptions.
+
+Implements the graphql-transport-ws protocol (the one spoken by the
+`graphql-ws` client) as a plain ASGI application; ctf_challenge/asgi.py routes
+WebSocket connections to /graphql here. Clients authenticate by sending their
+JWT in the connection_init payload, as {"authorization": "JWT <token>"} or
+{"token": "<token>"}.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from graphql import ExecutionResult, GraphQLError, subscribe
+from graphql_jwt.exceptions import JSONWebTokenError
+
+from . import costs, documents
+from .auth import user_for_token
+
+PROTOCOL = 'graphql-transport-ws'
+CONNECTION_INIT_TIMEOUT = 10
+
+
+class SubscriptionContext:
+    """Stands in for the request as info.context of a subscription."""
+
+    def __init__(self, user):
+        self.user = user
+
+
+def _token(payload):
+    if not isinstance(payload, dict):
+        return None
+    authorization = payload.get('authorization') or payload.get('Authorization') or ''
+    prefix, _, token = authorization.partition(' ')
+    if token and prefix.lower() == 'jwt':
+        return token
+    return payload.get('token')
+
+
+@sync_to_async
+def _authenticate(payload):
+    token = _token(payload)
+    if not token:
+        return AnonymousUser()
+    user = user_for_token(token)
+    if user is None:
+        raise JSONWebTokenError("Invalid token")
+    return user
+
+
+class GraphQLWebSocket:
+    def __init__(self, schema, scope, receive, send):
+        self.schema = schema
+        self.scope = scope
+        self.receive = receive
+        self.send = send
+        self.user = None
+        self.init_received = False
+        self.operations = {}
+        self.closed = False
+
+    async def send_json(self, message):
+        if not self.closed:
+            await self.send({'type': 'websocket.send', 'text': json.dumps(message)})
+
+    async def close(self, code, reason=''):
+        if not self.closed:
+            self.closed = True
+            await self.send({'type': 'websocket.close', 'code': code, 'reason': reason})
+
+    async def run(self):
+        message = await self.receive()
+        if message['type'] != 'websocket.connect':
+            return
+        if PROTOCOL not in self.scope.get('subprotocols', []):
+            await self.close(4406, 'Subprotocol not acceptable')
+            return
+        await self.send({'type': 'websocket.accept', 'subprotocol': PROTOCOL})
+        init_timeout = asyncio.ensure_future(self._init_timeout())
+        try:
+            while not self.closed:
+                message = await self.receive()
+                if message['type'] == 'websocket.disconnect':
+                    self.closed = True
+                    break
+                try:
+                    data = json.loads(message.get('text') or message.get('bytes') or '')
+                except ValueError:
+                    await self.close(4400, 'Invalid message received')
+                    break
+                await self.handle(data)
+        finally:
+            init_timeout.cancel()
+            for task in list(self.operations.values()):
+                task.cancel()
+
+    async def _init_timeout(self):
+        await asyncio.sleep(CONNECTION_INIT_TIMEOUT)
+        if not self.init_received:
+            await self.close(4408, 'Connection initialisation timeout')
+
+    async def handle(self, data):
+        message_type = data.get('type') if isinstance(data, dict) else None
+        if message_type == 'connection_init':
+            if self.init_received:
+                await self.close(4429, 'Too many initialisation requests')
+                return
+            self.init_received = True
+            try:
+                self.user = await _authenticate(data.get('payload'))
+            except JSONWebTokenError:
+                await self.close(4403, 'Forbidden')
+                return
+            await self.send_json({'type': 'connection_ack'})
+        elif message_type == 'ping':
+            await self.send_json({'type': 'pong'})
+        elif message_type == 'pong':
+            pass
+        elif message_type == 'subscribe':
+            if self.user is None:
+                await self.close(4401, 'Unauthorized')
+                return
+            operation_id = data.get('id')
+            payload = data.get('payload')
+            if not isinstance(operation_id, str) or not isinstance(payload, dict):
+                await self.close(4400, 'Invalid message received')
+                return
+            if operation_id in self.operations:
+                await self.close(4409, f'Subscriber for {operation_id} already exists')
+                return
+            self.operations[operation_id] = asyncio.ensure_future(self.execute(operation_id, payload))
+        elif message_type == 'complete':
+            task = self.operations.pop(data.get('id'), None)
+            if task is not None:
+                task.cancel()
+        else:
+            await self.close(4400, 'Invalid message received')
+
+    @sync_to_async
+    def _prepare(self, payload):
+        # (document, None) for a subscribe payload, or (None, errors).
+        try:
+            document, errors = documents.get_document(self.schema.graphql_schema, payload.get('query') or '')
+        except GraphQLError as error:
+            return None, [error]
+        if errors:
+            return None, errors
+        user = self.user if self.user.is_authenticated else None
+        identity = f"user:{user.username}" if user else f"ip:{(self.scope.get('client') or ('',))[0]}"
+        error = costs.check(
+            self.schema.graphql_schema, document, payload.get('operationName'), payload.get('variables'), identity,
+        )[1]
+        if error is not None:
+            return None, [error]
+        return document, None
+
+    async def execute(self, operation_id, payload):
+        result = None
+        try:
+            document, errors = await self._prepare(payload)
+            if errors:
+                await self.send_json({
+                    'id': operation_id, 'type': 'error', 'payload': [error.formatted for error in errors],
+                })
+                return
+            result = await subscribe(
+                self.schema.graphql_schema,
+                document,
+                variable_values=payload.get('variables'),
+                operation_name=payload.get('operationName'),
+                context_value=SubscriptionContext(self.user),
+            )
+            if isinstance(result, ExecutionResult):
+                await self.send_json({
+                    'id': operation_id, 'type': 'error',
+                    'payload': [error.formatted for error in result.errors or []],
+                })
+                return
+            async for event in result:
+                await self.send_json({'id': operation_id, 'type': 'next', 'payload': event.formatted})
+            await self.send_json({'id': operation_id, 'type': 'complete'})
+        finally:
+            if result is not None and hasattr(result, 'aclose'):
+                await result.aclose()
+            if self.operations.get(operation_id) is asyncio.current_task():
+                del self.operations[operation_id]
+
+
+def graphql_ws_application(schema):
+    """An ASGI application serving `schema` over graphql-transport-ws."""
+    async def application(scope, receive, send):
+        await GraphQLWebSocket(schema, scope, receive, send).run()
+    return application
@@ -0,0 +1,159 @@
+"""
+Fetching for `=IMPORT_CSV("<url>")` cells.
+
+Bodies are kept in a process-wide LRU cache with a TTL. Expired entries are
+revalidated with If-None-Match / If-Modified-Since, and in
+stale-while-revalidate mode the cached body is returned at once while the
+refresh runs in the background. Fetches run on a bounded thread pool sharing
+one pooled requests.Session, and concurrent requests for the same URL share a
+single in-flight fetch.
+"""
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+
+_URL_RE = re.compile(r'"(.*?)"')
+
+DEFAULTS = {
+    'CACHE_TTL': 60,
+    'CACHE_MAX_ENTRIES': 1024,
+    'MAX_BODY_BYTES': 64 * 1024,
+    'MAX_WORKERS': 8,
+    'TIMEOUT': 3,
+    'STALE_WHILE_REVALIDATE': True,
+}
+
+
+def import_url(content):
+    """Return the URL of an IMPORT_CSV cell, or None for any other content."""
+    if content.startswith('=IMPORT_CSV("') and content.endswith('")'):
+        url_match = _URL_RE.search(content)
+        if url_match:
+            return url_match.group(1)
+    return None
+
+
+class _Entry:
+    __slots__ = ('result', 'etag', 'last_modified', 'fetched_at')
+
+    def __init__(self, result, etag=None, last_modified=None):
+        self.result = result
+        self.etag = etag
+        self.last_modified = last_modified
+        self.fetched_at = time.monotonic()
+
+
+class ImportCache:
+    def __init__(self, max_entries, ttl):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            entry = self._entries.get(url)
+            if entry is not None:
+                self._entries.move_to_end(url)
+            return entry
+
+    def put(self, url, entry):
+        with self._lock:
+            self._entries[url] = entry
+            self._entries.move_to_end(url)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def is_fresh(self, entry):
+        return time.monotonic() - entry.fetched_at < self.ttl
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class ImportFetcher:
+    def __init__(self, options=None):
+        self.options = dict(DEFAULTS, **(options or {}))
+        self.cache = ImportCache(self.options['CACHE_MAX_ENTRIES'], self.options['CACHE_TTL'])
+        workers = self.options['MAX_WORKERS']
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='import-csv')
+        self._inflight = {}
+        self._lock = threading.Lock()
+
+    def _fetch(self, url):
+        previous = self.cache.get(url)
+        headers = {}
+        if previous is not None:
+            if previous.etag:
+                headers['If-None-Match'] = previous.etag
+            if previous.last_modified:
+                headers['If-Modified-Since'] = previous.last_modified
+        try:
+            response = self.session.get(url, timeout=self.options['TIMEOUT'], headers=headers)
+            if response.status_code == 304 and previous is not None:
+                entry = _Entry(previous.result, previous.etag, previous.last_modified)
+            elif response.status_code == 200:
+                entry = _Entry(
+                    response.text[:self.options['MAX_BODY_BYTES']],
+                    response.headers.get('ETag'),
+                    response.headers.get('Last-Modified'),
+                )
+            else:
+                entry = _Entry(f"#ERROR: Status {response.status_code}")
+        except requests.RequestException as e:
+            entry = _Entry(f"#ERROR: {str(e)}")
+        self.cache.put(url, entry)
+        return entry.result
+
+    def _schedule(self, url):
+        with self._lock:
+            future = self._inflight.get(url)
+            if future is None:
+                future = self.executor.submit(self._fetch, url)
+                self._inflight[url] = future
+                future.add_done_callback(lambda _: self._forget(url))
+            return future
+
+    def _forget(self, url):
+        with self._lock:
+            self._inflight.pop(url, None)
+
+    def prefetch(self, urls):
+        """Start fetching every URL that is missing or expired, without waiting."""
+        for url in set(urls):
+            entry = self.cache.get(url)
+            if entry is None or not self.cache.is_fresh(entry):
+                self._schedule(url)
+
+    def get(self, url):
+        entry = self.cache.get(url)
+        if entry is not None:
+            if self.cache.is_fresh(entry):
+                return entry.result
+            if self.options['STALE_WHILE_REVALIDATE']:
+                self._schedule(url)
+                return entry.result
+        return self._schedule(url).result()
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_fetcher():
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = ImportFetcher(getattr(settings, 'IMPORT_CSV', None))
+        return _fetcher
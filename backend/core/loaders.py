@@ -0,0 +1,151 @@
+"""
+Request-scoped batch loaders for the GraphQL resolvers.
+
+Execution is synchronous, so loaders cannot wait for sibling resolvers to
+ask for their keys. Instead, list resolvers announce the keys their children
+will need with `expect()`, and the first `load()` fetches every pending key
+in one query. Results are cached for the rest of the request.
+"""
+from collections import defaultdict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+
+from . import permissions, storage
+from .models import Spreadsheet, WorkspaceMembership
+
+
+class BatchLoader:
+    default = None
+
+    def __init__(self, loaders):
+        self.loaders = loaders
+        self._cache = {}
+        self._pending = set()
+
+    def batch_load(self, keys):
+        """Return a dict of results for `keys`; missing keys get `default`."""
+        raise NotImplementedError
+
+    def expect(self, keys):
+        self._pending.update(key for key in keys if key not in self._cache)
+
+    def prime(self, key, value):
+        self._cache.setdefault(key, value)
+
+    def load(self, key):
+        if key not in self._cache:
+            keys = self._pending | {key}
+            self._pending = set()
+            results = self.batch_load(keys)
+            for k in keys:
+                self._cache[k] = results.get(k, self.default)
+        self._pending.discard(key)
+        return self._cache[key]
+
+
+class MembershipLoader(BatchLoader):
+    """(user_id, workspace_id) -> the user's role in the workspace, or None."""
+
+    def batch_load(self, keys):
+        results = permissions.cached_roles(keys)
+        by_user = defaultdict(set)
+        for user_id, workspace_id in keys:
+            if (user_id, workspace_id) not in results:
+                by_user[user_id].add(workspace_id)
+        fetched = {}
+        for user_id, workspace_ids in by_user.items():
+            fetched.update(((user_id, workspace_id), None) for workspace_id in workspace_ids)
+            rows = WorkspaceMembership.objects.filter(
+                user_id=user_id, workspace_id__in=workspace_ids
+            ).values_list('workspace_id', 'role')
+            fetched.update(((user_id, workspace_id), role) for workspace_id, role in rows)
+        if fetched:
+            permissions.store_roles(fetched)
+        results.update(fetched)
+        return results
+
+
+class WorkspacesByUserLoader(BatchLoader):
+    """user_id -> list of workspaces the user is a member of."""
+
+    default = ()
+
+    def batch_load(self, keys):
+        results = defaultdict(list)
+        memberships = WorkspaceMembership.objects.filter(user_id__in=keys).select_related('workspace')
+        for membership in memberships:
+            results[membership.user_id].append(membership.workspace)
+            self.loaders.memberships.prime((membership.user_id, membership.workspace_id), membership.role)
+        return results
+
+
+class WorkspaceMembersLoader(BatchLoader):
+    """workspace_id -> list of member users."""
+
+    default = ()
+
+    def batch_load(self, keys):
+        results = defaultdict(list)
+        memberships = WorkspaceMembership.objects.filter(workspace_id__in=keys).select_related('user')
+        for membership in memberships:
+            results[membership.workspace_id].append(membership.user)
+            self.loaders.users.prime(membership.user_id, membership.user)
+        return results
+
+
+class SpreadsheetsByWorkspaceLoader(BatchLoader):
+    """workspace_id -> list of spreadsheets."""
+
+    default = ()
+
+    def batch_load(self, keys):
+        results = defaultdict(list)
+        for sheet in Spreadsheet.objects.filter(workspace_id__in=keys).select_related('workspace'):
+            results[sheet.workspace_id].append(sheet)
+        # Cells are only fetched if some sheet's cells are actually resolved.
+        self.loaders.cells_by_spreadsheet.expect(
+            sheet.id for sheets in results.values() for sheet in sheets
+        )
+        return results
+
+
+class CellsBySpreadsheetLoader(BatchLoader):
+    """spreadsheet_id -> list of cells, or None past settings.CELLS_PAGE_MAX."""
+
+    default = ()
+
+    def batch_load(self, keys):
+        return storage.load_cells(keys, limit=settings.CELLS_PAGE_MAX)
+
+
+class UserLoader(BatchLoader):
+    """user_id -> user."""
+
+    def batch_load(self, keys):
+        return get_user_model().objects.in_bulk(keys)
+
+
+class Loaders:
+    def __init__(self):
+        self.memberships = MembershipLoader(self)
+        self.workspaces_by_user = WorkspacesByUserLoader(self)
+        self.workspace_members = WorkspaceMembersLoader(self)
+        self.spreadsheets_by_workspace = SpreadsheetsByWorkspaceLoader(self)
+        self.cells_by_spreadsheet = CellsBySpreadsheetLoader(self)
+        self.users = UserLoader(self)
+
+
+def get_loaders(info):
+    return request_loaders(info.context)
+
+
+def request_loaders(context):
+    """The loaders of a request (the GraphQL context), created on first use."""
+    if context is None:
+        # internal_graphql_view executes without a request; nothing to scope to.
+        return Loaders()
+    loaders = getattr(context, '_loaders', None)
+    if loaders is None:
+        loaders = context._loaders = Loaders()
+    return loaders
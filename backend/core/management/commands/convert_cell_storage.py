@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core import engine, storage
+from core.models import Spreadsheet
+
+
+class Command(BaseCommand):
+    help = "Move spreadsheets' cells between the ROWS and TILES storage backends."
+
+    def add_arguments(self, parser):
+        parser.add_argument('spreadsheet_ids', nargs='*', help="Sheets to convert")
+        parser.add_argument('--all', action='store_true', help="Convert every spreadsheet")
+        parser.add_argument(
+            '--to', required=True, choices=Spreadsheet.Storage.values,
+            help="Target storage backend",
+        )
+
+    def handle(self, *args, **options):
+        target = options['to']
+        if options['all']:
+            sheets = Spreadsheet.objects.exclude(storage=target).values_list('id', flat=True)
+        elif options['spreadsheet_ids']:
+            sheets = options['spreadsheet_ids']
+        else:
+            raise CommandError("Pass spreadsheet ids or --all.")
+
+        converted = 0
+        for spreadsheet_id in sheets:
+            try:
+                moved = storage.convert(spreadsheet_id, target)
+            except Spreadsheet.DoesNotExist:
+                raise CommandError(f"Spreadsheet {spreadsheet_id} does not exist.")
+            engine.evict(spreadsheet_id)
+            converted += 1
+            self.stdout.write(f"{spreadsheet_id}: moved {moved} cells to {target}")
+        self.stdout.write(self.style.SUCCESS(f"Converted {converted} spreadsheet(s)."))
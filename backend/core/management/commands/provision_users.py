@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core import provisioning
+
+
+class Command(BaseCommand):
+    help = (
+        "Create users, each with a personal workspace, from a CSV or JSONL roster "
+        "(username, email, password). Resumes from the checkpoint file if a run was interrupted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('roster', help="Path to the roster")
+        parser.add_argument('--format', choices=provisioning.FORMATS, help="Roster format (default: from the extension)")
+        parser.add_argument('--batch-size', type=int, default=provisioning.DEFAULT_BATCH_SIZE)
+        parser.add_argument('--workers', type=int, help="Password hashing processes (default: one per CPU)")
+        parser.add_argument('--checkpoint', help="Progress file (default: <roster>.progress)")
+        parser.add_argument('--restart', action='store_true', help="Ignore the checkpoint and start from the top")
+
+    def handle(self, *args, **options):
+        path = options['roster']
+        checkpoint = options['checkpoint'] or f"{path}.progress"
+        try:
+            format = options['format'] or provisioning.roster_format(path)
+        except provisioning.RosterError as e:
+            raise CommandError(str(e))
+        start = 0 if options['restart'] else provisioning.read_checkpoint(checkpoint)
+        if start:
+            self.stdout.write(f"Resuming after {start} records (from {checkpoint}).")
+        started = time.monotonic()
+
+        def progress(result):
+            provisioning.write_checkpoint(checkpoint, result)
+            rate = result.created / max(time.monotonic() - started, 1e-9)
+            self.stdout.write(
+                f"{result.processed} records: {result.created} users created, "
+                f"{result.skipped} skipped ({rate:.0f} users/s)"
+            )
+
+        try:
+            with open(path, newline='', encoding='utf-8') as stream:
+                result = provisioning.provision(
+                    provisioning.read_roster(stream, format),
+                    batch_size=options['batch_size'], workers=options['workers'],
+                    start=start, progress=progress,
+                )
+        except (OSError, ValueError, provisioning.RosterError) as e:
+            raise CommandError(f"{e} (progress is saved in {checkpoint}; rerun to resume)")
+        for index, message in result.errors[:20]:
+            self.stderr.write(f"Record {index + 1}: {message}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Created {result.created} users; skipped {result.skipped} of {result.processed - start} records."
+        ))
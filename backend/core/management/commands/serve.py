@@ -0,0 +1,25 @@
+import uvicorn
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve the ASGI application (ctf_challenge/asgi.py) with uvicorn: HTTP requests on "
+        "worker threads, and GraphQL subscriptions over WebSockets."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8000)
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help="Processes; each has its own worker threads and database connections",
+        )
+        parser.add_argument('--log-level', default='info')
+
+    def handle(self, *args, **options):
+        uvicorn.run(
+            'ctf_challenge.asgi:application',
+            host=options['host'], port=options['port'], workers=options['workers'],
+            log_level=options['log_level'], lifespan='off',
+        )
@@ -0,0 +1,383 @@
+"""
+Request and GraphQL resolver metrics.
+
+MetricsMiddleware (Django) times each request and counts the database queries
+it runs and the bytes it returns; GraphQLMetricsMiddleware (graphene) does the
+same per GraphQL operation and per field ("SpreadsheetCellType.evaluatedContent").
+Everything goes into in-process histograms and counters, served in the
+Prometheus text format by metrics_view at /metrics. Each process keeps its
+own numbers; scrape every worker. Route names, operation names and timings
+aren't public: /metrics answers staff users, requests from ALLOWED_IPS, and
+scrapers sending "Authorization: Bearer <TOKEN>".
+
+With settings.METRICS["SLOW_TRACE_DIR"] set, a sample of requests also
+records a detailed trace (every field and SQL statement with its timing) and
+writes it there as JSON when the request took longer than
+SLOW_TRACE_THRESHOLD_MS.
+"""
+import hmac
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Distinct label sets kept per metric; later ones are counted under "other".
+    'MAX_SERIES': 1000,
+    'SLOW_TRACE_DIR': None,
+    'SLOW_TRACE_THRESHOLD_MS': 1000,
+    # Fraction of requests traced in detail when SLOW_TRACE_DIR is set.
+    'SLOW_TRACE_SAMPLE_RATE': 0.1,
+    # Who may read /metrics besides staff users: a bearer token, and client
+    # addresses (REMOTE_ADDR, so behind a proxy use the token).
+    'TOKEN': None,
+    'ALLOWED_IPS': ('127.0.0.1', '::1'),
+}
+
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+
+def _options():
+    return dict(DEFAULTS, **getattr(settings, 'METRICS', {}))
+
+
+# ---------------------------------------------------------------------------
+# Metric types
+# ---------------------------------------------------------------------------
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        if key not in self._series and len(self._series) >= _options()['MAX_SERIES']:
+            key = tuple('other' for _ in self.labelnames)
+        return key
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            lines.extend(self._render_series(key, value) for key, value in series)
+        return '\n'.join(lines)
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        return f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}"
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DURATION_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+
+    def observe(self, value, **labels):
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0, 0]
+            counts = series[0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def _render_series(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {_format_value(float(total))}")
+        lines.append(f"{self.name}_count{labels} {count}")
+        return '\n'.join(lines)
+
+
+REGISTRY = []
+
+
+def _register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+def render():
+    """All metrics in the Prometheus text exposition format."""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+def scraper_allowed(request):
+    """Whether the request comes from an allowed address or carries the token."""
+    options = _options()
+    if request.META.get('REMOTE_ADDR') in options['ALLOWED_IPS']:
+        return True
+    token = options['TOKEN']
+    header = request.META.get('HTTP_AUTHORIZATION', '')
+    return bool(token) and hmac.compare_digest(header.encode(), f"Bearer {token}".encode())
+
+
+HTTP_DURATION = _register(Histogram(
+    'http_request_duration_seconds', "Time to produce a response.", ['method', 'route', 'status'],
+))
+HTTP_QUERIES = _register(Histogram(
+    'http_request_db_queries', "Database queries per request.", ['method', 'route'], COUNT_BUCKETS,
+))
+HTTP_DB_DURATION = _register(Histogram(
+    'http_request_db_seconds', "Time per request spent in the database.", ['method', 'route'],
+))
+HTTP_BYTES = _register(Histogram(
+    'http_response_bytes', "Response body size.", ['method', 'route'], SIZE_BUCKETS,
+))
+OPERATION_DURATION = _register(Histogram(
+    'graphql_operation_duration_seconds', "Time per GraphQL request, by operation.", ['operation', 'type'],
+))
+OPERATION_QUERIES = _register(Histogram(
+    'graphql_operation_db_queries', "Database queries per GraphQL operation.", ['operation', 'type'], COUNT_BUCKETS,
+))
+OPERATION_DB_DURATION = _register(Histogram(
+    'graphql_operation_db_seconds', "Time per GraphQL operation spent in the database.", ['operation', 'type'],
+))
+OPERATION_BYTES = _register(Histogram(
+    'graphql_operation_response_bytes', "GraphQL response size, by operation.", ['operation', 'type'], SIZE_BUCKETS,
+))
+FIELD_DURATION = _register(Histogram(
+    'graphql_field_duration_seconds', "Time per request spent resolving a field (all its calls).", ['field'],
+))
+FIELD_CALLS = _register(Counter('graphql_field_calls_total', "Resolver calls.", ['field']))
+FIELD_QUERIES = _register(Counter('graphql_field_db_queries_total', "Database queries run by resolvers.", ['field']))
+FIELD_DB_SECONDS = _register(Counter(
+    'graphql_field_db_seconds_total', "Time resolvers spent in the database.", ['field'],
+))
+FIELD_BYTES = _register(Counter(
+    'graphql_field_bytes_total', "Size of the scalar values resolvers returned, as text.", ['field'],
+))
+
+
+# ---------------------------------------------------------------------------
+# Recording a request
+# ---------------------------------------------------------------------------
+
+class Recorder:
+    """What one request did. Lives in a context variable for its duration."""
+
+    def __init__(self, trace=False):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.operation = None
+        # field -> [calls, seconds, queries, db seconds, bytes]
+        self.fields = {}
+        self.trace = [] if trace else None
+
+    def execute(self, execute, sql, params, many, context):
+        # A connection.execute_wrapper.
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.queries += 1
+            self.db_seconds += elapsed
+            if self.trace is not None:
+                self.trace.append({
+                    'sql': sql[:2000], 'at_ms': round((start - self.started) * 1000, 3),
+                    'ms': round(elapsed * 1000, 3),
+                })
+
+
+_recorder = ContextVar('metrics_recorder', default=None)
+
+
+def current_recorder():
+    return _recorder.get()
+
+
+@contextmanager
+def recording(recorder):
+    """Count the queries this thread's connections run into `recorder`."""
+    with ExitStack() as stack:
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(recorder.execute))
+        yield
+
+
+class MetricsMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            # Lets Django call this middleware without a thread hop.
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        options = _options()
+        if not options['ENABLED']:
+            return self.get_response(request)
+        recorder = self._recorder(options)
+        token = _recorder.set(recorder)
+        try:
+            with recording(recorder):
+                response = self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        self._record(request, response, recorder, options)
+        return response
+
+    async def __acall__(self, request):
+        # Only without the worker threads (core/workers.py), whose sync
+        # chain takes the path above; the views' queries aren't counted.
+        options = _options()
+        if not options['ENABLED']:
+            return await self.get_response(request)
+        recorder = self._recorder(options)
+        token = _recorder.set(recorder)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _recorder.reset(token)
+        self._record(request, response, recorder, options)
+        return response
+
+    def _recorder(self, options):
+        trace = bool(options['SLOW_TRACE_DIR']) and random.random() < options['SLOW_TRACE_SAMPLE_RATE']
+        return Recorder(trace)
+
+    def _record(self, request, response, recorder, options):
+        elapsed = time.perf_counter() - recorder.started
+        match = getattr(request, 'resolver_match', None)
+        route = match.route if match is not None else 'unmatched'
+        method = request.method
+        # Streaming bodies (exports) are produced after this returns; their
+        # size and queries aren't counted.
+        size = 0 if response.streaming else len(response.content)
+        HTTP_DURATION.observe(elapsed, method=method, route=route, status=response.status_code)
+        HTTP_QUERIES.observe(recorder.queries, method=method, route=route)
+        HTTP_DB_DURATION.observe(recorder.db_seconds, method=method, route=route)
+        HTTP_BYTES.observe(size, method=method, route=route)
+        if recorder.operation is not None:
+            operation, type = recorder.operation
+            OPERATION_DURATION.observe(elapsed, operation=operation, type=type)
+            OPERATION_QUERIES.observe(recorder.queries, operation=operation, type=type)
+            OPERATION_DB_DURATION.observe(recorder.db_seconds, operation=operation, type=type)
+            OPERATION_BYTES.observe(size, operation=operation, type=type)
+        for field, (calls, seconds, queries, db_seconds, returned) in recorder.fields.items():
+            FIELD_DURATION.observe(seconds, field=field)
+            FIELD_CALLS.inc(calls, field=field)
+            FIELD_QUERIES.inc(queries, field=field)
+            FIELD_DB_SECONDS.inc(db_seconds, field=field)
+            FIELD_BYTES.inc(returned, field=field)
+        if recorder.trace is not None and elapsed * 1000 >= options['SLOW_TRACE_THRESHOLD_MS']:
+            write_trace(options['SLOW_TRACE_DIR'], request, response, recorder, elapsed)
+
+
+def write_trace(directory, request, response, recorder, elapsed):
+    os.makedirs(directory, exist_ok=True)
+    trace = {
+        'at': time.time(),
+        'method': request.method,
+        'path': request.path,
+        'status': response.status_code,
+        'operation': recorder.operation,
+        'ms': round(elapsed * 1000, 3),
+        'queries': recorder.queries,
+        'db_ms': round(recorder.db_seconds * 1000, 3),
+        'events': sorted(recorder.trace, key=lambda event: event['at_ms']),
+    }
+    name = f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}.json"
+    with open(os.path.join(directory, name), 'w') as f:
+        json.dump(trace, f, indent=1, default=str)
+
+
+class GraphQLMetricsMiddleware:
+    """Graphene middleware attributing time, queries and bytes to fields."""
+
+    def resolve(self, next, root, info, **args):
+        recorder = _recorder.get()
+        if recorder is None:
+            return next(root, info, **args)
+        if recorder.operation is None:
+            operation = info.operation
+            recorder.operation = (operation.name.value if operation.name else 'anonymous', operation.operation.value)
+        field = f"{info.parent_type.name}.{info.field_name}"
+        queries, db_seconds = recorder.queries, recorder.db_seconds
+        start = time.perf_counter()
+        result = next(root, info, **args)
+        elapsed = time.perf_counter() - start
+        stats = recorder.fields.get(field)
+        if stats is None:
+            stats = recorder.fields[field] = [0, 0.0, 0, 0.0, 0]
+        stats[0] += 1
+        stats[1] += elapsed
+        stats[2] += recorder.queries - queries
+        stats[3] += recorder.db_seconds - db_seconds
+        if isinstance(result, (str, bytes)):
+            stats[4] += len(result)
+        elif isinstance(result, (int, float, bool)):
+            stats[4] += len(str(result))
+        if recorder.trace is not None:
+            recorder.trace.append({
+                'field': field, 'path': list(info.path.as_list()),
+                'at_ms': round((start - recorder.started) * 1000, 3), 'ms': round(elapsed * 1000, 3),
+                'queries': recorder.queries - queries,
+            })
+        return result
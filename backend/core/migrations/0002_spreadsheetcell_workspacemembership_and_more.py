@@ -0,0 +1,111 @@
+# Generated by Django 4.1.7 on 2026-10-16 22:53
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SpreadsheetCell',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('row', models.IntegerField()),
+                ('column', models.IntegerField()),
+                ('content', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='WorkspaceMembership',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('role', models.CharField(choices=[('ADMIN', 'Admin'), ('EDITOR', 'Editor'), ('VIEWER', 'Viewer')], default='VIEWER', max_length=10)),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='spreadsheet',
+            name='content',
+        ),
+        migrations.AddField(
+            model_name='invitation',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='invitation',
+            name='inviter',
+            field=models.ForeignKey(default=None, on_delete=django.db.models.deletion.CASCADE, related_name='sent_invitations', to=settings.AUTH_USER_MODEL),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='flag',
+            field=models.CharField(blank=True, max_length=255, null=True),
+        ),
+        migrations.AlterField(
+            model_name='invitation',
+            name='role',
+            field=models.CharField(choices=[('ADMIN', 'Admin'), ('EDITOR', 'Editor'), ('VIEWER', 'Viewer')], max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='invitation',
+            name='status',
+            field=models.CharField(choices=[('PENDING', 'Pending'), ('ACCEPTED', 'Accepted'), ('DECLINED', 'Declined')], default='PENDING', max_length=10),
+        ),
+        migrations.AlterField(
+            model_name='invitation',
+            name='workspace',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='invitations', to='core.workspace'),
+        ),
+        migrations.AlterField(
+            model_name='user',
+            name='email',
+            field=models.EmailField(blank=True, max_length=254, verbose_name='email address'),
+        ),
+        migrations.DeleteModel(
+            name='WorkspaceMember',
+        ),
+        migrations.AddField(
+            model_name='workspacemembership',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='workspacemembership',
+            name='workspace',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.workspace'),
+        ),
+        migrations.AddField(
+            model_name='spreadsheetcell',
+            name='spreadsheet',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='cells', to='core.spreadsheet'),
+        ),
+        migrations.AddField(
+            model_name='workspace',
+            name='members',
+            field=models.ManyToManyField(related_name='workspaces', through='core.WorkspaceMembership', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='workspacemembership',
+            unique_together={('user', 'workspace')},
+        ),
+        migrations.AlterUniqueTogether(
+            name='spreadsheetcell',
+            unique_together={('spreadsheet', 'row', 'column')},
+        ),
+    ]
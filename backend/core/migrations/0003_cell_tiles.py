@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-16 22:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_spreadsheetcell_workspacemembership_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='storage',
+            field=models.CharField(choices=[('ROWS', 'One row per cell'), ('TILES', 'Compressed tiles')], default='ROWS', max_length=10),
+        ),
+        migrations.CreateModel(
+            name='CellTile',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('tile_row', models.IntegerField()),
+                ('tile_column', models.IntegerField()),
+                ('data', models.BinaryField()),
+                ('spreadsheet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tiles', to='core.spreadsheet')),
+            ],
+            options={
+                'unique_together': {('spreadsheet', 'tile_row', 'tile_column')},
+            },
+        ),
+    ]
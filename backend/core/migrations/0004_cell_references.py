@@ -0,0 +1,72 @@
+# Generated by Django 4.1.7 on 2026-10-16 22:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+import json
+import re
+import uuid
+import zlib
+
+# Copies of core.references and core.storage as of this migration, so later
+# changes to them can't alter it.
+REFERENCE_RE = re.compile(r"=\['?(.*?)'?\]")
+TILE_SIZE = 64
+
+
+def reference_name(content):
+    match = REFERENCE_RE.search(content) if content else None
+    return match.group(1) if match else None
+
+
+def name_key(name):
+    return name.casefold()[:255]
+
+
+def backfill_references(apps, schema_editor):
+    SpreadsheetCell = apps.get_model('core', 'SpreadsheetCell')
+    CellTile = apps.get_model('core', 'CellTile')
+    CellReference = apps.get_model('core', 'CellReference')
+
+    def cells():
+        rows = SpreadsheetCell.objects.filter(content__contains="=[")
+        yield from rows.values_list('spreadsheet_id', 'row', 'column', 'content').iterator(chunk_size=2000)
+        for tile in CellTile.objects.iterator(chunk_size=16):
+            for r, c, content in json.loads(zlib.decompress(bytes(tile.data))):
+                yield tile.spreadsheet_id, tile.tile_row * TILE_SIZE + r, tile.tile_column * TILE_SIZE + c, content
+
+    batch = []
+    for spreadsheet_id, row, column, content in cells():
+        name = reference_name(content)
+        if name is not None:
+            batch.append(CellReference(
+                spreadsheet_id=spreadsheet_id, row=row, column=column, name=name, name_key=name_key(name),
+            ))
+        if len(batch) >= 2000:
+            CellReference.objects.bulk_create(batch)
+            batch = []
+    CellReference.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_cell_tiles'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CellReference',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('row', models.IntegerField()),
+                ('column', models.IntegerField()),
+                ('name', models.TextField()),
+                ('name_key', models.CharField(db_index=True, max_length=255)),
+                ('spreadsheet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='references', to='core.spreadsheet')),
+            ],
+            options={
+                'unique_together': {('spreadsheet', 'row', 'column')},
+            },
+        ),
+        migrations.RunPython(backfill_references, migrations.RunPython.noop),
+    ]
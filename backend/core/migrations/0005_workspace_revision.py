@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-16 23:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_cell_references'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='workspace',
+            name='revision',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-16 23:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_workspace_revision'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='celltile',
+            name='revision',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spreadsheet',
+            name='revision',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='spreadsheetcell',
+            name='revision',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='celltile',
+            index=models.Index(fields=['spreadsheet', 'revision'], name='core_cellti_spreads_027490_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='spreadsheetcell',
+            index=models.Index(fields=['spreadsheet', 'revision'], name='core_spread_spreads_5a6a57_idx'),
+        ),
+    ]
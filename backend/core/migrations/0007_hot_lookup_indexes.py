@@ -0,0 +1,37 @@
+# Generated by Django 4.1.7 on 2026-10-16 23:55
+
+from django.db import migrations, models
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_cell_revisions'),
+    ]
+
+    # No partial index on pending invitations' email: AcceptInvitation and
+    # UpdateInvitation look pending invitations up by id, which the primary
+    # key serves, and nothing lists them by email.
+    operations = [
+        migrations.AddIndex(
+            model_name='invitation',
+            index=models.Index(fields=['workspace', 'email', 'status'], name='core_invitation_ws_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='spreadsheet',
+            index=models.Index(django.db.models.functions.text.Lower('name'), name='core_sheet_lower_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='spreadsheet',
+            index=models.Index(fields=['workspace', 'created_at'], name='core_sheet_ws_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='user',
+            index=models.Index(fields=['email'], name='core_user_email_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='workspacemembership',
+            index=models.Index(fields=['workspace', 'user'], name='core_membership_ws_user_idx'),
+        ),
+    ]
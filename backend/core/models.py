@@ -1,10 +1,15 @@
 import uuid
 from django.db import models
+from django.db.models.functions import Lower
 from django.contrib.auth.models import AbstractUser
 
 class User(AbstractUser):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     
+    class Meta(AbstractUser.Meta):
+        # InviteUser looks users up by email.
+        indexes = [models.Index(fields=['email'], name='core_user_email_idx')]
+
     def __str__(self):
         return self.username
 
@@ -13,6 +18,9 @@ class Workspace(models.Model):
     name = models.CharField(max_length=100)
     owner = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owned_workspaces')
     members = models.ManyToManyField(User, through='WorkspaceMembership', related_name='workspaces')
+    # Bumped whenever the workspace is saved or a sheet or cell in it changes
+    # (see core/revisions.py).
+    revision = models.BigIntegerField(default=0)
 
     def __str__(self):
         return self.name
@@ -30,6 +38,8 @@ class WorkspaceMembership(models.Model):
     
     class Meta:
         unique_together = ('user', 'workspace')
+        # The unique index leads with the user; member lists go by workspace.
+        indexes = [models.Index(fields=['workspace', 'user'], name='core_membership_ws_user_idx')]
 
 class Invitation(models.Model):
     class Status(models.TextChoices):
@@ -45,16 +55,37 @@ class Invitation(models.Model):
     status = models.CharField(max_length=10, choices=Status.choices, default=Status.PENDING)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # InviteUser: the accepted invitation of an email to a workspace.
+            models.Index(fields=['workspace', 'email', 'status'], name='core_invitation_ws_email_idx'),
+        ]
+
 class Spreadsheet(models.Model):
+    class Storage(models.TextChoices):
+        ROWS = 'ROWS', 'One row per cell'
+        TILES = 'TILES', 'Compressed tiles'
+
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     workspace = models.ForeignKey(Workspace, on_delete=models.CASCADE, related_name='spreadsheets')
     name = models.CharField(max_length=100)
     created_at = models.DateTimeField(auto_now_add=True)
+    storage = models.CharField(max_length=10, choices=Storage.choices, default=Storage.ROWS)
+    # Bumped by every cell write; each written cell is stamped with the new value.
+    revision = models.BigIntegerField(default=0)
     
     # Secret flag for the CTF challenge
     flag = models.CharField(max_length=255, blank=True, null=True)
 
 
+    class Meta:
+        indexes = [
+            # Export resolves referenced sheet names case-insensitively.
+            models.Index(Lower('name'), name='core_sheet_lower_name_idx'),
+            # ReferenceIndex lists a workspace's sheets oldest first.
+            models.Index(fields=['workspace', 'created_at'], name='core_sheet_ws_created_idx'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -64,7 +95,39 @@ class SpreadsheetCell(models.Model):
     row = models.IntegerField()
     column = models.IntegerField()
     content = models.TextField(blank=True)
+    revision = models.BigIntegerField(default=0)
     
     class Meta:
         unique_together = ('spreadsheet', 'row', 'column')
+        indexes = [models.Index(fields=['spreadsheet', 'revision'])]
+
+
+class CellTile(models.Model):
+    # A fixed-size block of cells (see core/storage.py), stored as one
+    # compressed row for sheets using Spreadsheet.Storage.TILES.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    spreadsheet = models.ForeignKey(Spreadsheet, on_delete=models.CASCADE, related_name='tiles')
+    tile_row = models.IntegerField()
+    tile_column = models.IntegerField()
+    data = models.BinaryField()
+    # The highest revision of any cell in the tile.
+    revision = models.BigIntegerField(default=0)
 
+    class Meta:
+        unique_together = ('spreadsheet', 'tile_row', 'tile_column')
+        indexes = [models.Index(fields=['spreadsheet', 'revision'])]
+
+
+class CellReference(models.Model):
+    # A cross-sheet reference (`=['Name']`) found in a cell, extracted when the
+    # cell is written (see core/references.py). name_key is the case-folded
+    # name, cut to a length no sheet name can exceed.
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    spreadsheet = models.ForeignKey(Spreadsheet, on_delete=models.CASCADE, related_name='references')
+    row = models.IntegerField()
+    column = models.IntegerField()
+    name = models.TextField()
+    name_key = models.CharField(max_length=255, db_index=True)
+
+    class Meta:
+        unique_together = ('spreadsheet', 'row', 'column')
@@ -0,0 +1,86 @@
+"""
+Workspace permission resolution.
+
+A user's role in a workspace is memoized per request by the memberships
+loader and shared across requests, with a short TTL, through the
+settings.PERMISSION_CACHE cache. That cache must be shared by every process:
+membership changes invalidate the entry there (see core/signals.py), and
+each process must see that at once.
+"""
+from django.conf import settings
+from django.core.cache import caches
+
+from . import loaders
+from .models import Spreadsheet
+
+NOT_A_MEMBER = '-'
+
+# Seconds a spreadsheet's workspace stays cached.
+SPREADSHEET_CACHE_TTL = 3600
+
+
+def _ttl():
+    return getattr(settings, 'PERMISSION_CACHE_TTL', 30)
+
+
+def _cache():
+    return caches[getattr(settings, 'PERMISSION_CACHE', 'default')]
+
+
+def role_cache_key(user_id, workspace_id):
+    return f"perm:role:{user_id}:{workspace_id}"
+
+
+def cached_roles(keys):
+    """
+    Return {(user_id, workspace_id): role or None} for the keys present in
+    the shared cache.
+    """
+    found = _cache().get_many([role_cache_key(*key) for key in keys])
+    results = {}
+    for key in keys:
+        role = found.get(role_cache_key(*key))
+        if role is not None:
+            results[key] = None if role == NOT_A_MEMBER else role
+    return results
+
+
+def store_roles(roles):
+    _cache().set_many(
+        {role_cache_key(*key): role or NOT_A_MEMBER for key, role in roles.items()},
+        _ttl(),
+    )
+
+
+def invalidate_role(user_id, workspace_id):
+    _cache().delete(role_cache_key(user_id, workspace_id))
+
+
+def get_role(info, workspace_id):
+    """The calling user's role in the workspace, or None."""
+    user = info.context.user
+    if not user.is_authenticated:
+        return None
+    return loaders.get_loaders(info).memberships.load((user.pk, workspace_id))
+
+
+def sheet_cache_key(spreadsheet_id):
+    return f"perm:sheet:{spreadsheet_id}"
+
+
+def spreadsheet_workspace_id(spreadsheet_id):
+    """
+    The workspace a spreadsheet belongs to. Sheets never move, so this is
+    cached for SPREADSHEET_CACHE_TTL seconds, or until the sheet is deleted.
+    Raises Spreadsheet.DoesNotExist.
+    """
+    key = sheet_cache_key(spreadsheet_id)
+    workspace_id = _cache().get(key)
+    if workspace_id is None:
+        workspace_id = Spreadsheet.objects.values_list('workspace_id', flat=True).get(id=spreadsheet_id)
+        _cache().set(key, workspace_id, SPREADSHEET_CACHE_TTL)
+    return workspace_id
+
+
+def forget_spreadsheet(spreadsheet_id):
+    _cache().delete(sheet_cache_key(spreadsheet_id))
@@ -0,0 +1,176 @@
+"""
+Bulk user provisioning.
+
+Creates users the way CreateUser does (the user, a personal workspace and an
+ADMIN membership in it) for a whole roster at a time. Rosters are read as a
+stream, passwords are hashed in a process pool (hashing dominates the cost of
+creating a user) while the previous batch is inserted, and each batch is
+inserted with bulk_create in one transaction.
+
+Usernames that already exist are skipped, so a batch can be retried safely;
+`progress` is told how many roster records are done after every committed
+batch, which is where a later run can resume from.
+"""
+import csv
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+
+from .models import User, Workspace, WorkspaceMembership
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_BATCH_SIZE = 1000
+
+
+class RosterError(Exception):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Rosters
+# ---------------------------------------------------------------------------
+
+def roster_format(path):
+    extension = os.path.splitext(path)[1].lower().lstrip('.')
+    if extension in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if extension == 'csv':
+        return 'csv'
+    raise RosterError(f"Can't tell the roster format of {path}; pass one of {', '.join(FORMATS)}.")
+
+
+def read_roster(stream, format):
+    """
+    Yield a {'username', 'email', 'password'} dict per roster record from a
+    text stream. CSV rosters need a header row; JSONL rosters hold one object
+    per line. Records without a password get an unusable one.
+    """
+    if format == 'csv':
+        records = csv.DictReader(stream)
+    elif format == 'jsonl':
+        records = (json.loads(line) for line in stream if line.strip())
+    else:
+        raise RosterError(f"Unknown roster format: {format}")
+    for record in records:
+        yield {
+            'username': (record.get('username') or '').strip(),
+            'email': (record.get('email') or '').strip(),
+            'password': record.get('password') or None,
+        }
+
+
+# ---------------------------------------------------------------------------
+# Provisioning
+# ---------------------------------------------------------------------------
+
+class ProvisionResult:
+    def __init__(self, processed=0):
+        self.processed = processed
+        self.created = 0
+        self.skipped = 0
+        self.errors = []
+
+
+def _init_worker(settings_module):
+    # Workers started with spawn rather than fork need Django set up to hash.
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', settings_module)
+    django.setup()
+
+
+def _batches(records, size):
+    records = iter(records)
+    while True:
+        batch = list(islice(records, size))
+        if not batch:
+            return
+        yield batch
+
+
+def _insert(batch, passwords, result):
+    # Invalid records and existing usernames are skipped; duplicates in the
+    # roster keep their first record.
+    users = {}
+    for index, record in batch:
+        username = record['username']
+        if not username:
+            result.errors.append((index, "missing username"))
+        elif username not in users:
+            users[username] = User(username=username, email=record['email'], password=passwords[index])
+    with transaction.atomic():
+        existing = set(User.objects.filter(username__in=list(users)).values_list('username', flat=True))
+        users = [user for username, user in users.items() if username not in existing]
+        workspaces = [Workspace(name=f"{user.username}'s Workspace", owner=user) for user in users]
+        memberships = [
+            WorkspaceMembership(user=user, workspace=workspace, role=WorkspaceMembership.Role.ADMIN)
+            for user, workspace in zip(users, workspaces)
+        ]
+        # Primary keys are UUIDs assigned on instantiation, so the rows can
+        # be linked before they are inserted.
+        User.objects.bulk_create(users)
+        Workspace.objects.bulk_create(workspaces)
+        WorkspaceMembership.objects.bulk_create(memberships)
+    # New users and workspaces can't have cached roles, so there is nothing
+    # to invalidate in core/permissions.py.
+    result.created += len(users)
+    result.skipped += len(batch) - len(users)
+
+
+def provision(records, batch_size=DEFAULT_BATCH_SIZE, workers=None, start=0, progress=None):
+    """
+    Create a user, personal workspace and membership per roster record,
+    skipping the first `start` records. `progress(result)` is called after
+    every committed batch; result.processed counts records from the start of
+    the roster.
+    """
+    result = ProvisionResult(processed=start)
+    records = islice(enumerate(records), start, None)
+    settings_module = os.environ.get('DJANGO_SETTINGS_MODULE', 'ctf_challenge.settings')
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, batch_size // (workers * 4))
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(settings_module,)) as pool:
+        pending = None
+        for batch in _batches(records, batch_size):
+            # Start hashing this batch before inserting the previous one.
+            hashes = pool.map(make_password, [record['password'] for _, record in batch], chunksize=chunksize)
+            if pending is not None:
+                _commit(*pending, result, progress)
+            pending = (batch, hashes)
+        if pending is not None:
+            _commit(*pending, result, progress)
+    return result
+
+
+def _commit(batch, hashes, result, progress):
+    passwords = dict(zip((index for index, _ in batch), hashes))
+    _insert(batch, passwords, result)
+    result.processed = batch[-1][0] + 1
+    if progress is not None:
+        progress(result)
+
+
+# ---------------------------------------------------------------------------
+# Checkpoints
+# ---------------------------------------------------------------------------
+
+def read_checkpoint(path):
+    """Records already processed according to the checkpoint file, or 0."""
+    try:
+        with open(path) as f:
+            return int(json.load(f)['processed'])
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, result):
+    # Written to a temporary file and moved into place, so a crash never
+    # leaves a half-written checkpoint.
+    partial = f"{path}.part"
+    with open(partial, 'w') as f:
+        json.dump({'processed': result.processed, 'created': result.created, 'at': time.time()}, f)
+    os.replace(partial, path)
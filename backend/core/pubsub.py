@@ -0,0 +1,66 @@
+"""
+Publish/subscribe for GraphQL subscriptions.
+
+Publishers are ordinary (synchronous) request code; subscribers are async
+iterators running on the ASGI event loop. The backend is chosen by
+settings.PUBSUB["BACKEND"]. LocalPubSub delivers within this process only,
+which is enough when one ASGI process serves both the mutations and the
+subscriptions; a backend for several processes (Redis, Postgres LISTEN/NOTIFY)
+implements the same three methods.
+"""
+import asyncio
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+
+class LocalPubSub:
+    def __init__(self, **options):
+        self._subscribers = defaultdict(set)
+        self._lock = threading.Lock()
+
+    def publish(self, channel, message):
+        """Deliver `message` to every current subscriber of `channel`. Thread-safe."""
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, message)
+            except RuntimeError:
+                # The subscriber's loop has closed; it is about to unsubscribe.
+                pass
+
+    def has_subscribers(self, channel):
+        """False only when a publish to `channel` would certainly go nowhere."""
+        with self._lock:
+            return bool(self._subscribers.get(channel))
+
+    async def subscribe(self, channel):
+        """Async iterator over the messages published to `channel` from now on."""
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers[channel].add(subscriber)
+        try:
+            while True:
+                yield await subscriber[1].get()
+        finally:
+            with self._lock:
+                self._subscribers[channel].discard(subscriber)
+                if not self._subscribers[channel]:
+                    del self._subscribers[channel]
+
+
+_pubsub = None
+_pubsub_lock = threading.Lock()
+
+
+def get_pubsub():
+    global _pubsub
+    with _pubsub_lock:
+        if _pubsub is None:
+            config = getattr(settings, 'PUBSUB', {})
+            backend = import_string(config.get('BACKEND', 'core.pubsub.LocalPubSub'))
+            _pubsub = backend(**config.get('OPTIONS', {}))
+        return _pubsub
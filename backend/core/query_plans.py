@@ -0,0 +1,183 @@
+"""
+Query plan audit.
+
+PLANS lists the hot ORM queries, built the way the resolvers, loaders and
+export build them, with the tables each must reach through an index. audit()
+runs EXPLAIN on each and reports the plans that scan one of those tables from
+end to end. A planner rightly prefers scanning small tables, so audits run
+against seed() data, large enough that only a missing or unusable index
+produces a scan. QueryPlanTests in core/tests.py runs the audit.
+
+Scans are recognised in PostgreSQL ("Seq Scan on t") and SQLite ("SCAN t")
+plans; other databases aren't supported.
+"""
+import re
+from itertools import islice
+
+from django.db import connection, transaction
+from django.db.models.functions import Lower
+
+from .models import (
+    CellReference, Invitation, Spreadsheet, SpreadsheetCell, User, Workspace, WorkspaceMembership,
+)
+
+SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on "?(\w+)"?'),
+    'sqlite': re.compile(r'\bSCAN "?(\w+)"?'),
+}
+
+
+class Sample:
+    """Keys of seeded rows the audited queries look up."""
+
+    def __init__(self, user, workspace, sheet, invitation):
+        self.user = user
+        self.workspace = workspace
+        self.sheet = sheet
+        self.invitation = invitation
+
+
+class Plan:
+    def __init__(self, name, tables, build):
+        self.name = name
+        # Tables the query must not scan.
+        self.tables = tables
+        self.build = build
+
+
+PLANS = [
+    Plan("InviteUser: user by email", ['core_user'],
+         lambda s: User.objects.filter(email=s.user.email)),
+    Plan("InviteUser: existing membership", ['core_workspacemembership'],
+         lambda s: WorkspaceMembership.objects.filter(user=s.user, workspace_id=s.workspace.id)),
+    Plan("InviteUser: accepted invitation", ['core_invitation'],
+         lambda s: Invitation.objects.filter(
+             email=s.invitation.email, workspace_id=s.workspace.id, status=Invitation.Status.ACCEPTED,
+         )),
+    Plan("AcceptInvitation", ['core_invitation'],
+         lambda s: Invitation.objects.filter(
+             id=s.invitation.id, email=s.invitation.email, status=Invitation.Status.PENDING,
+         )),
+    Plan("MembershipLoader: roles", ['core_workspacemembership'],
+         lambda s: WorkspaceMembership.objects.filter(
+             user_id=s.user.id, workspace_id__in=[s.workspace.id],
+         ).values_list('workspace_id', 'role')),
+    Plan("WorkspacesByUserLoader", ['core_workspacemembership', 'core_workspace'],
+         lambda s: WorkspaceMembership.objects.filter(user_id__in=[s.user.id]).select_related('workspace')),
+    Plan("MembersByWorkspaceLoader", ['core_workspacemembership', 'core_user'],
+         lambda s: WorkspaceMembership.objects.filter(workspace_id__in=[s.workspace.id]).select_related('user')),
+    Plan("SpreadsheetsByWorkspaceLoader", ['core_spreadsheet', 'core_workspace'],
+         lambda s: Spreadsheet.objects.filter(workspace_id__in=[s.workspace.id]).select_related('workspace')),
+    Plan("workspaceById", ['core_workspace', 'core_workspacemembership'],
+         lambda s: Workspace.objects.filter(members=s.user, id=s.workspace.id)),
+    Plan("ReferenceIndex: sheets of a workspace", ['core_spreadsheet'],
+         lambda s: Spreadsheet.objects.filter(workspace_id=s.workspace.id).order_by('created_at')),
+    Plan("Export: referenced names", ['core_spreadsheet', 'core_cellreference'],
+         lambda s: CellReference.objects.filter(spreadsheet__workspace=s.workspace)
+         .values_list('name', flat=True).distinct()),
+    Plan("Export: sheets by name", ['core_spreadsheet'],
+         lambda s: Spreadsheet.objects.annotate(name_lower=Lower('name'))
+         .filter(name_lower__in=[s.sheet.name.lower()])),
+    Plan("Cells: window", ['core_spreadsheetcell'],
+         lambda s: SpreadsheetCell.objects.filter(spreadsheet_id=s.sheet.id, row__gte=0, row__lte=20)
+         .order_by('row', 'column')[:100]),
+    Plan("Cells: changed since", ['core_spreadsheetcell'],
+         lambda s: SpreadsheetCell.objects.filter(spreadsheet_id=s.sheet.id, revision__gt=0, revision__lte=1)
+         .order_by('revision', 'row', 'column')[:100]),
+    Plan("Provisioning: existing usernames", ['core_user'],
+         lambda s: User.objects.filter(username__in=[s.user.username]).values_list('username', flat=True)),
+]
+
+
+# ---------------------------------------------------------------------------
+# Seeding
+# ---------------------------------------------------------------------------
+
+def _bulk(model, objs, batch_size=2000):
+    objs = iter(objs)
+    while batch := list(islice(objs, batch_size)):
+        model.objects.bulk_create(batch)
+
+
+def seed(users=2000, sheets_per_workspace=4, invitations_per_workspace=10, cells_per_sheet=20):
+    """
+    Create `users` users, each with a workspace, its sheets (with cells and
+    references) and invitations, most of them answered. Returns a Sample
+    from the middle of the data.
+    """
+    with transaction.atomic():
+        people = [
+            User(username=f"plan.{n}", email=f"plan.{n}@example.com", password='!')
+            for n in range(users)
+        ]
+        _bulk(User, people)
+        workspaces = [Workspace(name=f"Workspace {n}", owner=user) for n, user in enumerate(people)]
+        _bulk(Workspace, workspaces)
+        _bulk(WorkspaceMembership, (
+            WorkspaceMembership(user=user, workspace=workspace, role=WorkspaceMembership.Role.ADMIN)
+            for user, workspace in zip(people, workspaces)
+        ))
+        sheets = [
+            Spreadsheet(workspace=workspace, name=f"Sheet {n}.{i}", revision=1)
+            for n, workspace in enumerate(workspaces) for i in range(sheets_per_workspace)
+        ]
+        _bulk(Spreadsheet, sheets)
+        _bulk(SpreadsheetCell, (
+            SpreadsheetCell(spreadsheet=sheet, row=i // 5, column=i % 5, content=str(i), revision=1)
+            for sheet in sheets for i in range(cells_per_sheet)
+        ))
+        _bulk(CellReference, (
+            CellReference(spreadsheet=sheet, row=0, column=9, name=f"Sheet {n}", name_key=f"sheet {n}")
+            for n, sheet in enumerate(sheets)
+        ))
+        statuses = [Invitation.Status.ACCEPTED, Invitation.Status.DECLINED, Invitation.Status.ACCEPTED]
+        invitations = [
+            Invitation(
+                workspace=workspace, inviter=workspace.owner, email=f"plan.{(n + i + 1) % users}@example.com",
+                role=WorkspaceMembership.Role.VIEWER,
+                # One open invitation per workspace; the rest have been answered.
+                status=Invitation.Status.PENDING if i == 0 else statuses[i % len(statuses)],
+            )
+            for n, workspace in enumerate(workspaces) for i in range(invitations_per_workspace)
+        ]
+        _bulk(Invitation, invitations)
+    with connection.cursor() as cursor:
+        # Fresh statistics, as autovacuum would have gathered by now.
+        cursor.execute("ANALYZE")
+    middle = users // 2
+    return Sample(
+        people[middle], workspaces[middle], sheets[middle * sheets_per_workspace],
+        invitations[middle * invitations_per_workspace],
+    )
+
+
+# ---------------------------------------------------------------------------
+# Auditing
+# ---------------------------------------------------------------------------
+
+def scanned_tables(plan_text, vendor=None):
+    pattern = SCAN_PATTERNS.get(vendor or connection.vendor)
+    if pattern is None:
+        raise ValueError(f"Can't read {vendor or connection.vendor} query plans.")
+    return {match.group(1) for match in pattern.finditer(plan_text)}
+
+
+class PlanResult:
+    def __init__(self, plan, text, scanned):
+        self.plan = plan
+        self.text = text
+        self.scanned = scanned
+
+    @property
+    def ok(self):
+        return not self.scanned
+
+
+def audit(sample, plans=PLANS):
+    """EXPLAIN every plan; returns a PlanResult per plan."""
+    results = []
+    for plan in plans:
+        text = plan.build(sample).explain()
+        scanned = sorted(scanned_tables(text) & set(plan.tables))
+        results.append(PlanResult(plan, text, scanned))
+    return results
@@ -0,0 +1,69 @@
+"""
+Cross-sheet references.
+
+A cell containing `=['Name']` refers to the sheet called Name. References are
+extracted when cells are written and stored as CellReference rows, so readers
+can resolve them in bulk instead of scanning cell contents.
+"""
+import re
+
+from django.db.models import Q
+
+from .models import CellReference, Spreadsheet
+
+REFERENCE_RE = re.compile(r"=\['?(.*?)'?\]")
+
+# Writes touching more cells than this diff against all of the sheet's
+# references instead of filtering by position.
+POSITION_FILTER_MAX = 100
+
+
+def reference_name(content):
+    """The sheet name referenced by a cell, or None."""
+    match = REFERENCE_RE.search(content) if content else None
+    return match.group(1) if match else None
+
+
+def name_key(name):
+    return name.casefold()[:255]
+
+
+def record(spreadsheet_id, writes):
+    """Replace the stored references at the positions in {(row, column): content}."""
+    existing = CellReference.objects.filter(spreadsheet_id=spreadsheet_id)
+    if len(writes) <= POSITION_FILTER_MAX:
+        positions = Q()
+        for row, column in writes:
+            positions |= Q(row=row, column=column)
+        existing = existing.filter(positions)
+    stale = [
+        reference_id
+        for reference_id, row, column in existing.values_list('id', 'row', 'column')
+        if (row, column) in writes
+    ]
+    if stale:
+        CellReference.objects.filter(id__in=stale).delete()
+
+    references = []
+    for (row, column), content in writes.items():
+        name = reference_name(content)
+        if name is not None:
+            references.append(CellReference(
+                spreadsheet_id=spreadsheet_id, row=row, column=column, name=name, name_key=name_key(name),
+            ))
+    CellReference.objects.bulk_create(references)
+
+
+class ReferenceIndex:
+    """Case-folded sheet names of one workspace, loaded once."""
+
+    def __init__(self, workspace_id):
+        self.sheets = {}
+        for sheet in Spreadsheet.objects.filter(workspace_id=workspace_id).order_by('created_at'):
+            self.sheets.setdefault(name_key(sheet.name), sheet)
+
+    def resolve(self, name):
+        return self.sheets.get(name_key(name))
+
+    def resolve_many(self, names):
+        return {name: self.resolve(name) for name in names}
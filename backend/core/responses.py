@@ -0,0 +1,162 @@
+"""
+Response cache for spreadsheet reads.
+
+Dashboards embed the same read-only sheets and poll spreadsheetById with the
+same queries. A query whose root fields are all spreadsheetById, and which
+selects no more of a sheet's workspace than its id and name, depends only on
+those sheets, their workspaces and the caller's role there. Its result is
+cached under (operation hash, variables, each sheet's revision and its
+workspace's revision, the caller's role there). Cell writes (UpdateCell,
+UpdateCells) bump the sheet's revision, and saving the workspace or creating,
+renaming or deleting its sheets bumps the workspace's, so changes never need
+to be invalidated explicitly. TIMEOUT only bounds how stale IMPORT_CSV results
+may get.
+
+Cached responses carry a weak ETag over their data, and GET requests whose
+If-None-Match names it get a 304 without a body.
+"""
+import hashlib
+import json
+import uuid
+
+from django.conf import settings
+from django.contrib.auth import authenticate
+from django.core.cache import cache
+from graphql import FieldNode, OperationType, get_operation_ast, value_from_ast_untyped
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.utils import get_credentials
+
+from .loaders import request_loaders
+from .models import Spreadsheet
+
+DEFAULTS = {
+    'ENABLED': True,
+    # Seconds a response is kept.
+    'TIMEOUT': 60,
+}
+
+# Root fields a cacheable operation may select, with the argument naming the sheet.
+SHEET_FIELDS = {'spreadsheetById': 'id'}
+# Fields of a sheet's workspace that follow the workspace's revision; its
+# members and owner don't.
+WORKSPACE_FIELDS = {'__typename', 'id', 'name'}
+
+
+def _options():
+    return dict(DEFAULTS, **getattr(settings, 'GRAPHQL_RESPONSE_CACHE', {}))
+
+
+def _follows_revisions(node):
+    # Whether everything `node` selects through a workspace is in WORKSPACE_FIELDS.
+    selection_set = getattr(node, 'selection_set', None)
+    for selection in selection_set.selections if selection_set is not None else ():
+        if isinstance(selection, FieldNode) and selection.name.value == 'workspace':
+            if not all(
+                isinstance(field, FieldNode) and field.name.value in WORKSPACE_FIELDS and field.selection_set is None
+                for field in selection.selection_set.selections
+            ):
+                return False
+        elif not _follows_revisions(selection):
+            return False
+    return True
+
+
+def _sheet_ids(document, operation_name, variables):
+    # The sheets a cacheable operation reads, or None.
+    operation = get_operation_ast(document, operation_name)
+    if operation is None or operation.operation != OperationType.QUERY:
+        return None
+    sheet_ids = set()
+    for selection in operation.selection_set.selections:
+        if not isinstance(selection, FieldNode):
+            return None
+        name = selection.name.value
+        if name == '__typename':
+            continue
+        if name not in SHEET_FIELDS:
+            return None
+        arguments = {
+            argument.name.value: value_from_ast_untyped(argument.value, variables)
+            for argument in selection.arguments or ()
+        }
+        try:
+            sheet_ids.add(uuid.UUID(str(arguments.get(SHEET_FIELDS[name]))))
+        except ValueError:
+            return None
+    # Fragments are checked whether the operation uses them or not.
+    for definition in document.definitions:
+        if not _follows_revisions(definition):
+            return None
+    return sheet_ids or None
+
+
+def request_user(request, session=True):
+    """
+    The request's user, authenticating its JWT now rather than in the GraphQL
+    middleware (which then finds the user already set). None if anonymous.
+    With session=False only the JWT counts, for views exempt from CSRF checks.
+    """
+    user = getattr(request, 'user', None)
+    if session and user is not None and user.is_authenticated:
+        return user
+    if get_credentials(request) is None:
+        return None
+    try:
+        user = authenticate(request=request)
+    except JSONWebTokenError:
+        # Left for the middleware to report.
+        return None
+    if user is not None:
+        request.user = user
+    return user
+
+
+def cache_key(request, query, document, operation_name, variables):
+    """The cache key of an operation, or None when its response isn't cacheable."""
+    if not _options()['ENABLED']:
+        return None
+    sheet_ids = _sheet_ids(document, operation_name, variables or {})
+    if sheet_ids is None:
+        return None
+    user = request_user(request)
+    if user is None:
+        return None
+    sheets = list(
+        Spreadsheet.objects.filter(id__in=sheet_ids)
+        .values_list('id', 'revision', 'workspace_id', 'workspace__revision')
+    )
+    if len(sheets) != len(sheet_ids):
+        return None
+    memberships = request_loaders(request).memberships
+    memberships.expect((user.pk, workspace_id) for _, _, workspace_id, _ in sheets)
+    state = sorted(
+        (str(sheet_id), revision, workspace_revision, memberships.load((user.pk, workspace_id)))
+        for sheet_id, revision, workspace_id, workspace_revision in sheets
+    )
+    key = json.dumps(
+        [hashlib.sha256(query.encode('utf-8')).hexdigest(), operation_name, variables, state],
+        sort_keys=True, default=str,
+    )
+    return f"graphql:response:{hashlib.sha256(key.encode('utf-8')).hexdigest()}"
+
+
+def get(key):
+    """(etag, data) of a cached response, or None."""
+    return cache.get(key)
+
+
+def store(key, data):
+    """Cache a response's data; returns its ETag."""
+    encoded = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+    etag = f'W/"{hashlib.sha256(encoded.encode("utf-8")).hexdigest()[:32]}"'
+    cache.set(key, (etag, data), _options()['TIMEOUT'])
+    return etag
+
+
+def etag_matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH')
+    if not header:
+        return False
+    # Weak comparison: W/ prefixes are ignored.
+    candidates = {candidate.strip().removeprefix('W/') for candidate in header.split(',')}
+    return '*' in candidates or etag.removeprefix('W/') in candidates
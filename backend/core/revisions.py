@@ -0,0 +1,55 @@
+"""
+Content revisions.
+
+Every workspace carries a counter that is bumped whenever one of its sheets or
+cells changes, so derived data (export archives) can be keyed by it. Cell
+writes bump it once their transaction commits, so concurrent writers to a
+workspace's sheets don't queue on its row; sheet changes bump it through
+core/signals.py.
+
+Sheets carry their own counter, bumped once per cell write. Written cells are
+stamped with it, which lets clients fetch only the cells changed since a
+revision they have seen, and make writes conditional on it.
+"""
+from django.db import transaction
+from django.db.models import F
+
+from .models import Spreadsheet, Workspace
+
+
+def touch_workspace(workspace_id):
+    Workspace.objects.filter(id=workspace_id).update(revision=F('revision') + 1)
+
+
+class RevisionConflict(Exception):
+    pass
+
+
+def begin_write(spreadsheet_id):
+    """
+    Allocate the revision for a write to a sheet's cells, and record the change
+    on its workspace once the write commits. Must run inside the write's
+    transaction: the sheet row stays locked until it commits, which orders
+    concurrent writes to the sheet.
+    """
+    sheet = Spreadsheet.objects.select_for_update().only('revision', 'workspace_id').get(id=spreadsheet_id)
+    revision = sheet.revision + 1
+    # A queryset update, so the Spreadsheet signals don't fire for cell writes.
+    Spreadsheet.objects.filter(id=spreadsheet_id).update(revision=revision)
+    workspace_id = sheet.workspace_id
+    transaction.on_commit(lambda: touch_workspace(workspace_id))
+    return revision
+
+
+def check_conflicts(changed, writes, expected_revision):
+    """
+    Raise RevisionConflict if a cell about to be written changed after
+    `expected_revision`. `changed` maps (row, column) -> that cell's revision.
+    """
+    conflicts = sorted(
+        position for position, revision in changed.items()
+        if revision > expected_revision and position in writes
+    )
+    if conflicts:
+        cells = ', '.join(f"({row},{column})" for row, column in conflicts[:10])
+        raise RevisionConflict(f"Cells changed since revision {expected_revision}: {cells}")
@@ -0,0 +1,192 @@
+"""
+Read-replica database routing.
+
+Most traffic only reads: GraphQL queries (spreadsheetById, currentUser) and
+workspace exports. Those requests run inside route(request, read_only=True)
+and read from one of the replicas, picked per request. Everything else reads
+from the primary ("default"), and every write goes there.
+
+Replicas lag behind the primary, so reads follow writes:
+
+- once a request writes, its later reads go to the primary;
+- read-only requests of the same caller (core.costs.request_identity) or
+  from the same address go to the primary for STICKY_SECONDS after it. The
+  flags saying so are kept in the CACHE cache, which must be shared by every
+  process (by default a database cache on the primary);
+- reads inside a transaction go to the primary.
+
+Data kept past the request, such as the formula engines, is read from the
+primary whatever the route.
+
+The replicas are the aliases in REPLICAS, by default every database in
+settings.DATABASES besides "default". Trying it locally takes a second
+database holding a copy of the first, e.g. for SQLite:
+
+    DATABASES['replica'] = dict(DATABASES['default'], NAME='replica.sqlite3')
+
+Without replicas every request uses the primary.
+"""
+import contextvars
+import random
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.http import FileResponse
+
+from . import costs
+
+DEFAULTS = {
+    # Database aliases to read from; None for every alias besides "default".
+    'REPLICAS': None,
+    # Seconds a caller reads from the primary after writing.
+    'STICKY_SECONDS': 5,
+    # Cache alias holding those callers; every process must see the same one.
+    'CACHE': 'default',
+}
+
+# The app label of django.core.cache.backends.db.DatabaseCache's table.
+CACHE_APP_LABEL = 'django_cache'
+
+
+def _options():
+    return dict(DEFAULTS, **getattr(settings, 'REPLICA_ROUTING', {}))
+
+
+def replicas():
+    aliases = _options()['REPLICAS']
+    if aliases is None:
+        aliases = [alias for alias in settings.DATABASES if alias != DEFAULT_DB_ALIAS]
+    return list(aliases)
+
+
+class Route:
+    """Where the current request reads from."""
+
+    def __init__(self, request, replica):
+        self.request = request
+        # None reads from the primary.
+        self.replica = replica
+        self.wrote = False
+
+
+_route = contextvars.ContextVar('db_route', default=None)
+
+
+def _sticky_key(caller):
+    return f"routing:primary:{caller}"
+
+
+def _sticky_cache():
+    return caches[_options()['CACHE']]
+
+
+def _callers(request):
+    # The caller, and its address for the requests it makes before it has
+    # a user (e.g. a query right after the mutation that registered it).
+    return sorted({costs.request_identity(request), f"ip:{request.META.get('REMOTE_ADDR', '')}"})
+
+
+@contextmanager
+def route(request, read_only):
+    """Route the queries made inside to a replica if read_only, else to the primary."""
+    aliases = replicas()
+    replica = None
+    if read_only and aliases and not _sticky_cache().get_many([_sticky_key(caller) for caller in _callers(request)]):
+        replica = random.choice(aliases)
+    token = _route.set(Route(request, replica))
+    try:
+        yield
+    finally:
+        _route.reset(token)
+
+
+def reads_replica():
+    """Whether the current request reads from a replica."""
+    current = _route.get()
+    return current is not None and current.replica is not None
+
+
+def stream(iterable):
+    """
+    Iterate over iterable in the current route. Streaming bodies are produced
+    after the view has returned and left it.
+    """
+    context = contextvars.copy_context()
+    iterator = iter(iterable)
+
+    def chunks():
+        try:
+            while True:
+                try:
+                    chunk = context.run(next, iterator)
+                except StopIteration:
+                    return
+                yield chunk
+        finally:
+            if hasattr(iterator, 'close'):
+                context.run(iterator.close)
+    return chunks()
+
+
+def read_only_view(view):
+    """Serve a view, and the body it streams, from a replica."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with route(request, read_only=True):
+            response = view(request, *args, **kwargs)
+            # Files are streamed as they are, without queries.
+            if response.streaming and not isinstance(response, FileResponse):
+                response.streaming_content = stream(response.streaming_content)
+        return response
+    return wrapper
+
+
+def primary_view(view):
+    """Serve a view from the primary, and its caller too for a while if it writes."""
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        with route(request, read_only=False):
+            return view(request, *args, **kwargs)
+    return wrapper
+
+
+class ReplicaRouter:
+    """Database router for settings.DATABASE_ROUTERS; see route()."""
+
+    def db_for_read(self, model, **hints):
+        current = _route.get()
+        if (
+            current is None or current.replica is None or model._meta.app_label == CACHE_APP_LABEL
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return current.replica
+
+    def db_for_write(self, model, **hints):
+        current = _route.get()
+        # Writes to a database cache (such as the sticky flags) aren't the caller's.
+        if current is not None and not current.wrote and model._meta.app_label != CACHE_APP_LABEL:
+            current.wrote = True
+            current.replica = None
+            if replicas():
+                _sticky_cache().set_many(
+                    {_sticky_key(caller): True for caller in _callers(current.request)},
+                    _options()['STICKY_SECONDS'],
+                )
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the primary's rows.
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Replicas get the schema (and the cache tables) from the primary.
+        if db in replicas():
+            return False
+        return None
@@ -1,74 +1,213 @@
 import graphene
 import graphql_jwt
 from graphene_django import DjangoObjectType
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.db import transaction
 from .models import Workspace, WorkspaceMembership, Spreadsheet, SpreadsheetCell, Invitation
-import re
-import requests
+from . import engine, routing, storage
+from .imports import get_fetcher, import_url
+from .loaders import get_loaders
+from .permissions import get_role, spreadsheet_workspace_id
+from .pubsub import get_pubsub
+from asgiref.sync import sync_to_async
+import base64
 import json
 import time
 
+# --- Cell helpers ---
+
+def encode_cursor(row, column):
+    return base64.urlsafe_b64encode(f"{row}:{column}".encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        row, column = base64.urlsafe_b64decode(cursor.encode()).decode().split(':')
+        return int(row), int(column)
+    except (ValueError, UnicodeDecodeError):
+        raise Exception("Invalid cursor.")
+
+def evaluated_content(spreadsheet_id, row, column, content, revision=None):
+    # VULNERABILITY 2: SSRF in IMPORT_CSV
+    # This function is where the SSRF vulnerability is introduced.
+    url = import_url(content)
+    if url:
+        # No validation on the URL, allowing internal network requests
+        return get_fetcher().get(url)[:500] # Truncate for display
+
+    if not content.startswith('='):
+        return content
+    # `revision` is the cell's: an engine built before it was written is stale.
+    return engine.get_engine(spreadsheet_id, revision).display(row, column)
+
+def cell_channel(spreadsheet_id):
+    return f"cells:{spreadsheet_id}"
+
+def publish_cell_changes(spreadsheet_id, cells, revision):
+    """
+    Apply committed (row, column, content) writes of a sheet revision to the
+    engine and push them, with the formula cells they changed, to cellChanged
+    subscribers.
+    """
+    dirty = engine.cells_updated(spreadsheet_id, cells, revision)
+    channel = cell_channel(spreadsheet_id)
+    pubsub = get_pubsub()
+    if not pubsub.has_subscribers(channel):
+        return
+    written = {(row, column): content for row, column, content in cells}
+    changes = [
+        {'row': row, 'column': column, 'content': content,
+         'evaluated_content': evaluated_content(spreadsheet_id, row, column, content, revision)}
+        for (row, column), content in written.items()
+    ]
+    sheet_engine = engine.peek_engine(spreadsheet_id)
+    for row, column in sorted(dirty - written.keys()):
+        changes.append({'row': row, 'column': column, 'content': sheet_engine.content(row, column),
+                        'evaluated_content': sheet_engine.display(row, column)})
+    pubsub.publish(channel, changes)
+
 # --- Object Types ---
 
 class UserType(DjangoObjectType):
     class Meta:
         model = get_user_model()
-        fields = ('id', 'username', 'email')
+        fields = ('id', 'username', 'email', 'workspaces')
+
+    def resolve_workspaces(self, info):
+        # Only the caller's own workspace list is visible.
+        user = info.context.user
+        if not user.is_authenticated or user.pk != self.pk:
+            return []
+        loaders = get_loaders(info)
+        workspaces = loaders.workspaces_by_user.load(user.pk)
+        ids = [workspace.id for workspace in workspaces]
+        loaders.spreadsheets_by_workspace.expect(ids)
+        loaders.workspace_members.expect(ids)
+        loaders.users.expect(workspace.owner_id for workspace in workspaces)
+        return workspaces
 
 class WorkspaceType(DjangoObjectType):
+    # Declared explicitly: the generated foreign key field re-fetches the
+    # related row through get_node() on every object.
+    owner = graphene.Field(UserType, required=True)
+
     class Meta:
         model = Workspace
         fields = ('id', 'name', 'owner', 'members', 'spreadsheets')
 
+    def resolve_owner(self, info):
+        return get_loaders(info).users.load(self.owner_id)
+
+    def resolve_members(self, info):
+        return get_loaders(info).workspace_members.load(self.id)
+
+    def resolve_spreadsheets(self, info):
+        return get_loaders(info).spreadsheets_by_workspace.load(self.id)
+
 class SpreadsheetType(DjangoObjectType):
+    workspace = graphene.Field(WorkspaceType, required=True)
+    # Without arguments the whole sheet is returned. The range arguments are
+    # inclusive and `first`/`after` page through the window in (row, column)
+    # order, which is the order of the (spreadsheet, row, column) index.
+    cells = graphene.List(
+        graphene.NonNull(lambda: SpreadsheetCellType),
+        required=True,
+        row_start=graphene.Int(),
+        row_end=graphene.Int(),
+        column_start=graphene.Int(),
+        column_end=graphene.Int(),
+        first=graphene.Int(),
+        after=graphene.String(),
+    )
+
     class Meta:
         model = Spreadsheet
-        fields = ('id', 'name', 'workspace', 'cells', 'flag')
-    
+        fields = ('id', 'name', 'workspace', 'cells', 'flag', 'revision')
+
+    def resolve_cells(self, info, row_start=None, row_end=None, column_start=None,
+                      column_end=None, first=None, after=None):
+        windowed = any(arg is not None for arg in (row_start, row_end, column_start, column_end, first, after))
+        if not windowed:
+            cells = get_loaders(info).cells_by_spreadsheet.load(self.id)
+            # Whole-sheet reads are costed at no more than a page (core/costs.py).
+            if cells is None:
+                raise Exception(
+                    f"The sheet has more than {settings.CELLS_PAGE_MAX} cells; read it in windows or pages."
+                )
+        else:
+            after = decode_cursor(after) if after is not None else None
+            if first is not None:
+                first = max(0, min(first, settings.CELLS_PAGE_MAX))
+            cells = storage.cell_window(
+                self.id, (row_start, row_end), (column_start, column_end), after, first, self.storage,
+            )
+        # Start every IMPORT_CSV fetch of the sheet up front so they run
+        # concurrently instead of one per evaluatedContent resolver.
+        urls = [url for url in (import_url(cell.content) for cell in cells) if url]
+        get_fetcher().prefetch(urls)
+        if any(cell.content.startswith('=') for cell in cells):
+            if windowed:
+                # Formulas may read cells outside the window: the engine
+                # always holds the whole sheet.
+                engine.get_engine(self.id, self.revision)
+            elif routing.reads_replica():
+                # The engine is shared by later requests: build it from the primary.
+                engine.get_engine(self.id, self.revision)
+            else:
+                # Build the sheet's engine from the rows already loaded.
+                engine.get_engine(self.id, self.revision, ((cell.row, cell.column, cell.content) for cell in cells))
+        return cells
+
     def resolve_flag(self, info):
         # Only admins of the workspace can see the flag.
-        user = info.context.user
-        if not user.is_authenticated:
-            return None
-        try:
-            membership = WorkspaceMembership.objects.get(workspace=self.workspace, user=user)
-            if membership.role == WorkspaceMembership.Role.ADMIN:
-                return self.flag
-        except WorkspaceMembership.DoesNotExist:
-            pass
+        if get_role(info, self.workspace_id) == WorkspaceMembership.Role.ADMIN:
+            return self.flag
         return None
 
 class SpreadsheetCellType(DjangoObjectType):
     evaluated_content = graphene.String()
+    cursor = graphene.String()
 
     class Meta:
         model = SpreadsheetCell
-        fields = ('id', 'row', 'column', 'content')
+        fields = ('id', 'row', 'column', 'content', 'revision')
     
     def resolve_evaluated_content(self, info):
-        # VULNERABILITY 2: SSRF in IMPORT_CSV
-        # This function is where the SSRF vulnerability is introduced.
-        if self.content.startswith('=IMPORT_CSV("') and self.content.endswith('")'):
-            url_match = re.search(r'"(.*?)"', self.content)
-            if url_match:
-                url = url_match.group(1)
-                try:
-                    # No validation on the URL, allowing internal network requests
-                    response = requests.get(url, timeout=3)
-                    if response.status_code == 200:
-                        return response.text[:500] # Truncate for display
-                    else:
-                        return f"#ERROR: Status {response.status_code}"
-                except requests.RequestException as e:
-                    return f"#ERROR: {str(e)}"
-        
-        # Non-vulnerable formula examples
-        if self.content.startswith('=SUM('):
-            return "#SUM_RESULT"
-        if self.content.startswith('=AVERAGE('):
-            return "#AVG_RESULT"
+        return evaluated_content(self.spreadsheet_id, self.row, self.column, self.content, self.revision)
+
+    def resolve_cursor(self, info):
+        return encode_cursor(self.row, self.column)
+
+class CellInput(graphene.InputObjectType):
+    row = graphene.Int(required=True)
+    column = graphene.Int(required=True)
+    content = graphene.String(required=True)
+
+class CellResult(graphene.ObjectType):
+    # Compact per-cell result of UpdateCells; evaluatedContent is only
+    # computed when selected.
+    row = graphene.Int()
+    column = graphene.Int()
+    revision = graphene.BigInt()
+    evaluated_content = graphene.String()
+
+    def resolve_evaluated_content(self, info):
+        return evaluated_content(self.spreadsheet_id, self.row, self.column, self.content, self.revision)
+
+class CellChangeType(graphene.ObjectType):
+    row = graphene.Int(required=True)
+    column = graphene.Int(required=True)
+    content = graphene.String(required=True)
+    evaluated_content = graphene.String()
 
-        return self.content
+class CellChangesType(graphene.ObjectType):
+    # The sheet's revision now; pass it as `revision` next time. Cleared
+    # cells come back with empty content. When `truncated` is set there were
+    # more changes than one response holds and the client should refetch the
+    # sheet instead.
+    revision = graphene.BigInt(required=True)
+    cells = graphene.List(graphene.NonNull(SpreadsheetCellType), required=True)
+    truncated = graphene.Boolean(required=True)
 
 # --- Queries ---
 
@@ -76,6 +215,11 @@ class Query(graphene.ObjectType):
     current_user = graphene.Field(UserType)
     workspace_by_id = graphene.Field(WorkspaceType, id=graphene.UUID())
     spreadsheet_by_id = graphene.Field(SpreadsheetType, id=graphene.UUID())
+    cells_changed_since = graphene.Field(
+        CellChangesType,
+        spreadsheet_id=graphene.UUID(required=True),
+        revision=graphene.BigInt(required=True),
+    )
 
     def resolve_current_user(self, info):
         user = info.context.user
@@ -93,11 +237,25 @@ class Query(graphene.ObjectType):
         user = info.context.user
         if not user.is_authenticated:
             return None
-        spreadsheet = Spreadsheet.objects.filter(id=id).first()
-        if spreadsheet and WorkspaceMembership.objects.filter(workspace=spreadsheet.workspace, user=user).exists():
+        spreadsheet = Spreadsheet.objects.filter(id=id).select_related('workspace').first()
+        if spreadsheet and get_role(info, spreadsheet.workspace_id) is not None:
             return spreadsheet
         return None
 
+    def resolve_cells_changed_since(self, info, spreadsheet_id, revision):
+        user = info.context.user
+        if not user.is_authenticated:
+            return None
+        try:
+            workspace_id = spreadsheet_workspace_id(spreadsheet_id)
+        except Spreadsheet.DoesNotExist:
+            return None
+        if get_role(info, workspace_id) is None:
+            return None
+        limit = settings.CELLS_PAGE_MAX
+        current, cells = storage.changed_since(spreadsheet_id, revision, limit + 1)
+        return CellChangesType(revision=current, cells=cells[:limit], truncated=len(cells) > limit)
+
 # --- Mutations ---
 
 class CreateUser(graphene.Mutation):
@@ -153,15 +311,15 @@ class CreateSpreadsheet(graphene.Mutation):
         if not user.is_authenticated:
             raise Exception("Authentication required")
 
-        try:
-            membership = WorkspaceMembership.objects.get(user=user, workspace_id=workspace_id)
-            if membership.role not in [WorkspaceMembership.Role.ADMIN, WorkspaceMembership.Role.EDITOR]:
-                raise Exception("You don't have permission to create spreadsheets in this workspace.")
-        except WorkspaceMembership.DoesNotExist:
+        role = get_role(info, workspace_id)
+        if role is None:
             raise Exception("You are not a member of this workspace.")
-        
-        workspace = membership.workspace
-        spreadsheet = Spreadsheet.objects.create(workspace=workspace, name=name)
+        if role not in [WorkspaceMembership.Role.ADMIN, WorkspaceMembership.Role.EDITOR]:
+            raise Exception("You don't have permission to create spreadsheets in this workspace.")
+
+        spreadsheet = Spreadsheet.objects.create(
+            workspace_id=workspace_id, name=name, storage=settings.CELL_STORAGE_DEFAULT
+        )
         return CreateSpreadsheet(spreadsheet=spreadsheet)
 
 class UpdateCell(graphene.Mutation):
@@ -172,28 +330,54 @@ class UpdateCell(graphene.Mutation):
         row = graphene.Int(required=True)
         column = graphene.Int(required=True)
         content = graphene.String(required=True)
+        # Fail instead of writing if the cell changed after this revision.
+        expected_revision = graphene.BigInt()
 
-    def mutate(self, info, spreadsheet_id, row, column, content):
+    def mutate(self, info, spreadsheet_id, row, column, content, expected_revision=None):
         user = info.context.user
         if not user.is_authenticated:
             raise Exception("Authentication required")
         
-        spreadsheet = Spreadsheet.objects.get(id=spreadsheet_id)
-        try:
-            membership = WorkspaceMembership.objects.get(user=user, workspace=spreadsheet.workspace)
-            if membership.role not in [WorkspaceMembership.Role.ADMIN, WorkspaceMembership.Role.EDITOR]:
-                raise Exception("You don't have permission to edit this spreadsheet.")
-        except WorkspaceMembership.DoesNotExist:
+        role = get_role(info, spreadsheet_workspace_id(spreadsheet_id))
+        if role is None:
             raise Exception("You are not a member of this workspace.")
+        if role not in [WorkspaceMembership.Role.ADMIN, WorkspaceMembership.Role.EDITOR]:
+            raise Exception("You don't have permission to edit this spreadsheet.")
 
-        cell, created = SpreadsheetCell.objects.update_or_create(
-            spreadsheet=spreadsheet,
-            row=row,
-            column=column,
-            defaults={'content': content}
-        )
+        cell = storage.write_cell(spreadsheet_id, row, column, content, expected_revision)
+        transaction.on_commit(lambda: publish_cell_changes(spreadsheet_id, [(row, column, content)], cell.revision))
         return UpdateCell(cell=cell)
 
+class UpdateCells(graphene.Mutation):
+    results = graphene.List(CellResult)
+
+    class Arguments:
+        spreadsheet_id = graphene.UUID(required=True)
+        cells = graphene.List(graphene.NonNull(CellInput), required=True)
+        # Fail instead of writing if any of the cells changed after this revision.
+        expected_revision = graphene.BigInt()
+
+    def mutate(self, info, spreadsheet_id, cells, expected_revision=None):
+        user = info.context.user
+        if not user.is_authenticated:
+            raise Exception("Authentication required")
+
+        role = get_role(info, spreadsheet_workspace_id(spreadsheet_id))
+        if role is None:
+            raise Exception("You are not a member of this workspace.")
+        if role not in [WorkspaceMembership.Role.ADMIN, WorkspaceMembership.Role.EDITOR]:
+            raise Exception("You don't have permission to edit this spreadsheet.")
+        if len(cells) > settings.UPDATE_CELLS_MAX:
+            raise Exception(f"At most {settings.UPDATE_CELLS_MAX} cells can be written at once.")
+
+        # The upsert cannot touch the same row twice; the last write wins.
+        writes = {(cell.row, cell.column): cell.content for cell in cells}
+        objs = storage.write_cells(spreadsheet_id, writes, expected_revision)
+        changed = [(row, column, content) for (row, column), content in writes.items()]
+        if objs:
+            transaction.on_commit(lambda: publish_cell_changes(spreadsheet_id, changed, objs[0].revision))
+        return UpdateCells(results=objs)
+
 class InviteUser(graphene.Mutation):
     invitation = graphene.Field(lambda: InvitationType)
 
@@ -207,12 +391,11 @@ class InviteUser(graphene.Mutation):
         if not inviter.is_authenticated:
             raise Exception("Authentication required")
 
-        try:
-            membership = WorkspaceMembership.objects.get(user=inviter, workspace_id=workspace_id)
-            if membership.role != WorkspaceMembership.Role.ADMIN:
-                raise Exception("Only admins can invite users.")
-        except WorkspaceMembership.DoesNotExist:
+        inviter_role = get_role(info, workspace_id)
+        if inviter_role is None:
             raise Exception("You are not a member of this workspace.")
+        if inviter_role != WorkspaceMembership.Role.ADMIN:
+            raise Exception("Only admins can invite users.")
             
         # VULNERABILITY 3 (PART A): Information Leak
         # If the user is already a member, don't fail. Instead, leak their original invitation ID.
@@ -317,7 +500,31 @@ class Mutation(graphene.ObjectType):
     create_workspace = CreateWorkspace.Field()
     create_spreadsheet = CreateSpreadsheet.Field()
     update_cell = UpdateCell.Field()
+    update_cells = UpdateCells.Field()
     invite_user = InviteUser.Field()
     update_invitation = UpdateInvitation.Field() # Vulnerable mutation
     accept_invitation = AcceptInvitation.Field()
 
+
+
+# --- Subscriptions ---
+
+def _subscriber_role(info, spreadsheet_id):
+    try:
+        workspace_id = spreadsheet_workspace_id(spreadsheet_id)
+    except Spreadsheet.DoesNotExist:
+        return None
+    return get_role(info, workspace_id)
+
+class Subscription(graphene.ObjectType):
+    # Each event lists the cells changed by one committed write.
+    cell_changed = graphene.List(
+        graphene.NonNull(CellChangeType), spreadsheet_id=graphene.UUID(required=True)
+    )
+
+    async def subscribe_cell_changed(root, info, spreadsheet_id):
+        if not info.context.user.is_authenticated:
+            raise Exception("Authentication required")
+        if await sync_to_async(_subscriber_role)(info, spreadsheet_id) is None:
+            raise Exception("You are not a member of this workspace.")
+        return get_pubsub().subscribe(cell_channel(spreadsheet_id))
@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auth import get_token_cache
+from .models import Spreadsheet, User, Workspace, WorkspaceMembership
+from .permissions import forget_spreadsheet, invalidate_role
+from .revisions import touch_workspace
+
+
+@receiver([post_save, post_delete], sender=User)
+def user_changed(sender, instance, **kwargs):
+    # Deactivation and password changes must not wait for cached tokens to expire.
+    get_token_cache().evict_user(instance.pk)
+
+
+@receiver([post_save, post_delete], sender=WorkspaceMembership)
+def membership_changed(sender, instance, **kwargs):
+    invalidate_role(instance.user_id, instance.workspace_id)
+
+
+@receiver(post_delete, sender=Spreadsheet)
+def spreadsheet_deleted(sender, instance, **kwargs):
+    forget_spreadsheet(instance.id)
+
+
+@receiver([post_save, post_delete], sender=Spreadsheet)
+def spreadsheet_changed(sender, instance, **kwargs):
+    touch_workspace(instance.workspace_id)
+
+
+@receiver(post_save, sender=Workspace)
+def workspace_changed(sender, instance, **kwargs):
+    # Cached sheet reads may include the workspace's name (core/responses.py).
+    touch_workspace(instance.id)
@@ -0,0 +1,405 @@
+"""
+Cell storage backends.
+
+Every read and write of spreadsheet cells goes through this module so a sheet
+can use either backend:
+
+* ROWS  - one SpreadsheetCell row per cell (the original layout).
+* TILES - cells packed into TILE_SIZE x TILE_SIZE blocks, each stored as one
+          zlib-compressed CellTile row.
+
+Readers get SpreadsheetCell instances either way. Cells read from tiles are
+not saved rows; they carry a stable id derived from the sheet and position.
+
+Every write is stamped with a new sheet revision (core/revisions.py). Cleared
+cells are kept with empty content in both backends, so `changed_since` can
+report them.
+"""
+import json
+import uuid
+import zlib
+from collections import defaultdict
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Q
+
+from . import references, revisions
+from .models import CellTile, Spreadsheet, SpreadsheetCell
+
+TILE_SIZE = 64
+
+
+def tile_cell_id(spreadsheet_id, row, column):
+    # Derived from the sheet id and position; cheap enough to mint per cell.
+    if not isinstance(spreadsheet_id, uuid.UUID):
+        spreadsheet_id = uuid.UUID(str(spreadsheet_id))
+    return uuid.UUID(int=spreadsheet_id.int ^ (((row + 1) << 32) | column))
+
+
+def encode_tile(cells):
+    """`cells` maps (row offset, column offset) -> (content, revision)."""
+    payload = [[r, c, content, revision] for (r, c), (content, revision) in sorted(cells.items())]
+    return zlib.compress(json.dumps(payload, separators=(',', ':')).encode())
+
+
+def _tile_entries(data):
+    # Tiles written before revisions were tracked hold [r, c, content].
+    for entry in json.loads(zlib.decompress(bytes(data))):
+        yield entry[0], entry[1], entry[2], entry[3] if len(entry) > 3 else 0
+
+
+def decode_tile(data):
+    return {(r, c): (content, revision) for r, c, content, revision in _tile_entries(data)}
+
+
+def _tile_rows(tile, with_revision=False):
+    base_row = tile.tile_row * TILE_SIZE
+    base_column = tile.tile_column * TILE_SIZE
+    for r, c, content, revision in _tile_entries(tile.data):
+        if with_revision:
+            yield base_row + r, base_column + c, content, revision
+        else:
+            yield base_row + r, base_column + c, content
+
+
+def _as_cell(spreadsheet_id, row, column, content, revision=0):
+    return SpreadsheetCell(
+        id=tile_cell_id(spreadsheet_id, row, column),
+        spreadsheet_id=spreadsheet_id,
+        row=row,
+        column=column,
+        content=content,
+        revision=revision,
+    )
+
+
+class CellOutOfBounds(Exception):
+    pass
+
+
+def check_bounds(positions):
+    """Raise CellOutOfBounds unless every (row, column) lies inside the sheet."""
+    for row, column in positions:
+        if not (0 <= row < settings.SHEET_MAX_ROWS and 0 <= column < settings.SHEET_MAX_COLUMNS):
+            raise CellOutOfBounds(
+                f"Cell ({row},{column}) is outside the sheet: rows go from 0 to {settings.SHEET_MAX_ROWS - 1} "
+                f"and columns from 0 to {settings.SHEET_MAX_COLUMNS - 1}."
+            )
+
+
+def spreadsheet_storage(spreadsheet_id):
+    """
+    The storage backend of a sheet, as stored on its row. Any process may
+    convert a sheet, so it isn't cached: writers read it after
+    revisions.begin_write has locked the row, which convert() locks too.
+    """
+    return Spreadsheet.objects.values_list('storage', flat=True).get(id=spreadsheet_id)
+
+
+# --- Row storage ---
+
+class RowStore:
+    def load(self, spreadsheet_ids, limit=None):
+        results = defaultdict(list)
+        if limit is not None:
+            counts = SpreadsheetCell.objects.filter(spreadsheet_id__in=spreadsheet_ids).values_list(
+                'spreadsheet_id',
+            ).annotate(count=Count('id'))
+            over = {spreadsheet_id for spreadsheet_id, count in counts if count > limit}
+            results.update((spreadsheet_id, None) for spreadsheet_id in over)
+            spreadsheet_ids = [spreadsheet_id for spreadsheet_id in spreadsheet_ids if spreadsheet_id not in over]
+        cells = SpreadsheetCell.objects.filter(spreadsheet_id__in=spreadsheet_ids).order_by('row', 'column')
+        for cell in cells:
+            results[cell.spreadsheet_id].append(cell)
+        return results
+
+    def iter_rows(self, spreadsheet_id, chunk_size, using=None):
+        return SpreadsheetCell.objects.using(using).filter(spreadsheet_id=spreadsheet_id).order_by(
+            'row', 'column'
+        ).values_list('row', 'column', 'content').iterator(chunk_size=chunk_size)
+
+    def window(self, spreadsheet_id, rows, columns, after, limit):
+        cells = SpreadsheetCell.objects.filter(spreadsheet_id=spreadsheet_id)
+        if rows[0] is not None:
+            cells = cells.filter(row__gte=rows[0])
+        if rows[1] is not None:
+            cells = cells.filter(row__lte=rows[1])
+        if columns[0] is not None:
+            cells = cells.filter(column__gte=columns[0])
+        if columns[1] is not None:
+            cells = cells.filter(column__lte=columns[1])
+        if after is not None:
+            row, column = after
+            # The row__gte bound keeps this a range scan on the index.
+            cells = cells.filter(Q(row__gt=row) | Q(row=row, column__gt=column), row__gte=row)
+        return list(cells.order_by('row', 'column')[:limit])
+
+    def changed_since(self, spreadsheet_id, since, upto, limit):
+        cells = SpreadsheetCell.objects.filter(
+            spreadsheet_id=spreadsheet_id, revision__gt=since, revision__lte=upto,
+        )
+        return list(cells.order_by('revision', 'row', 'column')[:limit])
+
+    def _check_conflicts(self, spreadsheet_id, writes, expected_revision):
+        # Cells changed since the expected revision are few; the index finds them.
+        changed = SpreadsheetCell.objects.filter(
+            spreadsheet_id=spreadsheet_id, revision__gt=expected_revision,
+        ).values_list('row', 'column', 'revision')
+        revisions.check_conflicts(
+            {(row, column): revision for row, column, revision in changed}, writes, expected_revision,
+        )
+
+    def write_cell(self, spreadsheet_id, row, column, content, revision, expected_revision=None):
+        if expected_revision is not None:
+            self._check_conflicts(spreadsheet_id, {(row, column): content}, expected_revision)
+        cell, created = SpreadsheetCell.objects.update_or_create(
+            spreadsheet_id=spreadsheet_id,
+            row=row,
+            column=column,
+            defaults={'content': content, 'revision': revision}
+        )
+        return cell
+
+    def write_cells(self, spreadsheet_id, writes, revision, expected_revision=None):
+        if expected_revision is not None:
+            self._check_conflicts(spreadsheet_id, writes, expected_revision)
+        objs = [
+            SpreadsheetCell(spreadsheet_id=spreadsheet_id, row=row, column=column, content=content, revision=revision)
+            for (row, column), content in writes.items()
+        ]
+        with transaction.atomic():
+            SpreadsheetCell.objects.bulk_create(
+                objs,
+                batch_size=settings.BULK_WRITE_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=['spreadsheet', 'row', 'column'],
+                update_fields=['content', 'revision'],
+            )
+        return objs
+
+    def delete_all(self, spreadsheet_id):
+        SpreadsheetCell.objects.filter(spreadsheet_id=spreadsheet_id).delete()
+
+
+# --- Tile storage ---
+
+class TileStore:
+    def load(self, spreadsheet_ids, limit=None):
+        rows = defaultdict(list)
+        over = set()
+        for tile in CellTile.objects.filter(spreadsheet_id__in=spreadsheet_ids):
+            if tile.spreadsheet_id in over:
+                continue
+            rows[tile.spreadsheet_id].extend(_tile_rows(tile, with_revision=True))
+            if limit is not None and len(rows[tile.spreadsheet_id]) > limit:
+                # Decoding the rest of the sheet's tiles would be wasted.
+                over.add(tile.spreadsheet_id)
+                del rows[tile.spreadsheet_id]
+        results = {
+            spreadsheet_id: [_as_cell(spreadsheet_id, *row) for row in sorted(sheet_rows)]
+            for spreadsheet_id, sheet_rows in rows.items()
+        }
+        results.update((spreadsheet_id, None) for spreadsheet_id in over)
+        return results
+
+    def _bands(self, spreadsheet_id, rows, columns, chunk_size=16, with_revision=False, using=None):
+        # Yield each band of tiles sharing a tile_row, in row order.
+        tiles = CellTile.objects.using(using).filter(spreadsheet_id=spreadsheet_id)
+        if rows[0] is not None:
+            tiles = tiles.filter(tile_row__gte=rows[0] // TILE_SIZE)
+        if rows[1] is not None:
+            tiles = tiles.filter(tile_row__lte=rows[1] // TILE_SIZE)
+        if columns[0] is not None:
+            tiles = tiles.filter(tile_column__gte=columns[0] // TILE_SIZE)
+        if columns[1] is not None:
+            tiles = tiles.filter(tile_column__lte=columns[1] // TILE_SIZE)
+        tiles = tiles.order_by('tile_row', 'tile_column').iterator(chunk_size=chunk_size)
+        for _, band in groupby(tiles, key=lambda tile: tile.tile_row):
+            yield sorted(row for tile in band for row in _tile_rows(tile, with_revision))
+
+    def iter_rows(self, spreadsheet_id, chunk_size, using=None):
+        # Tiles are fetched a few at a time; chunk_size counts cells elsewhere.
+        for rows in self._bands(spreadsheet_id, (None, None), (None, None), using=using):
+            yield from rows
+
+    def window(self, spreadsheet_id, rows, columns, after, limit):
+        if after is not None and (rows[0] is None or rows[0] < after[0]):
+            rows = (after[0], rows[1])
+        found = []
+        for band in self._bands(spreadsheet_id, rows, columns, with_revision=True):
+            for row, column, content, revision in band:
+                if rows[0] is not None and row < rows[0]:
+                    continue
+                if rows[1] is not None and row > rows[1]:
+                    continue
+                if columns[0] is not None and column < columns[0]:
+                    continue
+                if columns[1] is not None and column > columns[1]:
+                    continue
+                if after is not None and (row, column) <= after:
+                    continue
+                found.append(_as_cell(spreadsheet_id, row, column, content, revision))
+                if len(found) >= limit:
+                    return found
+        return found
+
+    def changed_since(self, spreadsheet_id, since, upto, limit):
+        tiles = CellTile.objects.filter(spreadsheet_id=spreadsheet_id, revision__gt=since)
+        changed = [
+            row for tile in tiles for row in _tile_rows(tile, with_revision=True)
+            if since < row[3] <= upto
+        ]
+        changed.sort(key=lambda row: (row[3], row[0], row[1]))
+        return [_as_cell(spreadsheet_id, *row) for row in changed[:limit]]
+
+    def write_cell(self, spreadsheet_id, row, column, content, revision, expected_revision=None):
+        return self.write_cells(spreadsheet_id, {(row, column): content}, revision, expected_revision)[0]
+
+    def write_cells(self, spreadsheet_id, writes, revision, expected_revision=None):
+        by_tile = defaultdict(dict)
+        for (row, column), content in writes.items():
+            by_tile[(row // TILE_SIZE, column // TILE_SIZE)][(row % TILE_SIZE, column % TILE_SIZE)] = content
+
+        with transaction.atomic():
+            tile_filter = Q()
+            for tile_row, tile_column in by_tile:
+                tile_filter |= Q(tile_row=tile_row, tile_column=tile_column)
+            existing = {
+                (tile.tile_row, tile.tile_column): tile
+                for tile in CellTile.objects.select_for_update().filter(tile_filter, spreadsheet_id=spreadsheet_id)
+            }
+            decoded = {key: decode_tile(tile.data) for key, tile in existing.items()}
+            if expected_revision is not None:
+                revisions.check_conflicts({
+                    (tile_row * TILE_SIZE + r, tile_column * TILE_SIZE + c): cell_revision
+                    for (tile_row, tile_column), cells in decoded.items()
+                    for (r, c), (content, cell_revision) in cells.items()
+                }, writes, expected_revision)
+
+            created, updated = [], []
+            for key, changes in by_tile.items():
+                tile = existing.get(key)
+                cells = decoded.get(key, {})
+                for position, content in changes.items():
+                    if content or position in cells:
+                        # Cleared cells stay as empty entries so deltas see them.
+                        cells[position] = (content, revision)
+                if tile is None:
+                    if cells:
+                        created.append(CellTile(
+                            spreadsheet_id=spreadsheet_id, tile_row=key[0], tile_column=key[1],
+                            data=encode_tile(cells), revision=revision,
+                        ))
+                else:
+                    tile.data = encode_tile(cells)
+                    tile.revision = revision
+                    updated.append(tile)
+            CellTile.objects.bulk_create(created, batch_size=settings.BULK_WRITE_BATCH_SIZE)
+            CellTile.objects.bulk_update(updated, ['data', 'revision'], batch_size=settings.BULK_WRITE_BATCH_SIZE)
+
+        return [
+            _as_cell(spreadsheet_id, row, column, content, revision)
+            for (row, column), content in writes.items()
+        ]
+
+    def delete_all(self, spreadsheet_id):
+        CellTile.objects.filter(spreadsheet_id=spreadsheet_id).delete()
+
+
+STORES = {
+    Spreadsheet.Storage.ROWS: RowStore(),
+    Spreadsheet.Storage.TILES: TileStore(),
+}
+
+
+def store_for(spreadsheet_id, storage=None):
+    """The sheet's backend; pass `storage` when the caller has read the sheet."""
+    return STORES[storage or spreadsheet_storage(spreadsheet_id)]
+
+
+# --- API used by the resolvers, mutations and export ---
+
+def load_cells(spreadsheet_ids, limit=None):
+    """
+    spreadsheet_id -> list of cells in (row, column) order, for many sheets.
+    Sheets with more than `limit` cells map to None, without their cells
+    being loaded.
+    """
+    spreadsheet_ids = list(spreadsheet_ids)
+    results = STORES[Spreadsheet.Storage.ROWS].load(spreadsheet_ids, limit)
+    # A sheet lives in exactly one backend, so the results never overlap.
+    results.update(STORES[Spreadsheet.Storage.TILES].load(spreadsheet_ids, limit))
+    return results
+
+
+def iter_rows(spreadsheet_id, chunk_size=2000, storage=None, using=None):
+    """
+    Stream a sheet's (row, column, content) tuples in (row, column) order,
+    from the `using` database if given, else where the router sends reads.
+    """
+    return store_for(spreadsheet_id, storage).iter_rows(spreadsheet_id, chunk_size, using)
+
+
+def cell_window(spreadsheet_id, rows=(None, None), columns=(None, None), after=None, limit=None, storage=None):
+    """
+    Cells inside the inclusive row and column bounds (None means unbounded),
+    in (row, column) order, strictly after the `after` position.
+    """
+    if limit is None:
+        limit = settings.CELLS_PAGE_MAX
+    return store_for(spreadsheet_id, storage).window(spreadsheet_id, rows, columns, after, limit)
+
+
+def changed_since(spreadsheet_id, since, limit=None):
+    """
+    Return (revision, cells): the sheet's current revision and the cells
+    written after `since` up to it, in revision order, at most `limit` of them.
+    """
+    if limit is None:
+        limit = settings.CELLS_PAGE_MAX
+    revision, storage = Spreadsheet.objects.values_list('revision', 'storage').get(id=spreadsheet_id)
+    return revision, STORES[storage].changed_since(spreadsheet_id, since, revision, limit)
+
+
+def write_cell(spreadsheet_id, row, column, content, expected_revision=None):
+    """
+    Write one cell. With `expected_revision`, raise RevisionConflict instead if
+    the cell was written after that revision.
+    """
+    check_bounds([(row, column)])
+    with transaction.atomic():
+        revision = revisions.begin_write(spreadsheet_id)
+        # The sheet is locked now, so its backend can't change under the write.
+        cell = store_for(spreadsheet_id).write_cell(spreadsheet_id, row, column, content, revision, expected_revision)
+        references.record(spreadsheet_id, {(row, column): content})
+    return cell
+
+
+def write_cells(spreadsheet_id, writes, expected_revision=None):
+    """Write {(row, column): content} in one transaction; returns the cells."""
+    check_bounds(writes)
+    with transaction.atomic():
+        revision = revisions.begin_write(spreadsheet_id)
+        cells = store_for(spreadsheet_id).write_cells(spreadsheet_id, writes, revision, expected_revision)
+        references.record(spreadsheet_id, writes)
+    return cells
+
+
+def convert(spreadsheet_id, storage):
+    """Move a sheet's cells to another backend. Returns the number of cells moved."""
+    with transaction.atomic():
+        sheet = Spreadsheet.objects.select_for_update().get(id=spreadsheet_id)
+        if sheet.storage == storage:
+            return 0
+        source, target = STORES[sheet.storage], STORES[storage]
+        writes = {(row, column): content for row, column, content in source.iter_rows(spreadsheet_id, 5000)}
+        source.delete_all(spreadsheet_id)
+        sheet.storage = storage
+        sheet.save(update_fields=['storage'])
+        if writes:
+            # Moved cells are stamped with a new revision: deltas from before the
+            # move return them all, which is more than needed but never wrong.
+            target.write_cells(spreadsheet_id, writes, revisions.begin_write(spreadsheet_id))
+    return len(writes)
@@ -0,0 +1,1177 @@
+import asyncio
+import csv
+import io
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest import mock, skipUnless
+from xml.etree import ElementTree
+
+import numpy as np
+
+from django.conf import settings
+from django.apps import apps
+from django.core.cache import cache, caches
+from django.core.management import call_command
+from django.http import StreamingHttpResponse
+from django.test import Client, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, connections
+from django.urls import reverse
+from graphene_django.settings import graphene_settings
+from graphql_jwt.exceptions import JSONWebTokenError
+from graphql_jwt.shortcuts import get_token
+
+from . import (
+    auth, cell_imports, columnar, documents, engine, export_writers, exports, imports, permissions, provisioning,
+    query_plans, references, storage, workers,
+)
+from .auth import get_token_cache
+from .models import CellReference, CellTile, Spreadsheet, SpreadsheetCell, User, Workspace, WorkspaceMembership
+from .pubsub import get_pubsub
+from .schema import cell_channel
+
+
+class GraphQLTestMixin:
+    def setUp(self):
+        # Roles, tokens, responses and engines are cached across requests.
+        cache.clear()
+        caches[settings.PERMISSION_CACHE].clear()
+        get_token_cache().clear()
+        engine.evict()
+        self.tokens = {}
+
+    def make_user(self, username):
+        return User.objects.create_user(username, f"{username}@example.com", 'password')
+
+    def make_workspace(self, owner, name='Workspace', sheets=1):
+        workspace = Workspace.objects.create(name=name, owner=owner)
+        WorkspaceMembership.objects.create(user=owner, workspace=workspace, role=WorkspaceMembership.Role.ADMIN)
+        for n in range(sheets):
+            Spreadsheet.objects.create(workspace=workspace, name=f"{name} sheet {n}")
+        return workspace
+
+    def post(self, user, query, variables=None):
+        # One token per user, so the token cache knows it after the first request.
+        token = self.tokens.setdefault(user.pk, get_token(user))
+        client = Client(HTTP_AUTHORIZATION=f"JWT {token}")
+        response = client.post(
+            '/graphql', json.dumps({'query': query, 'variables': variables or {}}), content_type='application/json',
+        )
+        return response.json()
+
+    def graphql(self, user, query, variables=None):
+        body = self.post(user, query, variables)
+        self.assertNotIn('errors', body)
+        return body
+
+
+class GraphQLTestCase(GraphQLTestMixin, TestCase):
+    pass
+
+
+# ---------------------------------------------------------------------------
+# Query counts (user-004)
+# ---------------------------------------------------------------------------
+
+DASHBOARD = """
+query {
+  currentUser {
+    username
+    workspaces {
+      id name
+      owner { username }
+      members { id }
+      spreadsheets { id name flag }
+    }
+  }
+}
+"""
+
+SPREADSHEET = """
+query ($id: UUID) {
+  spreadsheetById(id: $id) {
+    id name flag
+    cells { row column content evaluatedContent }
+  }
+}
+"""
+
+UPDATE_CELL = """
+mutation ($id: UUID!, $row: Int!, $content: String!) {
+  updateCell(spreadsheetId: $id, row: $row, column: 0, content: $content) { cell { revision } }
+}
+"""
+
+
+class QueryCountTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        # Leave the token's user in the token cache, as after the first request.
+        self.graphql(self.user, "query { currentUser { id } }")
+
+    def test_dashboard_queries_do_not_grow_with_workspaces_and_sheets(self):
+        self.make_workspace(self.user, 'First')
+        # One query per loader: workspaces, owners, members, sheets.
+        with self.assertNumQueries(4):
+            self.graphql(self.user, DASHBOARD)
+
+        for n in range(4):
+            workspace = self.make_workspace(self.user, f"More {n}", sheets=3)
+            WorkspaceMembership.objects.create(
+                user=self.make_user(f"member{n}"), workspace=workspace, role=WorkspaceMembership.Role.VIEWER,
+            )
+        cache.clear()
+        with self.assertNumQueries(4):
+            body = self.graphql(self.user, DASHBOARD)
+        workspaces = body['data']['currentUser']['workspaces']
+        self.assertEqual(len(workspaces), 5)
+        self.assertEqual(sum(len(workspace['spreadsheets']) for workspace in workspaces), 13)
+        self.assertEqual(sum(len(workspace['members']) for workspace in workspaces), 9)
+
+    def test_spreadsheet_queries_do_not_grow_with_cells(self):
+        sheet = self.make_workspace(self.user).spreadsheets.get()
+        storage.write_cells(sheet.id, {(0, 0): '1', (1, 0): '=A1+1'})
+        # Leave the role in the shared cache.
+        self.graphql(self.user, SPREADSHEET, {'id': str(sheet.id)})
+        cache.clear()
+        engine.evict()
+        # The revisions keying the response cache, the cached role, sheet,
+        # its cell count, and its cells from each storage backend; the engine
+        # is built from those cells.
+        with self.assertNumQueries(6):
+            self.graphql(self.user, SPREADSHEET, {'id': str(sheet.id)})
+
+        storage.write_cells(sheet.id, {
+            (row, column): f"=A{row}+{column}" if column else str(row)
+            for row in range(2, 50) for column in range(5)
+        })
+        cache.clear()
+        engine.evict()
+        with self.assertNumQueries(6):
+            body = self.graphql(self.user, SPREADSHEET, {'id': str(sheet.id)})
+        cells = body['data']['spreadsheetById']['cells']
+        self.assertEqual(len(cells), 2 + 48 * 5)
+        self.assertEqual(cells[1]['evaluatedContent'], '2')
+        self.assertEqual(cells[-1]['evaluatedContent'], '52')
+
+    def test_roles_are_shared_across_requests(self):
+        sheet = self.make_workspace(self.user).spreadsheets.get()
+        cache.clear()
+        with CaptureQueriesContext(connection) as first:
+            self.graphql(self.user, UPDATE_CELL, {'id': str(sheet.id), 'row': 0, 'content': 'a'})
+        with CaptureQueriesContext(connection) as second:
+            self.graphql(self.user, UPDATE_CELL, {'id': str(sheet.id), 'row': 1, 'content': 'b'})
+        membership_queries = lambda queries: [q for q in queries if 'FROM "core_workspacemembership"' in q['sql']]
+        self.assertEqual(len(membership_queries(first)), 1)
+        self.assertEqual(membership_queries(second), [])
+
+
+# ---------------------------------------------------------------------------
+# Query cost (user-015)
+# ---------------------------------------------------------------------------
+
+class CostTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.sheet = self.make_workspace(self.user).spreadsheets.get()
+        storage.write_cells(self.sheet.id, {(row, 0): str(row) for row in range(20)})
+
+    def test_whole_sheet_reads_are_costed_at_a_page(self):
+        # The sheet, and a page of cells with their evaluatedContent, whatever
+        # the sheet holds: the cost is reported before access is checked.
+        weights = settings.GRAPHQL_COST['FIELD_WEIGHTS']
+        per_cell = weights['SpreadsheetType.cells'] + weights['SpreadsheetCellType.evaluatedContent']
+        expected = 1 + settings.CELLS_PAGE_MAX * per_cell
+        body = self.graphql(self.user, SPREADSHEET, {'id': str(self.sheet.id)})
+        self.assertEqual(body['extensions']['cost']['requestedQueryCost'], expected)
+        body = self.post(self.make_user('mallory'), SPREADSHEET, {'id': str(self.sheet.id)})
+        self.assertEqual(body['extensions']['cost']['requestedQueryCost'], expected)
+
+    def test_whole_sheet_reads_over_a_page_are_refused(self):
+        for backend in (Spreadsheet.Storage.ROWS, Spreadsheet.Storage.TILES):
+            storage.convert(self.sheet.id, backend)
+            cache.clear()
+            with self.settings(CELLS_PAGE_MAX=10):
+                body = self.post(self.user, SPREADSHEET, {'id': str(self.sheet.id)})
+                self.assertIsNone(body['data']['spreadsheetById'])
+                self.assertIn("more than 10 cells", body['errors'][0]['message'])
+                body = self.graphql(self.user, WINDOW, {'id': str(self.sheet.id), 'rowEnd': 9})
+                self.assertEqual(len(body['data']['spreadsheetById']['cells']), 10)
+            with self.settings(CELLS_PAGE_MAX=20):
+                body = self.graphql(self.user, SPREADSHEET, {'id': str(self.sheet.id)})
+                self.assertEqual(len(body['data']['spreadsheetById']['cells']), 20)
+
+    def test_oversized_sheets_are_not_loaded(self):
+        other = self.make_workspace(self.user, 'Other').spreadsheets.get()
+        storage.write_cells(other.id, {(0, 0): '1'})
+        loaded = storage.load_cells([self.sheet.id, other.id], limit=10)
+        self.assertIsNone(loaded[self.sheet.id])
+        self.assertEqual([cell.content for cell in loaded[other.id]], ['1'])
+
+
+# ---------------------------------------------------------------------------
+# Response cache (user-017)
+# ---------------------------------------------------------------------------
+
+# As sent by frontend/src/pages/Spreadsheet.js.
+SPREADSHEET_PAGE = """
+  query SpreadsheetById($id: UUID!, $rowEnd: Int!, $columnEnd: Int!) {
+    spreadsheetById(id: $id) {
+      id
+      name
+      workspace {
+        id
+        name
+      }
+      cells(rowStart: 0, rowEnd: $rowEnd, columnStart: 0, columnEnd: $columnEnd) {
+        id
+        row
+        column
+        content
+        evaluatedContent
+      }
+    }
+  }
+"""
+
+
+class ResponseCacheTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.workspace = self.make_workspace(self.user, 'Team')
+        self.sheet = self.workspace.spreadsheets.get()
+        self.variables = {'id': str(self.sheet.id), 'rowEnd': 19, 'columnEnd': 9}
+
+    def read_page(self):
+        with CaptureQueriesContext(connection) as queries:
+            body = self.graphql(self.user, SPREADSHEET_PAGE, self.variables)
+        return body['data']['spreadsheetById'], len(queries)
+
+    def test_the_spreadsheet_page_is_cached(self):
+        storage.write_cell(self.sheet.id, 0, 0, '=1+1')
+        first, _ = self.read_page()
+        cached, queries = self.read_page()
+        self.assertEqual(cached, first)
+        # Only the revisions and the role keying the response.
+        self.assertEqual(queries, 2)
+
+        self.workspace.name = 'Renamed'
+        self.workspace.save()
+        renamed, _ = self.read_page()
+        self.assertEqual(renamed['workspace']['name'], 'Renamed')
+        storage.write_cell(self.sheet.id, 0, 0, '=2+2')
+        written, _ = self.read_page()
+        self.assertEqual(written['cells'][0]['evaluatedContent'], '4')
+
+    def test_workspace_members_are_not_cached(self):
+        query = "query ($id: UUID) { spreadsheetById(id: $id) { workspace { name members { username } } } }"
+        self.graphql(self.user, query, {'id': str(self.sheet.id)})
+        WorkspaceMembership.objects.create(
+            user=self.make_user('bob'), workspace=self.workspace, role=WorkspaceMembership.Role.VIEWER,
+        )
+        body = self.graphql(self.user, query, {'id': str(self.sheet.id)})
+        self.assertEqual(len(body['data']['spreadsheetById']['workspace']['members']), 2)
+
+
+# ---------------------------------------------------------------------------
+# Permissions (user-005)
+# ---------------------------------------------------------------------------
+
+INVITE_USER = """
+mutation ($workspaceId: UUID!, $email: String!, $role: String!) {
+  inviteUser(workspaceId: $workspaceId, email: $email, role: $role) { invitation { role } }
+}
+"""
+
+
+class PermissionTests(GraphQLTestCase):
+    def test_invitation_keeps_the_requested_role(self):
+        admin = self.make_user('admin')
+        workspace = self.make_workspace(admin)
+        body = self.graphql(admin, INVITE_USER, {
+            'workspaceId': str(workspace.id), 'email': 'new@example.com', 'role': 'VIEWER',
+        })
+        self.assertEqual(body['data']['inviteUser']['invitation']['role'], 'VIEWER')
+        self.assertEqual(workspace.invitations.get().role, WorkspaceMembership.Role.VIEWER)
+
+    def test_shared_entries_are_invalidated_by_signals(self):
+        user = self.make_user('alice')
+        workspace = self.make_workspace(user)
+        sheet = workspace.spreadsheets.get()
+        self.graphql(user, UPDATE_CELL, {'id': str(sheet.id), 'row': 0, 'content': 'a'})
+        shared = caches[settings.PERMISSION_CACHE]
+        role_key = permissions.role_cache_key(user.pk, workspace.id)
+        sheet_key = permissions.sheet_cache_key(sheet.id)
+        self.assertEqual(shared.get(role_key), WorkspaceMembership.Role.ADMIN)
+        self.assertEqual(shared.get(sheet_key), workspace.id)
+
+        WorkspaceMembership.objects.filter(user=user, workspace=workspace).get().delete()
+        self.assertIsNone(shared.get(role_key))
+        body = self.post(user, UPDATE_CELL, {'id': str(sheet.id), 'row': 0, 'content': 'b'})
+        self.assertIn("not a member", body['errors'][0]['message'])
+        sheet.delete()
+        self.assertIsNone(shared.get(sheet_key))
+
+
+# ---------------------------------------------------------------------------
+# Formula engine
+# ---------------------------------------------------------------------------
+
+WINDOW = """
+query ($id: UUID, $rowEnd: Int) {
+  spreadsheetById(id: $id) {
+    cells(rowStart: 0, rowEnd: $rowEnd) { row column evaluatedContent }
+  }
+}
+"""
+
+
+class EngineTests(GraphQLTestCase):
+    def test_windowed_read_evaluates_against_the_whole_sheet(self):
+        user = self.make_user('alice')
+        sheet = self.make_workspace(user).spreadsheets.get()
+        storage.write_cells(sheet.id, {(30, 0): '7', (0, 0): '=A31+1'})
+        body = self.graphql(user, WINDOW, {'id': str(sheet.id), 'rowEnd': 19})
+        self.assertEqual(body['data']['spreadsheetById']['cells'], [{'row': 0, 'column': 0, 'evaluatedContent': '8'}])
+        # Later reads of the whole sheet use the same engine.
+        body = self.graphql(user, SPREADSHEET, {'id': str(sheet.id)})
+        self.assertEqual(body['data']['spreadsheetById']['cells'][0]['evaluatedContent'], '8')
+
+    def test_edits_recompute_only_their_dependents(self):
+        sheet = engine.SheetEngine([
+            (0, 0, '1'), (1, 0, '2'), (2, 0, '=A1+A2'), (3, 0, '=A3*10'), (0, 1, '=A2+1'), (0, 2, 'text'),
+        ])
+        self.assertEqual([sheet.display(row, 0) for row in range(4)], ['1', '2', '3', '30'])
+        self.assertEqual(sheet.set_cell(0, 0, '5'), {(0, 0), (2, 0), (3, 0)})
+        self.assertEqual((sheet.display(3, 0), sheet.display(0, 1)), ('70', '3'))
+        # A new reference adds an edge to the graph.
+        sheet.set_cell(0, 2, '=A4+B1')
+        self.assertEqual(sheet.set_cell(1, 0, '0'), {(1, 0), (2, 0), (3, 0), (0, 1), (0, 2)})
+        self.assertEqual(sheet.display(0, 2), '51')
+
+    def test_cycles_and_errors(self):
+        sheet = engine.SheetEngine([(0, 0, '=B1'), (0, 1, '=A1'), (1, 0, '=1/0'), (2, 0, '=A2+1'), (3, 0, '=FOO(A1)')])
+        self.assertEqual(sheet.display(0, 0), '#CYCLE!')
+        self.assertEqual(sheet.display(2, 0), '#DIV/0!')
+        self.assertEqual(sheet.display(3, 0), '#NAME?')
+        # Breaking the cycle clears it.
+        sheet.set_cell(0, 1, '4')
+        self.assertEqual(sheet.display(0, 0), '4')
+
+    def test_engines_are_rebuilt_for_newer_revisions(self):
+        user = self.make_user('alice')
+        sheet = self.make_workspace(user).spreadsheets.get()
+        storage.write_cells(sheet.id, {(0, 0): '1', (1, 0): '=A1*2'})
+        loaded = engine.get_engine(sheet.id)
+        self.assertEqual(loaded.display(1, 0), '2')
+        self.assertIs(engine.get_engine(sheet.id, loaded.revision), loaded)
+        # Written without telling this process's engine, as another process would.
+        storage.write_cells(sheet.id, {(0, 0): '4'})
+        sheet.refresh_from_db()
+        rebuilt = engine.get_engine(sheet.id, sheet.revision)
+        self.assertIsNot(rebuilt, loaded)
+        self.assertEqual(rebuilt.display(1, 0), '8')
+        # Writes committed in this process are applied in place.
+        storage.write_cells(sheet.id, {(0, 0): '5'})
+        self.assertEqual(engine.cells_updated(sheet.id, [(0, 0, '5')], sheet.revision + 1), {(0, 0), (1, 0)})
+        self.assertIs(engine.peek_engine(sheet.id), rebuilt)
+        self.assertEqual(rebuilt.display(1, 0), '10')
+
+
+# ---------------------------------------------------------------------------
+# Range aggregation (user-002)
+# ---------------------------------------------------------------------------
+
+class ColumnarTests(SimpleTestCase):
+    def test_aggregates_cover_dense_and_far_rows(self):
+        sheet = columnar.ColumnarSheet(max_rows=1_000_000, max_columns=10)
+        for row in range(10):
+            sheet.set(row, 0, float(row))
+        sheet.set(3, 1, 'text')
+        sheet.set(500_000, 1, -4.0)
+        # A single far-away cell stays out of the arrays.
+        self.assertLess(len(sheet._columns[1].values), 1000)
+        self.assertEqual(sheet.aggregate(0, 0, 999_999, 1, extrema=True), (41.0, 11, -4.0, 9.0))
+        self.assertEqual(sheet.aggregate(2, 0, 4, 0), (9.0, 3, None, None))
+        self.assertEqual(sheet.aggregate(0, 5, 10, 6, extrema=True), (0.0, 0, None, None))
+
+        sheet.set(7, 0, None, is_error=True)
+        sheet.set(600_000, 1, None, is_error=True)
+        self.assertEqual(sheet.first_error(0, 0, 999_999, 1), (7, 0))
+        self.assertEqual(sheet.first_error(0, 1, 999_999, 1), (600_000, 1))
+        with self.assertRaises(ValueError):
+            sheet.set(0, 10, 1.0)
+
+    def test_range_functions(self):
+        sheet = engine.SheetEngine([
+            (0, 0, '1'), (1, 0, 'x'), (2, 0, '3'), (4, 0, '-2'),
+            (0, 2, '=COUNT(A1:A5)'), (1, 2, '=MIN(A1:A5)'), (2, 2, '=MAX(A1:A5)'),
+            (3, 2, '=SUM(A1:A5)'), (4, 2, '=AVERAGE(A1:A5)'), (5, 2, '=SUM(A1:B1000)'),
+        ])
+        self.assertEqual([sheet.display(row, 2) for row in range(6)], ['3', '-2', '3', '2', '0.666666666666667', '2'])
+        # Ranges are dependencies too.
+        self.assertEqual(sheet.set_cell(999, 1, '100'), {(999, 1), (5, 2)})
+        self.assertEqual(sheet.display(5, 2), '102')
+        sheet.set_cell(1, 0, '=1/0')
+        self.assertEqual(sheet.display(3, 2), '#DIV/0!')
+
+# ---------------------------------------------------------------------------
+# Cell storage (user-008)
+# ---------------------------------------------------------------------------
+
+class StorageTests(GraphQLTestCase):
+    def test_writes_follow_a_conversion_made_elsewhere(self):
+        user = self.make_user('alice')
+        sheet = self.make_workspace(user).spreadsheets.get()
+        self.graphql(user, UPDATE_CELL, {'id': str(sheet.id), 'row': 0, 'content': 'before'})
+        # on_commit callbacks don't run inside a TestCase, so this process is
+        # told nothing of the conversion, as when another process converts.
+        storage.convert(sheet.id, Spreadsheet.Storage.TILES)
+        self.graphql(user, UPDATE_CELL, {'id': str(sheet.id), 'row': 1, 'content': 'after'})
+
+        self.assertFalse(SpreadsheetCell.objects.filter(spreadsheet=sheet).exists())
+        self.assertEqual(CellTile.objects.filter(spreadsheet=sheet).count(), 1)
+        body = self.graphql(user, WINDOW, {'id': str(sheet.id), 'rowEnd': 10})
+        self.assertEqual(
+            [cell['evaluatedContent'] for cell in body['data']['spreadsheetById']['cells']], ['before', 'after'],
+        )
+
+
+# ---------------------------------------------------------------------------
+# Streaming export (user-009)
+# ---------------------------------------------------------------------------
+
+class StreamingExportTests(GraphQLTestCase):
+    def test_archives_are_streamed_a_chunk_at_a_time(self):
+        user = self.make_user('alice')
+        workspace = self.make_workspace(user, 'Team', sheets=2)
+        first, second = workspace.spreadsheets.order_by('created_at')
+        cells = {(row, column): uuid.uuid4().hex for row in range(1000) for column in range(5)}
+        storage.write_cells(first.id, cells)
+        storage.convert(second.id, Spreadsheet.Storage.TILES)
+        storage.write_cells(second.id, {(0, 0): "=['Team sheet 0']"})
+
+        with mock.patch.object(exports, 'CELL_CHUNK_SIZE', 500):
+            chunks = list(exports.stream_workspace_export(workspace, 'csv'))
+        # The entry is handed out while it is written, not in one piece.
+        self.assertLess(max(len(chunk) for chunk in chunks), sum(len(chunk) for chunk in chunks) / 3)
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(chunks))) as archive:
+            self.assertEqual(
+                sorted(archive.namelist()), ['Team_sheet_0.csv', 'Team_sheet_1.csv', 'export_log.json'],
+            )
+            records = list(csv.reader(io.StringIO(archive.read('Team_sheet_0.csv').decode())))[1:]
+            log = json.loads(archive.read('export_log.json'))
+        self.assertEqual(records, [[str(row), str(column), cells[(row, column)]] for row, column in sorted(cells)])
+        self.assertEqual([(entry['referenced_name'], entry['status']) for entry in log], [('Team sheet 0', 'OK')])
+
+    def test_the_view_streams_the_archive(self):
+        user = self.make_user('alice')
+        workspace = self.make_workspace(user)
+        client = Client()
+        client.force_login(user)
+        response = client.get(reverse('data_export', args=[workspace.id]), {'format': 'csv'})
+        self.assertTrue(response.streaming)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIn('Workspace_sheet_0.csv', archive.namelist())
+
+# ---------------------------------------------------------------------------
+# Workspace revisions and export archives (user-011)
+# ---------------------------------------------------------------------------
+
+class RevisionTests(GraphQLTestCase):
+    def test_cell_writes_bump_the_workspace_once_committed(self):
+        user = self.make_user('alice')
+        workspace = self.make_workspace(user)
+        sheet = workspace.spreadsheets.get()
+        workspace.refresh_from_db()
+        before = workspace.revision
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with CaptureQueriesContext(connection) as queries:
+                storage.write_cells(sheet.id, {(0, 0): 'a', (1, 0): 'b'})
+            self.assertFalse([q for q in queries if 'UPDATE "core_workspace"' in q['sql']])
+        self.assertEqual(len(callbacks), 1)
+        workspace.refresh_from_db()
+        self.assertEqual(workspace.revision, before + 1)
+
+    def test_starting_a_job_needs_the_csrf_token(self):
+        user = self.make_user('alice')
+        workspace = self.make_workspace(user)
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(user)
+        response = client.post(reverse('export_job_start', args=[workspace.id]))
+        self.assertEqual(response.status_code, 403)
+        self.assertIn(b'CSRF', response.content)
+
+    def test_builds_keep_the_previous_archive(self):
+        with tempfile.TemporaryDirectory() as directory:
+            jobs = exports.ExportJobs({'DIR': directory, 'MAX_WORKERS': 1})
+            workspace_id = uuid.uuid4()
+            for revision in (1, 2, 3):
+                jobs.artifact_path(workspace_id, revision).write_bytes(b'')
+            other = jobs.artifact_path(uuid.uuid4(), 1)
+            other.write_bytes(b'')
+            jobs._prune(workspace_id, 3)
+            jobs.executor.shutdown()
+            self.assertEqual(
+                [jobs.artifact_path(workspace_id, revision).exists() for revision in (1, 2, 3)], [False, True, True],
+            )
+            self.assertTrue(other.exists())
+
+
+# ---------------------------------------------------------------------------
+# Metrics (user-021)
+# ---------------------------------------------------------------------------
+
+class MetricsTests(GraphQLTestCase):
+    def scrape(self, **headers):
+        return Client().get('/metrics', REMOTE_ADDR='203.0.113.5', **headers)
+
+    def test_metrics_are_not_public(self):
+        self.assertEqual(self.scrape().status_code, 403)
+        user = self.make_user('alice')
+        token = get_token(user)
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION=f"JWT {token}").status_code, 403)
+        user.is_staff = True
+        user.save()
+        self.assertEqual(self.scrape(HTTP_AUTHORIZATION=f"JWT {token}").status_code, 200)
+
+    def test_scrapers_use_the_token_or_an_allowed_address(self):
+        with self.settings(METRICS=dict(settings.METRICS, TOKEN='s3cret')):
+            self.assertEqual(self.scrape(HTTP_AUTHORIZATION="Bearer s3cret").status_code, 200)
+            self.assertEqual(self.scrape(HTTP_AUTHORIZATION="Bearer guess").status_code, 403)
+        with self.settings(METRICS=dict(settings.METRICS, ALLOWED_IPS=['203.0.113.5'])):
+            self.assertEqual(self.scrape().status_code, 200)
+
+
+# ---------------------------------------------------------------------------
+# Query plans (user-023)
+# ---------------------------------------------------------------------------
+
+@skipUnless(connection.vendor in query_plans.SCAN_PATTERNS, "Query plans of this database can't be read.")
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.sample = query_plans.seed(users=500)
+
+    def test_hot_queries_use_indexes(self):
+        for result in query_plans.audit(self.sample):
+            with self.subTest(result.plan.name):
+                self.assertEqual(result.scanned, [], f"Scans {', '.join(result.scanned)}:\n{result.text}")
+
+
+# ---------------------------------------------------------------------------
+# Read replicas (user-025)
+# ---------------------------------------------------------------------------
+
+REPLICA = 'replica'
+
+
+@skipUnless(connection.vendor == 'sqlite', "The replica is a second SQLite database.")
+@override_settings(REPLICA_ROUTING=dict(settings.REPLICA_ROUTING, REPLICAS=[REPLICA]))
+class ReplicaTests(GraphQLTestMixin, TransactionTestCase):
+    """
+    Against a second database standing in for a replica: it holds what
+    replicate() last copied from the primary, so it lags behind it until then.
+    Transactions would send every read to the primary, hence TransactionTestCase.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.directory = tempfile.TemporaryDirectory()
+        connections.settings[REPLICA] = dict(
+            connection.settings_dict, NAME=os.path.join(cls.directory.name, 'replica.sqlite3'),
+        )
+        with connections[REPLICA].schema_editor() as editor:
+            for model in apps.get_models():
+                editor.create_model(model)
+
+    @classmethod
+    def tearDownClass(cls):
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        cls.directory.cleanup()
+        super().tearDownClass()
+
+    def setUp(self):
+        super().setUp()
+        caches[settings.REPLICA_ROUTING['CACHE']].clear()
+
+    def replicate(self):
+        models = [User, Workspace, WorkspaceMembership, Spreadsheet, SpreadsheetCell]
+        for model in reversed(models):
+            model.objects.using(REPLICA).all().delete()
+        for model in models:
+            model.objects.using(REPLICA).bulk_create(model.objects.using('default').all())
+
+    def read_cells(self, user, sheet):
+        return self.graphql(user, SPREADSHEET, {'id': str(sheet.id)})['data']['spreadsheetById']['cells']
+
+    def test_engines_are_built_from_the_primary(self):
+        user = self.make_user('alice')
+        sheet = self.make_workspace(user).spreadsheets.get()
+        storage.write_cells(sheet.id, {(0, 0): '1', (0, 1): '=A1*10'})
+        self.replicate()
+        storage.write_cell(sheet.id, 0, 0, '2')
+        engine.evict()
+
+        # The request reads the replica's cells...
+        self.assertEqual([cell['content'] for cell in self.read_cells(user, sheet)], ['1', '=A1*10'])
+        # ...but the engine it leaves for later requests holds the primary's.
+        loaded = engine.peek_engine(sheet.id)
+        self.assertEqual(loaded.revision, Spreadsheet.objects.get(id=sheet.id).revision)
+        self.assertEqual(loaded.display(0, 1), '20')
+
+    def test_callers_read_their_writes_from_any_process(self):
+        user = self.make_user('alice')
+        sheet = self.make_workspace(user).spreadsheets.get()
+        self.replicate()
+        self.graphql(user, UPDATE_CELL, {'id': str(sheet.id), 'row': 0, 'content': 'written'})
+        # Another process shares none of this one's local caches.
+        cache.clear()
+        engine.evict()
+        self.assertEqual([cell['content'] for cell in self.read_cells(user, sheet)], ['written'])
+
+        # Once the caller is no longer pinned, it reads the lagging replica.
+        caches[settings.REPLICA_ROUTING['CACHE']].clear()
+        cache.clear()
+        self.assertEqual(self.read_cells(user, sheet), [])
+
+
+# ---------------------------------------------------------------------------
+# ASGI worker threads (user-024)
+# ---------------------------------------------------------------------------
+
+class WorkerStreamTests(SimpleTestCase):
+    def serve(self, view, send):
+        async def run():
+            response = await workers.run_in_worker(view, RequestFactory().get('/export'))
+            await workers.ASGIHandler().send_response(response, send)
+        asyncio.run(run())
+
+    def test_streamed_bodies_are_sent_as_they_are_produced(self):
+        events = []
+        sent_first = threading.Event()
+
+        def view(request):
+            def body():
+                events.append('built first')
+                yield b'first'
+                # The rest of the archive waits for the first chunk to go out.
+                sent_first.wait(5)
+                events.append('built rest')
+                yield b'rest'
+            return StreamingHttpResponse(body(), content_type='application/zip')
+
+        bodies = []
+
+        async def send(message):
+            if message['type'] == 'http.response.body':
+                bodies.append(message.get('body', b''))
+                if message.get('body') == b'first':
+                    events.append('sent first')
+                    sent_first.set()
+
+        self.serve(view, send)
+        self.assertEqual(events, ['built first', 'sent first', 'built rest'])
+        self.assertEqual(b''.join(bodies), b'firstrest')
+
+    def test_workers_stop_when_the_client_goes_away(self):
+        closed = threading.Event()
+
+        def view(request):
+            def body():
+                try:
+                    while True:
+                        yield b'x' * 1024
+                finally:
+                    closed.set()
+            return StreamingHttpResponse(body())
+
+        async def send(message):
+            if message.get('body'):
+                raise OSError("Client disconnected")
+
+        with self.assertRaises(OSError):
+            self.serve(view, send)
+        self.assertTrue(closed.wait(5))
+
+
+# ---------------------------------------------------------------------------
+# CSV/TSV imports (user-022)
+# ---------------------------------------------------------------------------
+
+class CellImportTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.sheet = self.make_workspace(self.user).spreadsheets.get()
+
+    def import_text(self, text, format='csv', origin=(0, 0)):
+        with self.captureOnCommitCallbacks(execute=True):
+            return cell_imports.import_cells(self.sheet.id, io.StringIO(text), format, origin)
+
+    def cells(self):
+        return {(row, column): content for row, column, content in storage.iter_rows(self.sheet.id)}
+
+    def test_imports_through_each_writer(self):
+        for backend, writer in [
+            (Spreadsheet.Storage.ROWS, cell_imports.UpsertWriter),
+            (Spreadsheet.Storage.TILES, cell_imports.BatchWriter),
+        ]:
+            storage.convert(self.sheet.id, backend)
+            storage.write_cells(self.sheet.id, {(2, 3): 'old'})
+            self.assertIsInstance(cell_imports._writer(self.sheet.id, 0), writer)
+            with self.settings(CELL_IMPORT=dict(settings.CELL_IMPORT, CHUNK_CELLS=2)):
+                result = self.import_text("a\tb\n\tc\n\n=E3+1\n", 'tsv', origin=(2, 3))
+            self.assertEqual((result.rows, result.cells), (4, 4))
+            # Empty fields leave the cell as it was.
+            self.assertEqual(self.cells(), {(2, 3): 'a', (2, 4): 'b', (3, 4): 'c', (5, 3): '=E3+1'})
+            self.assertEqual(Spreadsheet.objects.get(id=self.sheet.id).revision, result.revision)
+            storage.write_cells(self.sheet.id, {cell: '' for cell in self.cells()})
+
+    def test_rows_outside_the_sheet_are_refused(self):
+        with self.assertRaisesMessage(cell_imports.CellImportError, "Row 2 doesn't fit"):
+            self.import_text("a\nb\n", origin=(settings.SHEET_MAX_ROWS - 1, 0))
+        with self.assertRaisesMessage(cell_imports.CellImportError, "Row 1 doesn't fit"):
+            self.import_text("a,b\n", origin=(0, settings.SHEET_MAX_COLUMNS - 1))
+        with self.settings(CELL_IMPORT=dict(settings.CELL_IMPORT, MAX_COLUMNS=2)):
+            with self.assertRaisesMessage(cell_imports.CellImportError, "more than 2 columns"):
+                self.import_text("a,b,c\n")
+        # Nothing of a refused import is written.
+        self.assertEqual(self.cells(), {})
+
+    def test_imports_are_published_to_subscribers(self):
+        loop = asyncio.new_event_loop()
+        subscription = get_pubsub().subscribe(cell_channel(self.sheet.id))
+        received = loop.create_task(subscription.__anext__())
+        loop.run_until_complete(asyncio.sleep(0))
+        try:
+            self.import_text("1,=A1*2\n")
+            changes = loop.run_until_complete(asyncio.wait_for(received, 5))
+        finally:
+            loop.run_until_complete(subscription.aclose())
+            loop.close()
+        self.assertEqual(
+            sorted((change['row'], change['column'], change['evaluated_content']) for change in changes),
+            [(0, 0, '1'), (0, 1, '2')],
+        )
+
+    def test_the_view_only_accepts_tokens(self):
+        url = reverse('cell_import', args=[self.sheet.id])
+        client = Client()
+        client.force_login(self.user)
+        # The view is exempt from CSRF checks: the session alone isn't enough.
+        response = client.post(url, "a,b\n", content_type='text/csv')
+        self.assertEqual(response.status_code, 401)
+        client = Client(HTTP_AUTHORIZATION=f"JWT {get_token(self.user)}")
+        response = client.post(f"{url}?row=1", "a,b\n", content_type='text/csv')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(self.cells(), {(1, 0): 'a', (1, 1): 'b'})
+
+
+# ---------------------------------------------------------------------------
+# IMPORT_CSV fetcher (user-003)
+# ---------------------------------------------------------------------------
+
+class _Upstream(BaseHTTPRequestHandler):
+    # Keeps connections open, so the fetcher's pool can reuse them.
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append((self.client_address, self.headers.get('If-None-Match')))
+        if server.delay:
+            time.sleep(server.delay)
+        if self.headers.get('If-None-Match') == '"v1"':
+            self.send_response(304)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        body = f"a,b,{len(server.requests)}".encode()
+        self.send_response(200)
+        self.send_header('ETag', '"v1"')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ImportFetcherTests(SimpleTestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), _Upstream)
+        self.server.requests, self.server.delay = [], 0
+        threading.Thread(target=self.server.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/data.csv"
+
+    def fetcher(self, **options):
+        fetcher = imports.ImportFetcher(options)
+        self.addCleanup(fetcher.executor.shutdown)
+        return fetcher
+
+    def test_bodies_are_cached_until_they_expire(self):
+        fetcher = self.fetcher(CACHE_TTL=60)
+        self.assertEqual(fetcher.get(self.url), 'a,b,1')
+        self.assertEqual(fetcher.get(self.url), 'a,b,1')
+        self.assertEqual(len(self.server.requests), 1)
+
+        fetcher = self.fetcher(CACHE_TTL=0, STALE_WHILE_REVALIDATE=False)
+        self.assertEqual(fetcher.get(self.url), 'a,b,2')
+        # Expired: revalidated with the ETag, and the 304 keeps the body.
+        self.assertEqual(fetcher.get(self.url), 'a,b,2')
+        self.assertEqual([etag for _, etag in self.server.requests[1:]], [None, '"v1"'])
+
+    def test_fetches_share_pooled_connections(self):
+        fetcher = self.fetcher(CACHE_TTL=0, STALE_WHILE_REVALIDATE=False)
+        for _ in range(3):
+            fetcher.get(self.url)
+        self.assertEqual(len({address for address, _ in self.server.requests}), 1)
+
+    def test_concurrent_reads_share_one_fetch(self):
+        self.server.delay = 0.2
+        fetcher = self.fetcher()
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(fetcher.get(self.url))) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, ['a,b,1'] * 4)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_stale_bodies_are_served_while_they_refresh(self):
+        fetcher = self.fetcher(CACHE_TTL=0)
+        self.assertEqual(fetcher.get(self.url), 'a,b,1')
+        self.server.delay = 0.2
+        started = time.monotonic()
+        self.assertEqual(fetcher.get(self.url), 'a,b,1')
+        self.assertLess(time.monotonic() - started, 0.2)
+
+
+# ---------------------------------------------------------------------------
+# Batch cell writes (user-006)
+# ---------------------------------------------------------------------------
+
+UPDATE_CELLS = """
+mutation ($id: UUID!, $cells: [CellInput!]!, $expected: BigInt) {
+  updateCells(spreadsheetId: $id, cells: $cells, expectedRevision: $expected) {
+    results { row column revision evaluatedContent }
+  }
+}
+"""
+
+
+class UpdateCellsTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.sheet = self.make_workspace(self.user).spreadsheets.get()
+
+    def update(self, cells, expected=None):
+        cells = [{'row': row, 'column': column, 'content': content} for (row, column), content in cells]
+        return self.post(self.user, UPDATE_CELLS, {'id': str(self.sheet.id), 'cells': cells, 'expected': expected})
+
+    def test_writes_are_upserted_in_one_revision(self):
+        body = self.update([((0, 0), '1'), ((1, 0), '=A1+1'), ((0, 0), '2')])
+        results = body['data']['updateCells']['results']
+        # The last write to a cell wins.
+        self.assertEqual([(r['row'], r['column'], r['evaluatedContent']) for r in results], [(0, 0, '2'), (1, 0, '3')])
+        self.sheet.refresh_from_db()
+        self.assertEqual({r['revision'] for r in results}, {self.sheet.revision})
+
+        body = self.update([((1, 0), '=A1*10'), ((2, 0), 'x')])
+        results = body['data']['updateCells']['results']
+        self.assertEqual({r['revision'] for r in results}, {self.sheet.revision + 1})
+        self.assertEqual(
+            sorted(SpreadsheetCell.objects.filter(spreadsheet=self.sheet).values_list('row', 'content', 'revision')),
+            [(0, '2', self.sheet.revision), (1, '=A1*10', self.sheet.revision + 1), (2, 'x', self.sheet.revision + 1)],
+        )
+
+    def test_writes_are_conditional_on_the_expected_revision(self):
+        self.update([((0, 0), 'a')])
+        self.sheet.refresh_from_db()
+        seen = self.sheet.revision
+        self.update([((0, 0), 'b')])
+        body = self.update([((0, 0), 'c'), ((5, 5), 'd')], expected=seen)
+        self.assertIn("Cells changed since revision", body['errors'][0]['message'])
+        self.assertEqual(list(SpreadsheetCell.objects.filter(spreadsheet=self.sheet).values_list('content', flat=True)), ['b'])
+        # Cells written after that revision don't conflict with others.
+        body = self.update([((5, 5), 'd')], expected=seen)
+        self.assertNotIn('errors', body)
+
+    def test_large_batches_are_refused(self):
+        with self.settings(UPDATE_CELLS_MAX=2):
+            body = self.update([((row, 0), 'x') for row in range(3)])
+        self.assertIn("At most 2 cells", body['errors'][0]['message'])
+        self.assertFalse(SpreadsheetCell.objects.filter(spreadsheet=self.sheet).exists())
+
+
+# ---------------------------------------------------------------------------
+# Cross-sheet references (user-010)
+# ---------------------------------------------------------------------------
+
+class ReferenceTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.workspace = self.make_workspace(self.user, 'Team', sheets=2)
+        self.sheet, self.other = self.workspace.spreadsheets.order_by('created_at')
+
+    def references(self):
+        return sorted(CellReference.objects.filter(spreadsheet=self.sheet).values_list('row', 'column', 'name'))
+
+    def test_references_follow_cell_writes(self):
+        storage.write_cells(self.sheet.id, {(0, 0): "=['Budget']", (1, 0): '=A1+1', (2, 1): "=[Totals]"})
+        self.assertEqual(self.references(), [(0, 0, 'Budget'), (2, 1, 'Totals')])
+        storage.write_cells(self.sheet.id, {(0, 0): "=['Plan']", (2, 1): ''})
+        self.assertEqual(self.references(), [(0, 0, 'Plan')])
+
+    def test_large_writes_replace_references_too(self):
+        writes = {(row, 0): "=['Budget']" for row in range(references.POSITION_FILTER_MAX + 1)}
+        storage.write_cells(self.sheet.id, {(500, 0): "=['Kept']"})
+        storage.write_cells(self.sheet.id, writes)
+        storage.write_cells(self.sheet.id, {position: '1' for position in writes})
+        self.assertEqual(self.references(), [(500, 0, 'Kept')])
+
+    def test_the_index_resolves_names_within_the_workspace(self):
+        Spreadsheet.objects.create(workspace=self.make_workspace(self.user, 'Elsewhere'), name='Budget')
+        index = references.ReferenceIndex(self.workspace.id)
+        self.assertEqual(index.resolve(self.other.name.upper()), self.other)
+        self.assertEqual(index.resolve_many(['Budget', self.sheet.name]), {'Budget': None, self.sheet.name: self.sheet})
+
+
+# ---------------------------------------------------------------------------
+# Export formats (user-012)
+# ---------------------------------------------------------------------------
+
+class ExportWriterTests(SimpleTestCase):
+    sheet = SimpleNamespace(name='Q1: Plan/Actual')
+    rows = [(0, 0, '1.5'), (0, 2, 'a "b" <c>'), (1, 27, 'x,y'), (2, 0, 'héllo')]
+
+    def write(self, format):
+        entry = io.BytesIO()
+        writer = export_writers.get_writer(format)
+        for _ in writer.write(entry, self.sheet, export_writers.chunked(self.rows, 2)):
+            pass
+        return entry.getvalue()
+
+    def test_txt(self):
+        self.assertEqual(self.write('txt').decode(), (
+            "Spreadsheet Name: Q1: Plan/Actual\n\n"
+            "Cell (0,0): 1.5\nCell (0,2): a \"b\" <c>\nCell (1,27): x,y\nCell (2,0): héllo\n"
+        ))
+
+    def test_csv(self):
+        records = list(csv.reader(io.StringIO(self.write('csv').decode())))
+        self.assertEqual(records, [['row', 'column', 'content']] + [[str(r), str(c), v] for r, c, v in self.rows])
+
+    def test_xlsx(self):
+        with zipfile.ZipFile(io.BytesIO(self.write('xlsx'))) as workbook:
+            self.assertIn('name="Q1_ Plan_Actual"', workbook.read('xl/workbook.xml').decode())
+            sheet = ElementTree.fromstring(workbook.read('xl/worksheets/sheet1.xml'))
+        ns = {'s': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+        cells = {
+            cell.get('r'): cell.findtext('s:v', namespaces=ns) or cell.findtext('s:is/s:t', namespaces=ns)
+            for cell in sheet.iterfind('s:sheetData/s:row/s:c', ns)
+        }
+        self.assertEqual(cells, {'A1': '1.5', 'C1': 'a "b" <c>', 'AB2': 'x,y', 'A3': 'héllo'})
+        self.assertEqual([row.get('r') for row in sheet.iterfind('s:sheetData/s:row', ns)], ['1', '2', '3'])
+
+    def test_npz(self):
+        found = []
+        with zipfile.ZipFile(io.BytesIO(self.write('npz'))) as archive:
+            for index in range(2):
+                rows, columns, offsets, data = (
+                    np.lib.format.read_array(io.BytesIO(archive.read(f"{name}.{index}.npy")))
+                    for name in ('row', 'column', 'offsets', 'data')
+                )
+                self.assertEqual(rows.dtype, np.int32)
+                content = data.tobytes()
+                found.extend(
+                    (int(row), int(column), content[start:end].decode())
+                    for row, column, start, end in zip(rows, columns, offsets[:-1], offsets[1:])
+                )
+        self.assertEqual(found, self.rows)
+
+    @skipUnless(export_writers.pa is not None, "pyarrow is not installed")
+    def test_arrow(self):
+        table = export_writers.pa.ipc.open_stream(self.write('arrow')).read_all()
+        self.assertEqual(list(zip(*(table.column(name).to_pylist() for name in ('row', 'column', 'content')))), self.rows)
+
+    def test_formats(self):
+        self.assertEqual(export_writers.resolve_format(None), 'txt')
+        self.assertEqual(export_writers.resolve_format('columnar'), 'arrow' if export_writers.pa is not None else 'npz')
+        with self.assertRaisesMessage(ValueError, "Unknown export format: pdf"):
+            export_writers.resolve_format('PDF')
+
+
+# ---------------------------------------------------------------------------
+# Parsed documents and persisted queries (user-016)
+# ---------------------------------------------------------------------------
+
+class PersistedQueryTests(GraphQLTestCase):
+    query = "query { currentUser { username } }"
+
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.client = Client(HTTP_AUTHORIZATION=f"JWT {get_token(self.user)}")
+
+    def send(self, digest, query=None):
+        extensions = {'persistedQuery': {'version': 1, 'sha256Hash': digest}}
+        return self.client.post(
+            '/graphql', json.dumps({'query': query, 'extensions': extensions}), content_type='application/json',
+        ).json()
+
+    def test_unknown_hashes_are_registered_by_the_retry(self):
+        digest = documents.query_hash(self.query)
+        body = self.send(digest)
+        self.assertEqual(body['errors'][0]['message'], "PersistedQueryNotFound")
+        self.assertEqual(body['errors'][0]['extensions']['code'], 'PERSISTED_QUERY_NOT_FOUND')
+
+        body = self.send(digest, self.query)
+        self.assertEqual(body['data']['currentUser']['username'], 'alice')
+        body = self.send(digest.upper())
+        self.assertEqual(body['data']['currentUser']['username'], 'alice')
+
+    def test_the_hash_must_match_the_query(self):
+        body = self.send(documents.query_hash("query { other }"), self.query)
+        self.assertEqual(body['errors'][0]['message'], "provided sha does not match query")
+
+    def test_documents_are_parsed_once(self):
+        cached = documents.DocumentCache(max_size=1)
+        schema = graphene_settings.SCHEMA.graphql_schema
+        first = cached.get(schema, self.query)
+        self.assertIs(cached.get(schema, self.query), first)
+        cached.get(schema, "query { currentUser { id } }")
+        self.assertIsNot(cached.get(schema, self.query), first)
+        self.assertEqual((cached.hits, cached.misses), (1, 3))
+
+
+# ---------------------------------------------------------------------------
+# Token cache (user-018)
+# ---------------------------------------------------------------------------
+
+class TokenCacheTests(GraphQLTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = self.make_user('alice')
+        self.token = get_token(self.user)
+
+    def test_repeated_tokens_skip_the_user_lookup(self):
+        self.assertEqual(auth.user_for_token(self.token), self.user)
+        with self.assertNumQueries(0):
+            cached = auth.user_for_token(self.token)
+        self.assertEqual(cached, self.user)
+        # A fresh instance each time.
+        self.assertIsNot(cached, auth.user_for_token(self.token))
+
+    def test_saving_the_user_evicts_their_tokens(self):
+        auth.user_for_token(self.token)
+        self.user.is_active = False
+        self.user.save()
+        with self.assertRaises(JSONWebTokenError):
+            auth.user_for_token(self.token)
+        body = self.post(self.user, "query { currentUser { username } }")
+        self.assertIsNone(body['data']['currentUser'])
+
+    def test_entries_expire_and_are_bounded(self):
+        tokens = auth.TokenCache(max_size=2, ttl=60)
+        users = [self.make_user(f"user{n}") for n in range(3)]
+        for n, user in enumerate(users):
+            tokens.set(f"token{n}", user)
+        self.assertIsNone(tokens.get('token0'))
+        self.assertEqual(tokens.get('token2'), users[2])
+        tokens.set('expired', users[0], expires=time.time() - 1)
+        self.assertIsNone(tokens.get('expired'))
+
+
+# ---------------------------------------------------------------------------
+# Bulk provisioning (user-019)
+# ---------------------------------------------------------------------------
+
+class ProvisioningTests(TestCase):
+    def test_runs_resume_from_the_checkpoint_and_skip_existing_usernames(self):
+        User.objects.create_user('carol')
+        roster = ['username,email,password', 'alice,,', 'bob,,', 'carol,,', 'dave,d1@example.com,',
+                  'dave,d2@example.com,', ',nobody@example.com,', 'erin,,']
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'roster.csv')
+            with open(path, 'w') as f:
+                f.write('\n'.join(roster) + '\n')
+            checkpoint = f"{path}.progress"
+            # An earlier run got through alice and bob, then stopped.
+            provisioning.write_checkpoint(checkpoint, provisioning.ProvisionResult(processed=2))
+            out, err = io.StringIO(), io.StringIO()
+            call_command('provision_users', path, batch_size=2, workers=1, stdout=out, stderr=err)
+            self.assertEqual(provisioning.read_checkpoint(checkpoint), 7)
+
+        self.assertIn("Resuming after 2 records", out.getvalue())
+        self.assertIn("Created 2 users; skipped 3 of 5 records.", out.getvalue())
+        self.assertIn("Record 6: missing username", err.getvalue())
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)), ['carol', 'dave', 'erin'])
+        # A roster's duplicates keep their first record.
+        self.assertEqual(User.objects.get(username='dave').email, 'd1@example.com')
+        for username in ('dave', 'erin'):
+            membership = WorkspaceMembership.objects.get(user__username=username)
+            self.assertEqual(membership.role, WorkspaceMembership.Role.ADMIN)
+            self.assertEqual(membership.workspace.owner.username, username)
+        self.assertFalse(WorkspaceMembership.objects.filter(user__username='carol').exists())
+
+
+# ---------------------------------------------------------------------------
+# Synthetic load-test data (user-020)
+# ---------------------------------------------------------------------------
+
+class SyntheticDataTests(TestCase):
+    def setUp(self):
+        # A script beside manage.py rather than part of the app.
+        import seed_megacrop
+        self.seed = seed_megacrop
+
+    def test_cells_are_repeatable_and_formulas_only_read_cells_above(self):
+        cells = self.seed.synthetic_cells(random.Random(7), 50, 6, 0.5, 0.2)
+        self.assertEqual(cells, self.seed.synthetic_cells(random.Random(7), 50, 6, 0.5, 0.2))
+        self.assertTrue(0.35 < len(cells) / (50 * 6) < 0.65)
+        formulas = {key: content for key, content in cells.items() if content.startswith('=')}
+        self.assertTrue(formulas)
+        self.assertFalse(any(row == 0 for row, _ in formulas))
+        # Full density and no formulas: every cell, all plain values.
+        plain = self.seed.synthetic_cells(random.Random(7), 20, 4, 1, 0)
+        self.assertEqual(len(plain), 20 * 4)
+        self.assertFalse(any(content.startswith('=') for content in plain.values()))
+
+    def test_seeding_creates_users_workspaces_and_sheets(self):
+        with mock.patch('builtins.print'):
+            self.seed.seed_synthetic(4, sheets_per_workspace=2, members_per_workspace=2, rows=5, columns=3,
+                                     density=1, formula_ratio=0, storage_backend='TILES', prefix='t')
+        self.assertEqual(User.objects.filter(username__startswith='t.').count(), 4)
+        self.assertEqual(Workspace.objects.count(), 4)
+        for workspace in Workspace.objects.all():
+            roles = dict(workspace.workspacemembership_set.values_list('user_id', 'role'))
+            self.assertEqual(roles.pop(workspace.owner_id), WorkspaceMembership.Role.ADMIN)
+            self.assertEqual(len(roles), 2)
+        sheets = Spreadsheet.objects.all()
+        self.assertEqual(len(sheets), 8)
+        self.assertTrue(all(sheet.storage == 'TILES' for sheet in sheets))
+        self.assertEqual(len(storage.load_cells([sheets[0].id])[sheets[0].id]), 15)
+        self.assertTrue(User.objects.get(username='t.user0').check_password('loadtest'))
+        with self.assertRaises(SystemExit):
+            self.seed.seed_synthetic(1, prefix='t')
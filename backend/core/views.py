@@ -1,13 +1,24 @@
-from django.http import JsonResponse, HttpResponse
+from django.db import connection, transaction
+from django.http import FileResponse, JsonResponse, HttpResponse, HttpResponseNotAllowed, HttpResponseNotModified, StreamingHttpResponse
+from django.urls import reverse
+from django.utils.cache import patch_vary_headers
 from django.views.decorators.csrf import csrf_exempt
 from django.contrib.auth.decorators import login_required
-from .models import Workspace, Spreadsheet, SpreadsheetCell
+from django.views.decorators.http import require_GET, require_POST
+from .models import Spreadsheet, Workspace, WorkspaceMembership
+from . import cell_imports, exports
+from .export_writers import resolve_format
 from ctf_challenge.schema import schema
+from graphene_django.constants import MUTATION_ERRORS_FLAG
+from graphene_django.settings import graphene_settings
+from graphene_django.views import GraphQLView as BaseGraphQLView, HttpError
+from graphql import ExecutionResult, GraphQLError, OperationType, get_operation_ast
 from graphql.execution import execute
+from . import costs, documents, metrics, responses, routing
+from .loaders import request_loaders
+from .permissions import spreadsheet_workspace_id
 import json
-import re
-import zipfile
-import io
+from functools import wraps
 
 @csrf_exempt
 def internal_graphql_view(request):
@@ -23,67 +34,268 @@ def internal_graphql_view(request):
     else:
         return JsonResponse({'error': 'Method not allowed'}, status=405)
 
+    try:
+        document, validation_errors = documents.get_document(schema.graphql_schema, query)
+    except GraphQLError as e:
+        return JsonResponse({'data': None, 'errors': [str(e)]})
+    if validation_errors:
+        return JsonResponse({'data': None, 'errors': [str(e) for e in validation_errors]})
+
+    cost = _check_cost(request, document)
+    if isinstance(cost, JsonResponse):
+        return cost
+
     # We execute the query with a blank context, bypassing all authentication
     # and permission checks that rely on info.context.user
-    result = schema.execute(query)
+    result = documents.execute_document(schema.graphql_schema, document)
 
     response_data = {'data': result.data}
     if result.errors:
         response_data['errors'] = [str(e) for e in result.errors]
+    if cost is not None:
+        response_data['extensions'] = {'cost': cost}
 
     return JsonResponse(response_data)
 
-@login_required
-def data_export_view(request, workspace_id):
+def _check_cost(request, document):
+    # The cost report for internal_graphql_view, or the response rejecting it.
+    report, error = costs.check(schema.graphql_schema, document, identity=costs.request_identity(request))
+    if error is not None:
+        return JsonResponse({'data': None, 'errors': [str(error)], 'extensions': {'cost': report}})
+    return report
+
+
+class GraphQLView(BaseGraphQLView):
+    """
+    GraphQLView that takes its documents from the parsed-document cache and
+    accepts persisted queries (see core/documents.py), serves spreadsheet
+    reads from the response cache with ETags (see core/responses.py), and
+    analyzes each operation's cost before running it (see core/costs.py),
+    rejecting operations over the limits and reporting the cost in the
+    response's extensions. Queries read from a database replica (see
+    core/routing.py).
+    """
+
+    def execute_graphql_request(self, request, data, query, variables, operation_name, show_graphiql=False):
+        graphql_schema = self.schema.graphql_schema
+        try:
+            query = documents.resolve_query(query, request.GET.get('extensions') or data.get('extensions'))
+            if not query:
+                # The parent renders GraphiQL or rejects the request.
+                return super().execute_graphql_request(request, data, query, variables, operation_name, show_graphiql)
+            document, validation_errors = documents.get_document(graphql_schema, query)
+        except GraphQLError as e:
+            return ExecutionResult(errors=[e])
+
+        operation_ast = get_operation_ast(document, operation_name)
+        if request.method.lower() == 'get' and operation_ast and operation_ast.operation != OperationType.QUERY:
+            if show_graphiql:
+                return None
+            raise HttpError(HttpResponseNotAllowed(
+                ['POST'], f"Can only perform a {operation_ast.operation.value} operation from a POST request.",
+            ))
+        if validation_errors:
+            return ExecutionResult(data=None, errors=validation_errors)
+
+        # Queries read from a replica, mutations from the primary.
+        read_only = operation_ast is not None and operation_ast.operation == OperationType.QUERY
+        with routing.route(request, read_only):
+            return self._execute(request, query, document, operation_ast, variables, operation_name)
+
+    def _execute(self, request, query, document, operation_ast, variables, operation_name):
+        graphql_schema = self.schema.graphql_schema
+        response_key = responses.cache_key(request, query, document, operation_name, variables)
+        if response_key is not None:
+            cached = responses.get(response_key)
+            if cached is not None:
+                # Served without executing, so not charged to the cost budget.
+                request._graphql_etag, data = cached
+                return ExecutionResult(data=data)
+
+        report, error = costs.check(graphql_schema, document, operation_name, variables, costs.request_identity(request))
+        request._graphql_cost = report
+        if error is not None:
+            return ExecutionResult(errors=[error])
+
+        try:
+            options = {
+                'root_value': self.get_root_value(request),
+                'variable_values': variables,
+                'operation_name': operation_name,
+                'context_value': self.get_context(request),
+                'middleware': self.get_middleware(request),
+                'execution_context_class': self.execution_context_class,
+            }
+            if (
+                operation_ast
+                and operation_ast.operation == OperationType.MUTATION
+                and (
+                    graphene_settings.ATOMIC_MUTATIONS is True
+                    or connection.settings_dict.get('ATOMIC_MUTATIONS', False) is True
+                )
+            ):
+                with transaction.atomic():
+                    result = documents.execute_document(graphql_schema, document, **options)
+                    if getattr(request, MUTATION_ERRORS_FLAG, False) is True:
+                        transaction.set_rollback(True)
+                return result
+            result = documents.execute_document(graphql_schema, document, **options)
+        except Exception as e:
+            return ExecutionResult(errors=[e])
+        if response_key is not None and not result.errors:
+            request._graphql_etag = responses.store(response_key, result.data)
+        return result
+
+    def dispatch(self, request, *args, **kwargs):
+        response = super().dispatch(request, *args, **kwargs)
+        etag = getattr(request, '_graphql_etag', None)
+        if etag is not None and response.status_code == 200:
+            # Conditional POSTs can't be answered with a 304; GETs (such as
+            # Apollo's hashed persisted queries) can.
+            if request.method == 'GET' and responses.etag_matches(request, etag):
+                response = HttpResponseNotModified()
+            response['ETag'] = etag
+            response['Cache-Control'] = 'private, no-cache'
+            patch_vary_headers(response, ['Authorization'])
+        return response
+
+    def json_encode(self, request, d, pretty=False):
+        cost = getattr(request, '_graphql_cost', None)
+        if cost is not None:
+            d = dict(d, extensions={'cost': cost})
+        return super().json_encode(request, d, pretty)
+
+
+def export_view(view):
+    """
+    Resolve the workspace (which the user must be a member of) and the
+    requested ?format= before calling `view(request, workspace, format, ...)`.
+    """
+    @wraps(view)
+    def wrapper(request, workspace_id, *args, **kwargs):
+        try:
+            workspace = Workspace.objects.get(id=workspace_id, members=request.user)
+        except Workspace.DoesNotExist:
+            return HttpResponse("Workspace not found or access denied.", status=403)
+        try:
+            format = resolve_format(request.GET.get('format'))
+        except ValueError as e:
+            return HttpResponse(str(e), status=400)
+        return view(request, workspace, format, *args, **kwargs)
+    return login_required(wrapper)
+
+
+@routing.read_only_view
+@export_view
+def data_export_view(request, workspace, format):
     """
     VULNERABILITY 1: Leaky Data Export
     This view generates a zip file of workspace data but leaks referenced
     spreadsheet UUIDs from other tenants in a metadata log file.
     """
-    user = request.user
-    try:
-        workspace = Workspace.objects.get(id=workspace_id, members=user)
-    except Workspace.DoesNotExist:
-        return HttpResponse("Workspace not found or access denied.", status=403)
-
-    spreadsheets = Spreadsheet.objects.filter(workspace=workspace)
-    export_log = []
-
-    zip_buffer = io.BytesIO()
-    with zipfile.ZipFile(zip_buffer, "a", zipfile.ZIP_DEFLATED, False) as zip_file:
-        for sheet in spreadsheets:
-            sheet_data = f"Spreadsheet Name: {sheet.name}\n\n"
-            cells = SpreadsheetCell.objects.filter(spreadsheet=sheet).order_by('row', 'column')
-            for cell in cells:
-                sheet_data += f"Cell ({cell.row},{cell.column}): {cell.content}\n"
-                
-                # Check for cross-sheet references
-                match = re.search(r"=\['?(.*?)'?\]", cell.content)
-                if match:
-                    referenced_name = match.group(1)
-                    # The vulnerability: it resolves the name globally, not just within the tenant.
-                    referenced_sheet = Spreadsheet.objects.filter(name__iexact=referenced_name).first()
-                    log_entry = {
-                        "timestamp": "...",
-                        "source_doc_id": str(sheet.id),
-                        "source_doc_name": sheet.name,
-                        "referenced_name": referenced_name,
-                        "status": "NOT_FOUND"
-                    }
-                    if referenced_sheet:
-                        # Even if access is denied, we log the resolved UUID. This is the leak.
-                        log_entry["referenced_doc_id"] = str(referenced_sheet.id)
-                        log_entry["status"] = "ACCESS_DENIED" if referenced_sheet.workspace != workspace else "OK"
-                    
-                    export_log.append(log_entry)
-
-            zip_file.writestr(f"{sheet.name.replace(' ', '_')}.txt", sheet_data)
-        
-        # Add the leaky log file to the zip
-        zip_file.writestr("export_log.json", json.dumps(export_log, indent=2))
-
-    zip_buffer.seek(0)
-    response = HttpResponse(zip_buffer, content_type="application/zip")
+    # Serve the archive of an earlier job if the workspace hasn't changed since.
+    path = exports.get_jobs().cached(workspace, format)
+    response = _archive_response(workspace, path) if path is not None else None
+    if response is not None:
+        return response
+
+    response = StreamingHttpResponse(exports.stream_workspace_export(workspace, format), content_type="application/zip")
     response['Content-Disposition'] = f'attachment; filename=export_{workspace.name}.zip'
     return response
 
+
+def _archive_response(workspace, path):
+    # None if the archive was pruned since it was found (see ExportJobs._prune).
+    try:
+        archive = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    return FileResponse(
+        archive, as_attachment=True, filename=f"export_{workspace.name}.zip", content_type="application/zip",
+    )
+
+
+def _job_status(workspace, revision, format):
+    status, error = exports.get_jobs().status(workspace, revision, format)
+    data = {"workspace": str(workspace.id), "revision": revision, "format": format, "status": status}
+    if status == exports.DONE:
+        data["download"] = f"{reverse('export_job_download', args=[workspace.id, revision])}?format={format}"
+    if error:
+        data["error"] = error
+    return JsonResponse(data)
+
+
+@require_POST
+@export_view
+def export_job_start_view(request, workspace, format):
+    """Start exporting the workspace in the background."""
+    revision = exports.get_jobs().start(workspace, format)
+    return _job_status(workspace, revision, format)
+
+
+@require_GET
+@export_view
+def export_job_status_view(request, workspace, format, revision):
+    return _job_status(workspace, revision, format)
+
+
+@require_GET
+@export_view
+def export_job_download_view(request, workspace, format, revision):
+    response = _archive_response(workspace, exports.get_jobs().artifact_path(workspace.id, revision, format))
+    if response is None:
+        return HttpResponse("Export not ready.", status=404)
+    return response
+
+
+@require_GET
+def metrics_view(request):
+    """This process's metrics in the Prometheus text format, for staff and scrapers."""
+    if not metrics.scraper_allowed(request):
+        user = responses.request_user(request)
+        if user is None or not user.is_staff:
+            return HttpResponse("Metrics are restricted to staff and configured scrapers.", status=403)
+    return HttpResponse(metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+@csrf_exempt
+@require_POST
+@routing.primary_view
+def cell_import_view(request, spreadsheet_id):
+    """
+    Import a CSV or TSV into the sheet: the request body, or the "file" of a
+    multipart upload. ?format= (csv or tsv) defaults to the upload's content
+    type or name; ?row= and ?column= give the cell the first field goes to.
+    """
+    # Exempt from CSRF checks, so the session doesn't count: a cross-site
+    # form carries the cookie, but can't send an Authorization header.
+    user = responses.request_user(request, session=False)
+    if user is None:
+        return JsonResponse({'error': "Authentication required: send a JWT Authorization header."}, status=401)
+    try:
+        workspace_id = spreadsheet_workspace_id(spreadsheet_id)
+    except Spreadsheet.DoesNotExist:
+        return JsonResponse({'error': "Spreadsheet not found."}, status=404)
+    role = request_loaders(request).memberships.load((user.pk, workspace_id))
+    if role is None:
+        return JsonResponse({'error': "You are not a member of this workspace."}, status=403)
+    if role not in [WorkspaceMembership.Role.ADMIN, WorkspaceMembership.Role.EDITOR]:
+        return JsonResponse({'error': "You don't have permission to edit this spreadsheet."}, status=403)
+
+    if request.content_type == 'multipart/form-data':
+        upload = request.FILES.get('file')
+        if upload is None:
+            return JsonResponse({'error': "No file uploaded."}, status=400)
+        content_type, filename = upload.content_type, upload.name
+    else:
+        # Read straight from the request, never holding the whole body.
+        upload, content_type, filename = request, request.content_type, None
+    try:
+        format = cell_imports.resolve_format(request.GET.get('format'), content_type, filename)
+        origin = (int(request.GET.get('row', 0)), int(request.GET.get('column', 0)))
+        if min(origin) < 0:
+            raise ValueError("row and column must not be negative.")
+        result = cell_imports.import_cells(spreadsheet_id, cell_imports.text_stream(upload), format, origin)
+    except (cell_imports.CellImportError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    return JsonResponse(dict(result.as_dict(), spreadsheet=str(spreadsheet_id), format=format))
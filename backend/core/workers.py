@@ -0,0 +1,216 @@
+"""
+Worker threads for requests served over ASGI.
+
+Under ASGI, Django runs each request's sync code on a thread started for that
+request, and each sync middleware on another hop to it. Database connections
+belong to threads, so every request opens a new connection, and with
+CONN_MAX_AGE set the finished thread's connection stays open until it is
+garbage collected; nothing bounds how many exist.
+
+ASGIHandler runs the middleware and view of each request, as one sync call,
+on a fixed pool of settings.ASGI["WORKER_THREADS"] threads instead. Each
+thread keeps its database connection across requests, subject to
+CONN_MAX_AGE and CONN_HEALTH_CHECKS, so a process holds at most that many
+connections, and a slow request (an IMPORT_CSV fetch, an export) occupies one
+thread while the event loop goes on serving the rest.
+
+Streaming responses (exports) are produced on the worker thread too, since
+their queries need its connection, and handed to the event loop a chunk at a
+time through a bounded buffer; ASGIHandler sends them as they come.
+
+The pool is only used once enable() has been called, which asgi.py does;
+under WSGI (runserver) nothing changes.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers import asgi
+from django.db import close_old_connections
+from django.http import FileResponse, StreamingHttpResponse
+
+DEFAULTS = {
+    # 0 leaves requests on Django's per-request threads.
+    'WORKER_THREADS': 16,
+    # Chunks of a streaming response the worker may produce ahead of the client.
+    'STREAM_BUFFER_CHUNKS': 16,
+}
+
+
+def _options():
+    return dict(DEFAULTS, **getattr(settings, 'ASGI', {}))
+
+
+_enabled = False
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def enable():
+    """Serve requests on the worker threads (call before creating the ASGIHandler)."""
+    global _enabled
+    _enabled = _options()['WORKER_THREADS'] > 0
+
+
+def get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(_options()['WORKER_THREADS'], thread_name_prefix='view-worker')
+        return _executor
+
+
+_END = object()
+
+
+class WorkerStream:
+    """
+    The body of a streaming response, produced by a worker thread and read
+    on the event loop. The worker is at most STREAM_BUFFER_CHUNKS chunks
+    ahead, and stops once the reader cancels.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue()
+        self.slots = threading.Semaphore(_options()['STREAM_BUFFER_CHUNKS'])
+        self.cancelled = False
+
+    def _put(self, item):
+        try:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, item)
+        except RuntimeError:
+            # The loop is gone; nobody is reading.
+            self.cancelled = True
+
+    def produce(self, response):
+        # Worker thread: iterate the response and close it, here, where its
+        # queries' connection lives.
+        try:
+            for chunk in response:
+                self.slots.acquire()
+                if self.cancelled:
+                    break
+                self._put(chunk)
+        except Exception as e:
+            self._put(e)
+        finally:
+            response.close()
+            self._put(_END)
+
+    def cancel(self):
+        self.cancelled = True
+        # Wake the worker if it is waiting for room.
+        self.slots.release()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        item = await self.queue.get()
+        if item is _END:
+            raise StopAsyncIteration
+        if isinstance(item, Exception):
+            raise item
+        self.slots.release()
+        return item
+
+
+class _Started:
+    # Hands the view's response from the worker thread to the waiting request.
+    def __init__(self, loop):
+        self.loop = loop
+        self.future = loop.create_future()
+
+    def _settle(self, method, value):
+        if not self.future.done():
+            method(value)
+
+    def result(self, response):
+        self.loop.call_soon_threadsafe(self._settle, self.future.set_result, response)
+
+    def error(self, exception):
+        self.loop.call_soon_threadsafe(self._settle, self.future.set_exception, exception)
+
+
+def _streamed(response, stream):
+    # The response the event loop sends: the view's headers, and its body
+    # from `stream`.
+    streamed = StreamingHttpResponse(status=response.status_code)
+    for header, value in response.items():
+        streamed[header] = value
+    streamed.cookies = response.cookies
+    streamed.worker_stream = stream
+    return streamed
+
+
+def _call(view, request, args, kwargs, started, stream):
+    # Runs on a worker thread. The request_started/request_finished signals
+    # that recycle connections fire on Django's thread, not this one.
+    close_old_connections()
+    try:
+        try:
+            response = view(request, *args, **kwargs)
+        except Exception as e:
+            started.error(e)
+            return
+        if response.streaming and not isinstance(response, FileResponse):
+            started.result(_streamed(response, stream))
+            # Keeps this thread, and its connection, until the body is done.
+            stream.produce(response)
+        else:
+            started.result(response)
+    finally:
+        close_old_connections()
+
+
+async def run_in_worker(view, request, *args, **kwargs):
+    """Call a sync view (or handler) on a worker thread, in a copy of the current context."""
+    context = contextvars.copy_context()
+    loop = asyncio.get_running_loop()
+    started, stream = _Started(loop), WorkerStream(loop)
+    loop.run_in_executor(get_executor(), context.run, _call, view, request, args, kwargs, started, stream)
+    try:
+        return await started.future
+    except asyncio.CancelledError:
+        stream.cancel()
+        raise
+
+
+class ASGIHandler(asgi.ASGIHandler):
+    """
+    Django's ASGI handler, running each request's middleware and view on a
+    worker thread, and sending streaming bodies from that thread as they are
+    produced. (Django 4.1 iterates streaming bodies on the event loop, where
+    their queries aren't allowed.)
+    """
+
+    def load_middleware(self, is_async=False):
+        # On the worker threads the chain is called synchronously, in one hop.
+        super().load_middleware(is_async=is_async and not _enabled)
+
+    async def get_response_async(self, request):
+        if not _enabled:
+            return await super().get_response_async(request)
+        return await run_in_worker(self.get_response, request)
+
+    async def send_response(self, response, send):
+        stream = getattr(response, 'worker_stream', None)
+        if stream is None:
+            return await super().send_response(response, send)
+
+        async def send_with_body(message):
+            # Django sends the headers, an empty body and the closing message;
+            # the worker's chunks go in before the closing message.
+            if message['type'] == 'http.response.body' and not message.get('more_body'):
+                async for chunk in stream:
+                    if chunk:
+                        await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send(message)
+
+        try:
+            await super().send_response(response, send_with_body)
+        finally:
+            stream.cancel()
@@ -2,6 +2,10 @@
 ASGI config for ctf_challenge project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+HTTP goes to Django, whose requests run on worker threads (see
+core/workers.py); WebSocket connections to /graphql carry
+GraphQL subscriptions (see core/graphql_ws.py). Serve it with
+`python manage.py serve`.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -9,8 +13,29 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
-from django.core.asgi import get_asgi_application
+import django
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ctf_challenge.settings')
 
-application = get_asgi_application()
+django.setup(set_prefix=False)
+
+# Imported after setup: the schema pulls in the models.
+from core import workers  # noqa: E402
+from core.graphql_ws import graphql_ws_application  # noqa: E402
+from ctf_challenge.schema import schema  # noqa: E402
+
+# Before the handler loads its middleware.
+workers.enable()
+django_application = workers.ASGIHandler()
+websocket_application = graphql_ws_application(schema)
+
+
+async def application(scope, receive, send):
+    if scope['type'] == 'websocket':
+        if scope['path'].rstrip('/') == '/graphql':
+            await websocket_application(scope, receive, send)
+        else:
+            await receive()
+            await send({'type': 'websocket.close', 'code': 4404})
+        return
+    await django_application(scope, receive, send)
@@ -9,5 +9,8 @@ class Query(core.schema.Query, graphene.ObjectType):
 class Mutation(core.schema.Mutation, graphene.ObjectType):
     pass
 
-schema = graphene.Schema(query=Query, mutation=Mutation)
+class Subscription(core.schema.Subscription, graphene.ObjectType):
+    pass
+
+schema = graphene.Schema(query=Query, mutation=Mutation, subscription=Subscription)
 
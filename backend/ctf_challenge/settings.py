@@ -1,3 +1,5 @@
+import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -26,6 +28,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     "corsheaders.middleware.CorsMiddleware", # Move to the top
+    "core.metrics.MetricsMiddleware",
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -63,10 +66,37 @@ DATABASES = {
         'USER': 'postgres',
         'HOST': 'db',
         'PORT': 5432,
-        'PASSWORD': 'postgres'
+        'PASSWORD': 'postgres',
+        # Connections are kept per thread between requests, and checked
+        # before reuse after a restart of the database.
+        'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
     }
 }
 
+# Read replicas of the default database, e.g.
+# DB_REPLICA_HOSTS=replica-1,replica-2. GraphQL queries and exports read from
+# them; mutations, and the callers that just ran one, use the primary (see
+# core/routing.py)
+for n, host in enumerate(filter(None, os.environ.get('DB_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{n}'] = dict(DATABASES['default'], HOST=host.strip(), TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['core.routing.ReplicaRouter']
+
+REPLICA_ROUTING = {
+    "STICKY_SECONDS": int(os.environ.get("DB_REPLICA_STICKY_SECONDS", 5)),
+    # Shared by every process; see CACHES below.
+    "CACHE": "shared",
+}
+
+# Served over ASGI (`manage.py serve`), requests run on WORKER_THREADS threads
+# per process, each holding one persistent database connection (see
+# core/workers.py)
+ASGI = {
+    "WORKER_THREADS": int(os.environ.get("ASGI_WORKER_THREADS", 16)),
+    "STREAM_BUFFER_CHUNKS": 16,
+}
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator'},
@@ -85,6 +115,117 @@ USE_TZ = True
 STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Caching
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    # Entries every process must see at once: callers reading from the
+    # primary after a write (core/routing.py), and workspace roles
+    # (core/permissions.py). Kept in the primary database; create the table
+    # with `manage.py createcachetable`.
+    "shared": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "core_shared_cache",
+        "OPTIONS": {"MAX_ENTRIES": 100_000},
+    },
+}
+
+# The cache holding (user, workspace) roles, and the seconds they stay there
+# (core/permissions.py)
+PERMISSION_CACHE = "shared"
+PERMISSION_CACHE_TTL = 30
+
+# Cell storage backend for new spreadsheets: "ROWS" or "TILES" (core/storage.py)
+CELL_STORAGE_DEFAULT = "ROWS"
+
+# Sheet bounds: cells are written at rows 0 to SHEET_MAX_ROWS - 1 and columns
+# 0 to SHEET_MAX_COLUMNS - 1
+SHEET_MAX_ROWS = 1_048_576
+SHEET_MAX_COLUMNS = 16_384
+
+# updateCells limits: cells per mutation, rows per upsert statement
+UPDATE_CELLS_MAX = 50000
+BULK_WRITE_BATCH_SIZE = 5000
+
+# Bulk CSV/TSV imports (see core/cell_imports.py): cells written per chunk,
+# and whether PostgreSQL loads them with COPY
+CELL_IMPORT = {
+    "CHUNK_CELLS": 20000,
+    "MAX_ROWS": 1_000_000,
+    "MAX_COLUMNS": 1000,
+    "COPY": True,
+}
+
+# Largest page SpreadsheetType.cells returns for a windowed request
+CELLS_PAGE_MAX = 5000
+
+# IMPORT_CSV fetcher (see core/imports.py)
+IMPORT_CSV = {
+    "CACHE_TTL": 60,
+    "CACHE_MAX_ENTRIES": 1024,
+    "MAX_WORKERS": 8,
+    "TIMEOUT": 3,
+    "STALE_WHILE_REVALIDATE": True,
+}
+
+# Background export jobs; finished archives are cached in DIR (see core/exports.py)
+EXPORTS = {
+    "DIR": Path(tempfile.gettempdir()) / "ctf_exports",
+    "MAX_WORKERS": 2,
+}
+
+# GraphQL cost limits (see core/costs.py). Field weights are per returned
+# item; list sizes are the assumed length of list fields without `first`.
+GRAPHQL_COST = {
+    "MAX_COST": 50000,
+    "MAX_DEPTH": 10,
+    "MAX_BREADTH": 100,
+    "BUDGET_PER_MINUTE": 500000,
+    "DEFAULT_LIST_SIZE": 20,
+    "FIELD_WEIGHTS": {
+        "SpreadsheetType.cells": 2,
+        "SpreadsheetCellType.evaluatedContent": 5,
+        "CellResult.evaluatedContent": 5,
+    },
+    "LIST_SIZES": {},
+}
+
+# Parsed-document cache and persisted queries (see core/documents.py)
+GRAPHQL_DOCUMENTS = {
+    "CACHE_SIZE": 512,
+    "PERSISTED_QUERIES": True,
+    "PERSISTED_QUERY_TIMEOUT": 7 * 24 * 3600,
+}
+
+# Cached spreadsheetById responses (see core/responses.py). TIMEOUT bounds
+# how stale IMPORT_CSV results in a cached response may get.
+GRAPHQL_RESPONSE_CACHE = {
+    "ENABLED": True,
+    "TIMEOUT": 60,
+}
+
+# Request and resolver metrics, served at /metrics (see core/metrics.py) to
+# staff, to ALLOWED_IPS, and to scrapers sending "Authorization: Bearer
+# <TOKEN>". Set SLOW_TRACE_DIR to write detailed traces of slow sampled
+# requests there.
+METRICS = {
+    "ENABLED": True,
+    "MAX_SERIES": 1000,
+    "SLOW_TRACE_DIR": os.environ.get("METRICS_SLOW_TRACE_DIR") or None,
+    "SLOW_TRACE_THRESHOLD_MS": 1000,
+    "SLOW_TRACE_SAMPLE_RATE": 0.1,
+    "TOKEN": os.environ.get("METRICS_TOKEN") or None,
+    "ALLOWED_IPS": ["127.0.0.1", "::1"],
+}
+
+# Pub/sub backend behind GraphQL subscriptions (see core/pubsub.py). The local
+# backend only reaches subscribers in the same ASGI process.
+PUBSUB = {
+    "BACKEND": "core.pubsub.LocalPubSub",
+    "OPTIONS": {},
+}
+
 # Custom User Model
 AUTH_USER_MODEL = 'core.User'
 
@@ -93,6 +234,8 @@ GRAPHENE = {
     "SCHEMA": "ctf_challenge.schema.schema",
     "MIDDLEWARE": [
         "graphql_jwt.middleware.JSONWebTokenMiddleware",
+        # Last, so it is outermost and times authentication too.
+        "core.metrics.GraphQLMetricsMiddleware",
     ],
 }
 
@@ -102,8 +245,15 @@ GRAPHQL_JWT = {
     "JWT_LONG_RUNNING_REFRESH_TOKEN": True,
 }
 
+# Verified tokens -> user snapshots, per process (see core/auth.py). Entries
+# last until the token expires, and at most TTL seconds.
+JWT_USER_CACHE = {
+    "MAX_SIZE": 10000,
+    "TTL": 60,
+}
+
 AUTHENTICATION_BACKENDS = [
-    "graphql_jwt.backends.JSONWebTokenBackend",
+    "core.auth.CachedJSONWebTokenBackend",
     "django.contrib.auth.backends.ModelBackend",
 ]
 
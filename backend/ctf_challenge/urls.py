@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path
 from django.views.decorators.csrf import csrf_exempt
-from graphene_django.views import GraphQLView
-from core.views import internal_graphql_view, data_export_view
+from core.views import (
+    GraphQLView, internal_graphql_view, data_export_view,
+    export_job_start_view, export_job_status_view, export_job_download_view, metrics_view,
+    cell_import_view,
+)
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -12,5 +15,13 @@ urlpatterns = [
     path("internal-graphql", csrf_exempt(internal_graphql_view)),
     # Data export endpoint for the IDOR/leak challenge
     path("export/<uuid:workspace_id>", data_export_view, name="data_export"),
+    # Background export jobs, keyed by the workspace revision they export
+    path("export/<uuid:workspace_id>/jobs", export_job_start_view, name="export_job_start"),
+    path("export/<uuid:workspace_id>/jobs/<int:revision>", export_job_status_view, name="export_job_status"),
+    path("export/<uuid:workspace_id>/jobs/<int:revision>/download", export_job_download_view, name="export_job_download"),
+    # Bulk CSV/TSV import into a spreadsheet
+    path("spreadsheets/<uuid:spreadsheet_id>/import", cell_import_view, name="cell_import"),
+    # Prometheus metrics for this process
+    path("metrics", metrics_view, name="metrics"),
 ]
 
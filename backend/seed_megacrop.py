@@ -1,4 +1,8 @@
+import argparse
 import os
+import random
+import time
+
 import django
 import uuid
 
@@ -7,11 +11,14 @@ os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ctf_challenge.settings')
 django.setup()
 
 from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from core import storage
 from core.models import Workspace, WorkspaceMembership, Spreadsheet, SpreadsheetCell
 
 User = get_user_model()
 
-def run():
+def seed_megacorp():
     print("Seeding MegaCorp data...")
 
     # 1. Create MegaCorp Admin User
@@ -78,6 +85,124 @@ def run():
     print(f"Target Admin Email: {megacorp_admin.email}")
     print(f"Target Intern Email: {megacorp_intern.email}")
 
+
+# --- Synthetic data for load testing ---
+
+def column_name(column):
+    name = ''
+    column += 1
+    while column:
+        column, remainder = divmod(column - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+
+def synthetic_cells(rng, rows, columns, density, formula_ratio):
+    """{(row, column): content} for one sheet: numbers, labels and formulas over the cells above."""
+    cells = {}
+    for row in range(rows):
+        for column in range(columns):
+            if rng.random() >= density:
+                continue
+            if row > 0 and rng.random() < formula_ratio:
+                letter = column_name(column)
+                kind = rng.random()
+                if kind < 0.5:
+                    function = rng.choice(['SUM', 'AVERAGE', 'MIN', 'MAX', 'COUNT'])
+                    cells[(row, column)] = f"={function}({letter}1:{letter}{row})"
+                else:
+                    other = column_name(rng.randrange(columns))
+                    cells[(row, column)] = f"={letter}{rng.randint(1, row)}+{other}{rng.randint(1, row)}"
+            elif column == 0:
+                cells[(row, column)] = f"Item {row}"
+            else:
+                cells[(row, column)] = str(rng.randint(0, 100_000))
+    return cells
+
+
+def seed_synthetic(users, workspaces_per_user=1, sheets_per_workspace=2, members_per_workspace=2,
+                   rows=100, columns=10, density=0.5, formula_ratio=0.1, storage_backend='ROWS',
+                   prefix='load', password='loadtest', seed=1, batch_size=1000):
+    """
+    Fill the database with `users` users named <prefix>.user<n>, each owning
+    `workspaces_per_user` workspaces shared with `members_per_workspace`
+    other users, each holding `sheets_per_workspace` sheets of rows x columns
+    cells. Every user's password is `password`.
+    """
+    if User.objects.filter(username__startswith=f"{prefix}.").exists():
+        raise SystemExit(f"Users with the prefix '{prefix}.' already exist; pick another --prefix.")
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    # One hash for everyone: hashing dominates creating users and isn't what is being tested.
+    hashed = make_password(password)
+    width = len(str(users))
+    user_rows = [
+        User(username=f"{prefix}.user{n:0{width}d}", email=f"{prefix}.user{n:0{width}d}@example.com", password=hashed)
+        for n in range(users)
+    ]
+    workspace_rows = []
+    membership_rows = []
+    for owner in user_rows:
+        for n in range(workspaces_per_user):
+            workspace = Workspace(name=f"{owner.username} workspace {n}", owner=owner)
+            workspace_rows.append(workspace)
+            membership_rows.append(WorkspaceMembership(user=owner, workspace=workspace, role=WorkspaceMembership.Role.ADMIN))
+            others = [user for user in rng.sample(user_rows, min(members_per_workspace + 1, users)) if user is not owner]
+            for member in others[:members_per_workspace]:
+                role = rng.choice([WorkspaceMembership.Role.EDITOR, WorkspaceMembership.Role.VIEWER])
+                membership_rows.append(WorkspaceMembership(user=member, workspace=workspace, role=role))
+    sheet_rows = [
+        Spreadsheet(workspace=workspace, name=f"Sheet {n}", storage=storage_backend)
+        for workspace in workspace_rows for n in range(sheets_per_workspace)
+    ]
+    with transaction.atomic():
+        User.objects.bulk_create(user_rows, batch_size=batch_size)
+        Workspace.objects.bulk_create(workspace_rows, batch_size=batch_size)
+        WorkspaceMembership.objects.bulk_create(membership_rows, batch_size=batch_size)
+        Spreadsheet.objects.bulk_create(sheet_rows, batch_size=batch_size)
+    print(f"Created {len(user_rows)} users, {len(workspace_rows)} workspaces, "
+          f"{len(membership_rows)} memberships and {len(sheet_rows)} sheets.")
+
+    total = 0
+    for index, sheet in enumerate(sheet_rows, 1):
+        cells = synthetic_cells(rng, rows, columns, density, formula_ratio)
+        # Through the storage API, so tiles, revisions and the reference
+        # index come out as they would from the app.
+        storage.write_cells(sheet.id, cells)
+        total += len(cells)
+        if index % 100 == 0 or index == len(sheet_rows):
+            print(f"  {index}/{len(sheet_rows)} sheets filled ({total:,} cells)")
+    print(f"Synthetic data seeded in {time.perf_counter() - started:.1f}s.")
+
+
+def run(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Seed the MegaCorp challenge data and, with --users, synthetic data for load tests.",
+    )
+    parser.add_argument('--users', type=int, default=0, help="Synthetic users to create (default: none)")
+    parser.add_argument('--workspaces-per-user', type=int, default=1)
+    parser.add_argument('--sheets-per-workspace', type=int, default=2)
+    parser.add_argument('--members-per-workspace', type=int, default=2, help="Members besides the owner")
+    parser.add_argument('--rows', type=int, default=100)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--density', type=float, default=0.5, help="Fraction of cells filled")
+    parser.add_argument('--formula-ratio', type=float, default=0.1, help="Fraction of filled cells that are formulas")
+    parser.add_argument('--storage', choices=Spreadsheet.Storage.values, default=Spreadsheet.Storage.ROWS)
+    parser.add_argument('--prefix', default='load', help="Username prefix of the synthetic users")
+    parser.add_argument('--password', default='loadtest')
+    parser.add_argument('--seed', type=int, default=1, help="Random seed, for repeatable data")
+    parser.add_argument('--no-megacorp', action='store_true', help="Skip the MegaCorp challenge data")
+    args = parser.parse_args(argv)
+
+    if not args.no_megacorp:
+        seed_megacorp()
+    if args.users:
+        seed_synthetic(
+            args.users, args.workspaces_per_user, args.sheets_per_workspace, args.members_per_workspace,
+            args.rows, args.columns, args.density, args.formula_ratio, args.storage,
+            args.prefix, args.password, args.seed,
+        )
+
 if __name__ == '__main__':
     run()
 
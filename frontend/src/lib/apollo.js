@@ -1,10 +1,36 @@
-import { ApolloClient, InMemoryCache, createHttpLink, ApolloLink } from '@apollo/client';
+import { ApolloClient, InMemoryCache, createHttpLink, ApolloLink, split } from '@apollo/client';
 import { setContext } from '@apollo/client/link/context';
+import { createPersistedQueryLink } from '@apollo/client/link/persisted-queries';
+import { GraphQLWsLink } from '@apollo/client/link/subscriptions';
+import { getMainDefinition } from '@apollo/client/utilities';
+import { createClient } from 'graphql-ws';
+
+const GRAPHQL_ENDPOINT = process.env.REACT_APP_GRAPHQL_ENDPOINT || 'http://localhost:8000/graphql';
 
 const httpLink = createHttpLink({
-  uri: process.env.REACT_APP_GRAPHQL_ENDPOINT || 'http://localhost:8000/graphql',
+  uri: GRAPHQL_ENDPOINT,
 });
 
+// Subscriptions run over a WebSocket served by the ASGI app; the token is sent
+// with connection_init since browsers can't set headers on WebSockets.
+let socketConnected = false;
+const wsLink = new GraphQLWsLink(createClient({
+  url: process.env.REACT_APP_GRAPHQL_WS_ENDPOINT || GRAPHQL_ENDPOINT.replace(/^http/, 'ws'),
+  connectionParams: () => {
+    const token = localStorage.getItem('authToken');
+    return token ? { authorization: `JWT ${token}` } : {};
+  },
+  lazy: true,
+  on: {
+    connected: () => { socketConnected = true; },
+    closed: () => { socketConnected = false; },
+  },
+}));
+
+// Whether subscriptions are being delivered. Servers without the WebSocket
+// endpoint (manage.py runserver) never connect, so pages fall back to refetching.
+export const subscriptionsConnected = () => socketConnected;
+
 // This is the corrected auth link
 const authLink = setContext((_, { headers }) => {
   // Get the authentication token from local storage if it exists
@@ -19,7 +45,25 @@ const authLink = setContext((_, { headers }) => {
   }
 });
 
+// Send a hash in place of each query's text; the server asks for the text the
+// first time it sees a hash. Hashed queries go out as GETs so the browser can
+// revalidate cached sheet reads with their ETags. Web Crypto only exists in
+// secure contexts (https or localhost), so elsewhere queries are sent in full.
+const sha256 = async (query) => {
+  const digest = await window.crypto.subtle.digest('SHA-256', new TextEncoder().encode(query));
+  return Array.from(new Uint8Array(digest), (byte) => byte.toString(16).padStart(2, '0')).join('');
+};
+
+const httpLinks = window.crypto?.subtle
+  ? ApolloLink.from([createPersistedQueryLink({ sha256, useGETForHashedQueries: true }), authLink, httpLink])
+  : authLink.concat(httpLink);
+
+const isSubscription = ({ query }) => {
+  const definition = getMainDefinition(query);
+  return definition.kind === 'OperationDefinition' && definition.operation === 'subscription';
+};
+
 export const client = new ApolloClient({
-  link: authLink.concat(httpLink),
+  link: split(isSubscription, wsLink, httpLinks),
   cache: new InMemoryCache(),
 });
@@ -1,11 +1,12 @@
 import { useParams, Link } from 'react-router-dom';
-import { useQuery, useMutation, gql } from '@apollo/client';
+import { useQuery, useMutation, useSubscription, gql } from '@apollo/client';
 import { useState, useEffect } from 'react';
 import toast from 'react-hot-toast';
+import { subscriptionsConnected } from '../lib/apollo';
 import { ArrowUturnLeftIcon, UserPlusIcon, ArrowDownOnSquareIcon } from '@heroicons/react/24/outline';
 
 const GET_SPREADSHEET_DATA = gql`
-  query SpreadsheetById($id: UUID!) {
+  query SpreadsheetById($id: UUID!, $rowEnd: Int!, $columnEnd: Int!) {
     spreadsheetById(id: $id) {
       id
       name
@@ -13,7 +14,7 @@ const GET_SPREADSHEET_DATA = gql`
         id
         name
       }
-      cells {
+      cells(rowStart: 0, rowEnd: $rowEnd, columnStart: 0, columnEnd: $columnEnd) {
         id
         row
         column
@@ -36,6 +37,16 @@ const UPDATE_CELL = gql`
     }
 `;
 
+const CELL_CHANGED = gql`
+    subscription CellChanged($spreadsheetId: UUID!) {
+        cellChanged(spreadsheetId: $spreadsheetId) {
+            row
+            column
+            content
+            evaluatedContent
+        }
+    }
+`;
 
 const ROWS = 20;
 const COLS = 10;
@@ -47,7 +58,7 @@ export default function Spreadsheet() {
     const [inputValue, setInputValue] = useState('');
 
     const { loading, error, data, refetch } = useQuery(GET_SPREADSHEET_DATA, { 
-        variables: { id },
+        variables: { id, rowEnd: ROWS - 1, columnEnd: COLS - 1 },
         onCompleted: (d) => {
             const newCells = {};
             d.spreadsheetById.cells.forEach(cell => {
@@ -61,6 +72,21 @@ export default function Spreadsheet() {
         onError: (err) => toast.error(err.message),
     });
 
+    // Edits from anyone, including the formula cells they recompute, arrive here.
+    useSubscription(CELL_CHANGED, {
+        variables: { spreadsheetId: id },
+        onData: ({ data: { data: pushed } }) => {
+            if (!pushed?.cellChanged) return;
+            setCells(current => {
+                const next = { ...current };
+                pushed.cellChanged.forEach(cell => {
+                    next[`${cell.row}-${cell.column}`] = { content: cell.content, evaluated: cell.evaluatedContent };
+                });
+                return next;
+            });
+        },
+    });
+
     useEffect(() => {
         if (activeCell) {
             setInputValue(cells[activeCell]?.content || '');
@@ -72,13 +98,12 @@ export default function Spreadsheet() {
         
         const [row, col] = activeCell.split('-').map(Number);
         updateCell({ variables: { spreadsheetId: id, row, column: col, content: inputValue }})
-        .then(() => {
-            // Optimistically update UI
-            const newCells = { ...cells };
-            newCells[activeCell] = { ...newCells[activeCell], content: inputValue };
-            setCells(newCells);
+        .then(({ data: result }) => {
+            const evaluated = result?.updateCell?.cell?.evaluatedContent;
+            setCells(current => ({ ...current, [activeCell]: { content: inputValue, evaluated } }));
             toast.success('Cell updated!');
-            refetch(); // Refetch to get evaluated content
+            // Without the subscription, refetch to get the formula cells the edit recomputed.
+            if (!subscriptionsConnected()) refetch();
         });
     };
 